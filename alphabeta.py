@@ -0,0 +1,307 @@
+import time
+
+from basic_ai import ShatarAI, model_copier
+from evaluation import MATERIAL_EVALUATOR
+from shatar import DEMO_SEARCH_DEPTH
+from pieces import Pawn
+from transposition import TranspositionTable, EVALUATION, DEPTH_PREFERRED
+
+# Scores are from the point of view of the side to play, in MATERIAL_VALUE units. A mate scores MATE_SCORE
+# minus the number of plies it takes, so shorter mates are preferred and longer losses are put off.
+MATE_SCORE = 10000
+# any score further from 0 than this is a mate
+MATE_BOUND = MATE_SCORE - 1000
+INFINITY = MATE_SCORE + 1
+
+# what a transposition table score says about the real score
+EXACT = 0
+LOWER_BOUND = 1
+UPPER_BOUND = 2
+
+# move ordering: the table's best move, then captures by MVV-LVA, then killer moves, then the rest by history
+TT_MOVE_ORDER = 1 << 30
+CAPTURE_ORDER = 1 << 20
+PROMOTION_ORDER = 1 << 19
+KILLER_ORDER = 1 << 18
+# value of each piece for MVV-LVA, the King is worth the most as an attacker so it captures last
+ORDER_VALUES = {'P': 1, 'N': 3, 'B': 3, 'R': 5, 'Q': 7, 'K': 10}
+
+# how many nodes are searched between checks of the clock
+NODES_PER_TIME_CHECK = 1024
+
+
+def score_to_table(score, ply):
+    """ Mate scores count plies from the root, store them counting from the position instead """
+    if score > MATE_BOUND:
+        return score + ply
+    if score < -MATE_BOUND:
+        return score - ply
+    return score
+
+
+def score_from_table(score, ply):
+    """ Inverse of score_to_table """
+    if score > MATE_BOUND:
+        return score - ply
+    if score < -MATE_BOUND:
+        return score + ply
+    return score
+
+
+def is_promotion(model, move):
+    piece = model.board[move[0]][move[1]]
+    return isinstance(piece, Pawn) and move[2] == (7 if piece.white else 0)
+
+
+class AlphaBetaPlayer(ShatarAI):
+    """
+    AI that plays the best move of a negamax alpha-beta search. The search deepens one ply at a time up to
+    max_depth (or until the time limit), and each iteration starts with the best moves of the last one through
+    the transposition table. Quiet moves that caused a cutoff are tried early at the same ply (killer moves)
+    and anywhere else (history). At the leaves, captures and promotions are searched until the position is
+    quiet, so the material evaluation isn't taken in the middle of an exchange.
+
+    Games end by the rules in ShatarModel.is_game_over, so mates without a shak sequence or by a Knight, a side
+    down to its King and the capture clock all count as draws.
+
+    Attributes:
+        max_depth (int): deepest iteration to search
+        time_limit (float): seconds to think per move, or None to always finish max_depth
+        table (TranspositionTable): search results by position, depth preferred by default
+        nodes (int): positions searched for the last move
+        last_depth (int): deepest iteration finished for the last move
+        last_score (int): score of the last move for this player
+        evaluator (Evaluator): static evaluation at the leaves, material by default (see evaluation.py)
+    """
+
+    def __init__(self, white, max_depth=DEMO_SEARCH_DEPTH, time_limit=None, table=None, evaluator=None):
+        super().__init__(white)
+        if max_depth < 1:
+            raise ValueError("Alpha-beta search needs a depth of at least 1")
+        if table is None:
+            table = TranspositionTable(policy=DEPTH_PREFERRED)
+        if evaluator is None:
+            evaluator = MATERIAL_EVALUATOR
+        self.max_depth = max_depth
+        self.time_limit = time_limit
+        self.evaluator = evaluator
+        self.table = table
+        # ply: [up to two moves]
+        self.killers = {}
+        # move: score
+        self.history = {}
+        self.nodes = 0
+        self.last_depth = 0
+        self.last_score = 0
+        self.deadline = None
+        self.stopped = False
+
+    def get_move(self, model, time_limit=None):
+        if model.to_play is not self.white:
+            raise ValueError("Trying to play on wrong turn!")
+
+        if time_limit is None:
+            time_limit = self.time_limit
+        self.deadline = None if time_limit is None else time.time() + time_limit
+        self.stopped = False
+        self.nodes = 0
+        self.killers = {}
+        self.table.new_search()
+        # old history still helps ordering, but shouldn't outweigh what this search finds
+        self.history = {move: score // 2 for move, score in self.history.items() if score > 1}
+
+        # search a copy so that the caller's model is never left mid search
+        model = model_copier(model)
+        best_move = None
+        for depth in range(1, self.max_depth + 1):
+            move, score = self.search_root(model, depth)
+            if self.stopped:
+                break
+            best_move = move
+            self.last_depth = depth
+            self.last_score = score
+            if abs(score) > MATE_BOUND:
+                # a forced result was found, searching deeper won't change it
+                break
+
+        if best_move is None:
+            # out of time before the first iteration finished
+            moves = model.generate_legal_moves()
+            best_move = moves[0] if moves else None
+        return best_move
+
+    def search_root(self, model, depth):
+        """ One iteration of the search at the root
+
+        :return: (best move, its score), or (None, 0) if there are no moves
+        """
+        moves = self.order_moves(model, model.generate_legal_moves(), self.table_move(model), 0)
+        alpha = -INFINITY
+        best_move = None
+        for move in moves:
+            undo = model.make_move(move)
+            score = -self.negamax(model, depth - 1, -INFINITY, -alpha, 1)
+            model.unmake_move(undo)
+            if self.stopped:
+                return best_move, alpha
+            if score > alpha or best_move is None:
+                alpha = score
+                best_move = move
+
+        if best_move is not None:
+            self.table.put(hash(model), EVALUATION, (depth, score_to_table(alpha, 0), EXACT, best_move), depth=depth)
+        return best_move, alpha
+
+    def negamax(self, model, depth, alpha, beta, ply):
+        """ Score of the position for the side to play, searched to the given depth
+
+        :param model: ShatarModel, which is left as it was
+        :param depth: plies left before the quiescence search
+        :param alpha: score the side to play already has elsewhere
+        :param beta: score the other side already has elsewhere
+        :param ply: plies from the root
+        :return: (int) score, which is only a bound if it's outside of (alpha, beta)
+        """
+        if self.out_of_time():
+            return 0
+
+        result = model.is_game_over()
+        if result != 2:
+            return self.terminal_score(model, result, ply)
+        if depth <= 0:
+            return self.quiescence(model, alpha, beta, ply)
+
+        key = hash(model)
+        original_alpha = alpha
+        tt_move = None
+        entry = self.table.get(key, EVALUATION)
+        if entry is not None:
+            entry_depth, entry_score, bound, tt_move = entry
+            if entry_depth >= depth:
+                entry_score = score_from_table(entry_score, ply)
+                if bound == EXACT:
+                    return entry_score
+                elif bound == LOWER_BOUND:
+                    alpha = max(alpha, entry_score)
+                else:
+                    beta = min(beta, entry_score)
+                if alpha >= beta:
+                    return entry_score
+
+        best_score = -INFINITY
+        best_move = None
+        for move in self.order_moves(model, model.generate_legal_moves(), tt_move, ply):
+            undo = model.make_move(move)
+            score = -self.negamax(model, depth - 1, -beta, -alpha, ply + 1)
+            model.unmake_move(undo)
+            if self.stopped:
+                return 0
+
+            if score > best_score:
+                best_score = score
+                best_move = move
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                if undo[2] is None and not is_promotion(model, move):
+                    self.add_killer(move, ply)
+                    self.history[move] = self.history.get(move, 0) + depth * depth
+                break
+
+        if best_score <= original_alpha:
+            bound = UPPER_BOUND
+        elif best_score >= beta:
+            bound = LOWER_BOUND
+        else:
+            bound = EXACT
+        self.table.put(key, EVALUATION, (depth, score_to_table(best_score, ply), bound, best_move), depth=depth)
+        return best_score
+
+    def quiescence(self, model, alpha, beta, ply):
+        """ Score of the position once the captures and promotions have been played out """
+        if self.out_of_time():
+            return 0
+
+        result = model.is_game_over()
+        if result != 2:
+            return self.terminal_score(model, result, ply)
+
+        # the side to play doesn't have to capture, so it can always keep the current evaluation
+        best_score = self.evaluate(model)
+        if best_score >= beta:
+            return best_score
+        alpha = max(alpha, best_score)
+
+        board = model.board
+        noisy_moves = [move for move in model.generate_legal_moves()
+                       if board[move[2]][move[3]] is not None or is_promotion(model, move)]
+        for move in self.order_moves(model, noisy_moves, None, ply):
+            undo = model.make_move(move)
+            score = -self.quiescence(model, -beta, -alpha, ply + 1)
+            model.unmake_move(undo)
+            if self.stopped:
+                return 0
+
+            if score > best_score:
+                best_score = score
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                break
+        return best_score
+
+    def evaluate(self, model):
+        """ Static evaluation for the side to play """
+        evaluation = self.evaluator.evaluate(model)
+        return evaluation if model.to_play else -evaluation
+
+    def terminal_score(self, model, result, ply):
+        """ Score of a finished game for the side to play
+
+        :param result: is_game_over result, 1 if white won, -1 if black won, 0 if drawn
+        """
+        if result == 0:
+            return 0
+        if (result == 1) == model.to_play:
+            return MATE_SCORE - ply
+        return -MATE_SCORE + ply
+
+    def order_moves(self, model, moves, tt_move, ply):
+        """ Moves sorted so that the ones most likely to cause a cutoff come first """
+        board = model.board
+        killers = self.killers.get(ply, ())
+        history = self.history
+
+        def order(move):
+            if move == tt_move:
+                return TT_MOVE_ORDER
+            captured = board[move[2]][move[3]]
+            if captured is not None:
+                # most valuable victim, then least valuable attacker
+                attacker = board[move[0]][move[1]]
+                return CAPTURE_ORDER + 16 * ORDER_VALUES[captured.symbol.upper()] - \
+                    ORDER_VALUES[attacker.symbol.upper()]
+            if is_promotion(model, move):
+                return PROMOTION_ORDER
+            if move in killers:
+                return KILLER_ORDER
+            return min(history.get(move, 0), KILLER_ORDER - 1)
+
+        return sorted(moves, key=order, reverse=True)
+
+    def table_move(self, model):
+        entry = self.table.get(hash(model), EVALUATION)
+        return None if entry is None else entry[3]
+
+    def add_killer(self, move, ply):
+        killers = self.killers.setdefault(ply, [])
+        if move not in killers:
+            killers.insert(0, move)
+            del killers[2:]
+
+    def out_of_time(self):
+        """ Count a node and check the clock every NODES_PER_TIME_CHECK nodes """
+        self.nodes += 1
+        if self.deadline is not None and self.nodes % NODES_PER_TIME_CHECK == 0 and time.time() >= self.deadline:
+            self.stopped = True
+        return self.stopped
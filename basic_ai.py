@@ -1,25 +1,24 @@
-import math
+import multiprocessing
 import random
+import time
 
 # import numpy as np
 
-from shatar import ShatarModel
+# count_material_evaluation is imported so that callers can keep importing it from here
+from evaluation import count_material_evaluation, MATERIAL_EVALUATOR
+from playout import Playout, RANDOM_POLICY, CAPTURE_POLICY
+from selection import UCB1
+from transposition import TranspositionTable, LEGAL_MOVES, GAME_OVER
 
-MATERIAL_VALUE = {'k': 0, 'K': 0, 'p': -1, 'P': 1, 'q': -7, 'Q': 7, 'r': -5, 'R': 5, 'b': -3, 'B': 3, 'n': -3, 'N': 3}
 MOVES_PER_SIMULATION = 50
 WINNING_POSITION_VALUE = 3
-C_CONSTANT = 1.414
-total_arm_pulls = 0
 
+# how many rollouts a search runs between checks for an early stop
+EARLY_STOP_INTERVAL = 10
 
-def count_material_evaluation(board):
-    material = 0
-    for i in range(len(board)):
-        for j in range(len(board)):
-            piece = board[i][j]
-            if piece is not None:
-                material += MATERIAL_VALUE[str(piece)]
-    return material
+# ways of searching with more than one worker process
+ROOT_PARALLEL = 'root'
+LEAF_PARALLEL = 'leaf'
 
 
 class ShatarAI(object):
@@ -41,34 +40,37 @@ class RandomPlayer(ShatarAI):
 
 
 class GreedyPlayer(ShatarAI):
-    def __init__(self, white):
+    """
+    AI that plays the move that leaves the best evaluation, material by default (see evaluation.py)
+    """
+
+    def __init__(self, white, evaluator=None):
         super().__init__(white)
+        if evaluator is None:
+            evaluator = MATERIAL_EVALUATOR
+        self.evaluator = evaluator
 
     def get_move(self, model):
         if model.to_play is not self.white:
             raise ValueError("Trying to play on wrong turn!")
 
         candidate_moves = model.generate_legal_moves()
+        evaluations = self.evaluator.evaluate_children(model, candidate_moves)
 
         # if there are a lot of moves with the same eval, we want to choose a random one
         best_moves_to_choose_from = []
 
         # Set up the first one so that I can max it later
         best_move = candidate_moves[0]
-        board = model.get_board()
-        test_model = ShatarModel(board=board, to_play=self.white)
-        test_model.move(best_move[0], best_move[1], best_move[2], best_move[3])
-        best_move_eval = count_material_evaluation(test_model.get_board())
+        best_move_eval = evaluations[0]
         best_moves_to_choose_from.append(best_move)
 
-        for move in candidate_moves:
-            board = model.get_board()
-            test_model = ShatarModel(board=board, to_play=self.white)
-            test_model.move(move[0], move[1], move[2], move[3])
-            curr_eval = count_material_evaluation(test_model.get_board())
+        for move, curr_eval in zip(candidate_moves, evaluations):
+            undo = model.make_move(move)
+            gg = model.is_game_over()
+            model.unmake_move(undo)
 
             if self.white:
-                gg = test_model.is_game_over()
                 if gg == 1:
                     return move
                 if gg == -1 or 0:
@@ -81,7 +83,6 @@ class GreedyPlayer(ShatarAI):
                     best_move_eval = curr_eval
                     best_moves_to_choose_from = [move]
             else:
-                gg = test_model.is_game_over()
                 if gg == -1:
                     return move
                 if gg == 1 or 0:
@@ -126,221 +127,289 @@ class PacifistPlayer(ShatarAI):
 # we will hash seen boards to save space/time
 # as suggested by Prof Gold
 
-hash_to_legal_moves = dict()
-hash_to_is_game_over = dict()
-hash_to_best_moves = dict()
-hash_to_eval = dict()
+# legal moves and game over results of seen boards are cached in a
+# TranspositionTable. Each MCTSPlayer gets its own bounded table (or one passed in), so memory stays
+# flat over long runs and two players never share a cache.
 
 
-# these three dicts do not contain any information about simulation running,
-# they only store things we can get from model functions / evaluation from get_greedy_move,
-# so they can be global. Even if we have two MCTSPlayer's competing against each other,
-# neither will gain an advantage from these dicts, but both will move faster
+def cached_legal_moves(model, table):
+    """ Legal moves of the model, from the table if this position was seen before """
+    board_hash = hash(model)
+    moves = table.get(board_hash, LEGAL_MOVES)
+    if moves is None:
+        moves = model.generate_legal_moves()
+        table.put(board_hash, LEGAL_MOVES, moves)
+    return moves
+
+
+def cached_is_game_over(model, table):
+    """ is_game_over of the model, from the table if this position was seen before """
+    board_hash = hash(model)
+    game_over = table.get(board_hash, GAME_OVER)
+    if game_over is None:
+        game_over = model.is_game_over()
+        table.put(board_hash, GAME_OVER, game_over)
+    return game_over
 
 
 class MCTSPlayer(ShatarAI):
     """
     AI that will play based off of MCTS. It will keep track of win probabilities for every
-    board state that it sees in dicts. To save space/time, we're going to hash boards.
+    board state that it sees in a tree. To save space/time, we're going to hash boards into a
+    TranspositionTable, which can be passed in to control its size and replacement policy.
+
+    With more than one worker the search runs in a pool of worker processes, which is kept between moves
+    (call close() once the player is done with it):
+        ROOT_PARALLEL: every worker grows its own tree from the current position for its share of
+            simulation_number, and the root children's num_wins/num_sims are added up over all the workers
+            before choosing a move
+        LEAF_PARALLEL: there is one tree in this process, and the workers run its rollouts. Each step selects
+            batch_size leaves and runs rollouts_per_leaf rollouts from every one of them at once
+
+    Attributes:
+        workers (int): number of worker processes to search with, 1 to search in this process
+        parallel (str): ROOT_PARALLEL or LEAF_PARALLEL
+        seed (int): worker i of search n is seeded with seed + n * workers + i, or None for unseeded workers
+        rollout_seeds (random.Random): generator of the LEAF_PARALLEL rollout seeds, seeded with seed. It is
+            private to the player, so seeding a search never touches the random module of this process
+        batch_size (int): leaves selected per step in LEAF_PARALLEL
+        rollouts_per_leaf (int): rollouts run from each selected leaf in LEAF_PARALLEL
+        simulation_number (int): rollouts per move, or None to search until the time limit
+        time_limit (float): seconds to think per move, or None to run all of simulation_number
+        retained_nodes (int): number of nodes kept from the previous move's tree when the last search started
+        policy: selection policy of the search tree (see selection.py), UCB1 by default
+        evaluator (Evaluator): scores rollouts that are stopped after MOVES_PER_SIMULATION moves, or None for
+            the material balance (see evaluation.py)
     """
 
-    def __init__(self, white, random_rollout):
+    def __init__(self, white, random_rollout, table=None, workers=1, seed=None, parallel=ROOT_PARALLEL,
+                 batch_size=None, rollouts_per_leaf=1, policy=None, evaluator=None):
         super().__init__(white)
+        if workers < 1:
+            raise ValueError("MCTSPlayer needs at least one worker")
+        if parallel not in (ROOT_PARALLEL, LEAF_PARALLEL):
+            raise ValueError("Unknown parallel search: " + str(parallel))
         self.root = None
         self.simulation_number = 100
+        self.time_limit = None
         self.random_rollout = random_rollout
-
-    def get_move(self, model):
+        if table is None:
+            table = TranspositionTable()
+        self.table = table
+        self.workers = workers
+        self.parallel = parallel
+        self.seed = seed
+        self.rollout_seeds = random.Random(seed)
+        # by default give every worker one rollout per step
+        self.batch_size = max(1, workers // rollouts_per_leaf) if batch_size is None else batch_size
+        self.rollouts_per_leaf = rollouts_per_leaf
+        self.num_searches = 0
+        self.pool = None
+        self.retained_nodes = 0
+        self.policy = policy
+        self.evaluator = evaluator
+
+    def get_move(self, model, time_limit=None, node_limit=None):
+        """ Search the model's position and return a move.
+
+        The search stops at whichever comes first of the node budget and the time limit, or earlier once the
+        most visited move can't be overtaken anymore.
+
+        :param model: ShatarModel to move on
+        :param time_limit: seconds to think for this move, defaults to self.time_limit
+        :param node_limit: rollouts to run for this move, defaults to self.simulation_number
+        :return: the chosen move
+        """
         if model.to_play is not self.white:
             raise ValueError("Trying to play on wrong turn!")
 
-        if self.root is None:
-            self.root = GameTree(model=model_copier(model), white=self.white, random_rollout=self.random_rollout)
+        if time_limit is None:
+            time_limit = self.time_limit
+        if node_limit is None:
+            node_limit = self.simulation_number
+        deadline = None if time_limit is None else time.time() + time_limit
+
+        if self.workers > 1 and self.parallel == ROOT_PARALLEL:
+            return self.get_root_parallel_move(model, node_limit, deadline)
 
-        if model.to_play is not self.root.model.to_play:
-            self.root = self.root.update_opponents_turn(model)
+        # carry the subtree of the opponent's move over from the last search
+        if self.root is not None and model.to_play is not self.root.model.to_play:
+            child = self.root.update_opponents_turn(model)
+            if child is None:
+                # the opponent's move was never expanded, so none of the old tree is kept
+                self.root.release()
+            self.root = child
 
-        selected_node = self.root.best_action(self.simulation_number)
+        if self.root is not None and hash(self.root.model) != hash(model):
+            self.root.release()
+            self.root = None
+
+        if self.root is None:
+            self.root = GameTree(model=model_copier(model), white=self.white, random_rollout=self.random_rollout,
+                                 table=self.table, policy=self.policy, evaluator=self.evaluator)
+            self.retained_nodes = 0
+        else:
+            self.retained_nodes = self.root.count_nodes()
+
+        if self.workers > 1:
+            selected_node = self.root.best_action(node_limit, pool=self.get_pool(), batch_size=self.batch_size,
+                                                  rollouts_per_leaf=self.rollouts_per_leaf, deadline=deadline,
+                                                  rollout_seeds=self.rollout_seeds)
+        else:
+            selected_node = self.root.best_action(node_limit, deadline=deadline)
+        selected_node.detach()
         self.root = selected_node
 
         return selected_node.parent_action
 
+    def get_root_parallel_move(self, model, node_limit, deadline):
+        """ Search with every worker and pick a move from their combined root statistics
+
+        :param model: ShatarModel to move on
+        :param node_limit: rollouts to run over all the workers, or None for no limit
+        :param deadline: time.time() at which every worker stops, or None for no limit
+        :return: the chosen move
+        """
+        pool = self.get_pool()
+
+        jobs = []
+        for i in range(self.workers):
+            # split the simulations as evenly as possible
+            simulations = None
+            if node_limit is not None:
+                simulations = node_limit // self.workers + (i < node_limit % self.workers)
+            seed = None if self.seed is None else self.seed + self.num_searches * self.workers + i
+            jobs.append((model, self.white, self.random_rollout, simulations, seed, deadline, self.policy,
+                         self.evaluator))
+        self.num_searches += 1
+
+        # move: [num_wins, num_sims] over all the workers
+        merged = {}
+        for child_stats in pool.map(root_parallel_search, jobs):
+            for move, (num_wins, num_sims) in child_stats.items():
+                totals = merged.setdefault(move, [0, 0])
+                totals[0] += num_wins
+                totals[1] += num_sims
+
+        # the workers' trees stay in the workers, so there is no tree to keep for the next move
+        self.root = None
+        self.retained_nodes = 0
+
+        if len(merged) == 0:
+            # the game is over, just like most_visited_child at a terminal node there is no move to choose
+            return None
+
+        # same choice as GameTree.most_visited_child, on the merged statistics
+        most_sims = max(num_sims for num_wins, num_sims in merged.values())
+        return random.choice([move for move, (num_wins, num_sims) in merged.items() if num_sims == most_sims])
+
     def set_simulation_number(self, simulation_number):
         self.simulation_number = simulation_number
 
+    def set_time_limit(self, time_limit):
+        self.time_limit = time_limit
 
-def get_greedy_move(model, candidate_moves):
-    """
-    this is the same as get_move in GreedyPlayer, this is going to be used
-    in the rollout for the MCTS player
-    :return:
+    def get_pool(self):
+        """ The worker pool, which is started the first time it's needed """
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(self.workers)
+        return self.pool
+
+    def close(self):
+        """ Shut down the worker processes, if there are any """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+
+# transposition table of a pool worker process, which is made by its first search and kept for the rest, so
+# a worker doesn't build a new one on every move
+worker_table = None
+
+
+def get_worker_table():
+    global worker_table
+    if worker_table is None:
+        worker_table = TranspositionTable()
+    return worker_table
+
+
+def root_parallel_search(job):
+    """ One worker's share of a root parallel search, run in a worker process
+
+    :param job: (model, white, random_rollout, simulations, seed, deadline, policy, evaluator) tuple
+    :return: (dict) from each root move to the (num_wins, num_sims) of its child
     """
-    best_moves_to_choose_from = []
+    model, white, random_rollout, simulations, seed, deadline, policy, evaluator = job
+    if seed is not None:
+        random.seed(seed)
 
-    board_hash = hash(model)
+    root = GameTree(model=model, white=white, random_rollout=random_rollout, table=get_worker_table(), policy=policy,
+                    evaluator=evaluator)
+    root.best_action(simulations, deadline=deadline)
+    return {child.parent_action: (child.num_wins, child.num_sims) for child in root.children}
 
-    # if we have not evaluated this board before
 
-    # Set up the first one so that I can max it later
-    best_move = candidate_moves[0]
+def leaf_parallel_rollout(job):
+    """ One rollout of a leaf parallel search, run in a worker process
 
-    test_model = model_copier(model)
-    test_model.move(best_move[0], best_move[1], best_move[2], best_move[3])
+    :param job: (model, random_rollout, evaluator, seed) tuple
+    :return: the rollout's result, 1 for white win, -1 for black win, 0 for draw
+    """
+    model, random_rollout, evaluator, seed = job
+    random.seed(seed)
+    return rollout(model, random_rollout, evaluator)
 
-    test_board = test_model.get_board()
 
-    best_move_eval = count_material_evaluation(test_board)
-    best_moves_to_choose_from.append(best_move)
+def remaining_simulations(done, simulation_no):
+    """ Rollouts left in a search's simulation budget, infinite if it has none """
+    if simulation_no is None:
+        return float('inf')
+    return simulation_no - done
 
-    for move in candidate_moves:
-        test_model = model_copier(model)
-        test_model.move(move[0], move[1], move[2], move[3])
 
-        test_board_hash = hash(test_model)
+def budget_spent(done, simulation_no, deadline):
+    """ Whether a search has run out of rollouts or time
 
-        if test_board_hash not in hash_to_eval:
-            hash_to_eval[test_board_hash] = count_material_evaluation(test_model.get_board())
+    :param done: rollouts run so far
+    :param simulation_no: rollout budget, or None for no limit
+    :param deadline: time.time() to stop at, or None for no limit
+    :return: (boolean)
+    """
+    if remaining_simulations(done, simulation_no) <= 0:
+        return True
+    return deadline is not None and time.time() >= deadline
 
-        curr_eval = hash_to_eval[test_board_hash]
 
-        if test_board_hash not in hash_to_is_game_over:
-            hash_to_is_game_over[test_board_hash] = test_model.is_game_over()
-        gg = hash_to_is_game_over[test_board_hash]
+def evaluation_result(evaluation):
+    """ Result to count for a game stopped with the given material evaluation
 
-        if model.to_play:
+    :param evaluation: material evaluation, positive if white is ahead
+    :return: 1 if white is far enough ahead to count as a win, -1 if black is, 0 otherwise
+    """
+    if evaluation >= WINNING_POSITION_VALUE:
+        return 1
+    elif evaluation <= -WINNING_POSITION_VALUE:
+        return -1
+    return 0
 
-            if gg == 1:
-                return move
-            if gg == -1 or 0:
-                continue
 
-            if curr_eval == best_move_eval:
-                best_moves_to_choose_from.append(move)
-            elif curr_eval > best_move_eval:
-                best_move = move
-                best_move_eval = curr_eval
-                best_moves_to_choose_from = [move]
-        else:
+def rollout(model, random_rollout, evaluator=None):
+    """ Play the game out from the model on a Playout and return how it ended. The model isn't changed.
 
-            if gg == -1:
-                return move
-            if gg == 1 or 0:
-                continue
-
-            if curr_eval == best_move_eval:
-                best_moves_to_choose_from.append(move)
-            elif curr_eval < best_move_eval:
-                best_move = move
-                best_move_eval = curr_eval
-                best_moves_to_choose_from = [move]
-
-    hash_to_best_moves[board_hash] = best_moves_to_choose_from
-    return random.choice(best_moves_to_choose_from)
-
-
-### ZOBRIST HASHING:
-# https://en.wikipedia.org/wiki/Zobrist_hashing
-# https://levelup.gitconnected.com/zobrist-hashing-305c6c3c54d0
-
-# will use transposition tables (HashMap) as a cache to store already seen board positions
-# these tables are dicts: hash_to_legal_moves, hash_to_best_moves, hash_to_is_game_over
-
-# used pseudocode on Wikipedia to write two functions below
-
-## NOTE: We didn't end up using this in the final design, but we're leaving it because we spent
-## a while working on it / it could be useful if we want to modify the project in the future
-
-white_pawn = 1
-white_rook = 2
-white_knight = 3
-white_bishop = 4
-white_tiger = 5
-white_king = 6
-black_pawn = 7
-black_rook = 8
-black_knight = 9
-black_bishop = 10
-black_tiger = 11
-black_king = 12
-
-
-# table = [8][8][12]
-# table = [[[None for k in range(12)] for j in range(8)] for i in range(8)]
-
-
-# def init_zobrist():
-#     # fill a table of random numbers/bitstrings
-#     #print(table)
-#     for i in range(8):  # loop over the board
-#         for j in range(8):
-#             for k in range(12):  # loop over the pieces
-#
-#                 table[i][j][k] = random.getrandbits(64)
-#     #print(table[0][0][0])
-#
-#
-# def hash(board, to_play):
-#     h = 0
-#
-#     # if the table hasn't been initialized yet
-#     #if table[1][1][0] is None:
-#         #init_zobrist()
-#
-#     for i in range(8):  # loop over the board
-#         for j in range(8):
-#             if board[i][j] is not None:
-#                 piece_hash = 0
-#                 if board[i][j].__str__() == 'P':
-#                     # piece_hash = white_pawn
-#                     piece_hash = table[i][j][0]
-#                 if board[i][j].__str__() == 'R':
-#                     # piece_hash = white_rook
-#                     piece_hash = table[i][j][1]
-#                 if board[i][j].__str__() == 'N':
-#                     # piece_hash = white_knight
-#                     piece_hash = table[i][j][2]
-#                 if board[i][j].__str__() == 'B':
-#                     # piece_hash = white_bishop
-#                     piece_hash = table[i][j][3]
-#                 if board[i][j].__str__() == 'Q':
-#                     # piece_hash = white_tiger
-#                     piece_hash = table[i][j][4]
-#                 if board[i][j].__str__() == 'K':
-#                     # piece_hash = white_king
-#                     piece_hash = table[i][j][5]
-#                 if board[i][j].__str__() == 'p':
-#                     # piece_hash = black_pawn
-#                     piece_hash = table[i][j][6]
-#                 if board[i][j].__str__() == 'r':
-#                     # piece_hash = black_rook
-#                     piece_hash = table[i][j][7]
-#                 if board[i][j].__str__() == 'n':
-#                     # piece_hash = black_knight
-#                     piece_hash = table[i][j][8]
-#                 if board[i][j].__str__() == 'b':
-#                     # piece_hash = black_bishop
-#                     piece_hash = table[i][j][9]
-#                 if board[i][j].__str__() == 'q':
-#                     # piece_hash = black_tiger
-#                     piece_hash = table[i][j][10]
-#                 if board[i][j].__str__() == 'k':
-#                     # piece_hash = black_king
-#                     piece_hash = table[i][j][11]
-#
-#                 # h = h XOR table[i][j]
-#                 h = h ^ piece_hash
-#
-#     # we can't just hash the board state to legal moves because the same board state could occur
-#     # but it could be white's turn one time it's seen and black's turn another time
-#
-#     if to_play:
-#         string_hash = '0' + str(h)
-#     else:
-#         string_hash = '1' + str(h)
-#
-#     #print(string_hash)
-#
-#     return string_hash  # h
+    :param model: ShatarModel to play out
+    :param random_rollout: True to play random moves, False to prefer captures and promotions
+    :param evaluator: Evaluator that scores a game stopped after MOVES_PER_SIMULATION moves, None for material
+    :return: 1 for white win, -1 for black win, 0 for draw
+    """
+    policy = RANDOM_POLICY if random_rollout else CAPTURE_POLICY
+    # a game that isn't over after MOVES_PER_SIMULATION moves is scored by its evaluation
+    return Playout(model).play(MOVES_PER_SIMULATION, policy, WINNING_POSITION_VALUE, evaluator)
+
+
+# positions are hashed with the Zobrist key that ShatarModel keeps up to date as it moves (see zobrist.py),
+# so hash(model) is O(1) and covers side to play, both shak sequences and the capture clock
 
 
 class GameTree:
@@ -348,7 +417,15 @@ class GameTree:
     A class representing a tree in Monte Carlo tree search
     """
 
-    def __init__(self, model, parent=None, parent_action=None, white=True, random_rollout=True):
+    def __init__(self, model, parent=None, parent_action=None, white=True, random_rollout=True, table=None,
+                 policy=None, evaluator=None):
+        if table is None:
+            table = TranspositionTable()
+        if policy is None:
+            policy = UCB1()
+        self.table = table
+        # selection policy, see selection.py
+        self.policy = policy
         self.white = white
         self.parent = parent
         self.model = model
@@ -359,179 +436,140 @@ class GameTree:
         self.children = []
         self.num_wins = 0
         self.num_sims = 0
+        # sum of the squared results, for policies that look at how much the results vary
+        self.sum_squares = 0
+        # probability of each move, kept here by policies that use priors
+        self.priors = None
         self.random_rollout = random_rollout
+        # scores stopped rollouts, None for material
+        self.evaluator = evaluator
 
     # https://ai-boson.github.io/mcts/
     def get_untried_actions(self):
-        if self.board_hash not in hash_to_legal_moves:
-            hash_to_legal_moves[self.board_hash] = self.model.generate_legal_moves()
+        # copy the cached list, untried moves get removed from it as the node is expanded
+        return list(cached_legal_moves(self.model, self.table))
 
-        return hash_to_legal_moves[self.board_hash]
-
-    def expansion(self):
-        """ Returns a random untried child node
+    def expansion(self, action=None):
+        """ Returns a new child node for an untried move
 
+        :param action: the untried move, or None for a random one
         :return:
         """
-
-        action = random.choice(self.untried_actions)
+        if action is None:
+            action = random.choice(self.untried_actions)
         self.untried_actions.remove(action)
 
         next_model = self.model_copier()
-        next_model.move(action[0], action[1], action[2], action[3])
-        child = GameTree(model=next_model, parent=self, parent_action=action, white=self.white)
+        next_model.make_move(action)
+        child = GameTree(model=next_model, parent=self, parent_action=action, white=self.white,
+                         random_rollout=self.random_rollout, table=self.table, policy=self.policy,
+                         evaluator=self.evaluator)
         self.children.append(child)
         return child
 
     def is_terminal_node(self):
-        if self.board_hash not in hash_to_is_game_over:
-            hash_to_is_game_over[self.board_hash] = self.model.is_game_over()
+        # is_game_over returns 2 while the game is still going
+        return cached_is_game_over(self.model, self.table) != 2
 
-        return hash_to_is_game_over[self.board_hash]
+    def backpropagate(self, results, virtual_loss=False):
+        """ Add a batch of rollout results to this node and every ancestor, walking up the parent links.
 
-    def backpropagate(self, result):
-        self.num_sims += 1
+        A node's num_wins counts from the side of the player who made the move into it (a win is 1, a draw 0.5
+        and a loss -1), so the same result adds to one ply and takes away from the next.
 
-        if result == 1 and self.white:
-            self.num_wins += 1
-        elif result == -1 and not self.white:
-            self.num_wins += 1
-        elif result == 0:
-            self.num_wins += 0.5
-        else:
-            self.num_wins -= 1
-
-        if self.parent:
-            self.parent.backpropagate(result)
+        :param results: (list) of rollout results from this node, 1 for white win, -1 for black win, 0 for draw
+        :param virtual_loss: True to also take back the virtual loss that add_virtual_loss put on the path
+        """
+        white_wins = results.count(1)
+        black_wins = results.count(-1)
+        draws = len(results) - white_wins - black_wins
+        white_value = white_wins - black_wins + 0.5 * draws
+        black_value = black_wins - white_wins + 0.5 * draws
+        squares = white_wins + black_wins + 0.25 * draws
+        sims = len(results)
+
+        if virtual_loss:
+            # the virtual loss counted one simulation and one lost game
+            white_value += 1
+            black_value += 1
+            squares -= 1
+            sims -= 1
+
+        node = self
+        while node is not None:
+            node.num_sims += sims
+            # the side to play at the node is the one that didn't just move
+            node.num_wins += black_value if node.model.to_play else white_value
+            node.sum_squares += squares
+            node = node.parent
+
+    def add_virtual_loss(self):
+        """ Count a lost simulation on this node and every ancestor while its rollouts are running, so that
+        the rest of a batch gets steered towards other leaves """
+        node = self
+        while node is not None:
+            node.num_sims += 1
+            node.num_wins -= 1
+            node.sum_squares += 1
+            node = node.parent
 
     def is_fully_expanded(self):
         return len(self.untried_actions) == 0
 
-    def best_child(self):
-        max_win_percentage = float('-inf')
-        best_children = []
-
-        for child in self.children:
-            win_percentage = child.num_wins / child.num_sims
-
-            # print(str(child.parent_action) + ': ' + str(win_percentage))
-            if win_percentage > max_win_percentage:
-                best_children = []
-                max_win_percentage = win_percentage
-                best_children.append(child)
-            elif max_win_percentage == win_percentage:
-                best_children.append(child)
-
-        if len(best_children) > 0:
-            return random.choice(best_children)
-        else:
-            # we're at a terminal node
-            return self
-
     # rollout
     def simulation(self):
-        current_state = self.model_copier()
-        starting_move = current_state.total_moves
-
-        # while the game is not over
-        while current_state.is_game_over() == 2 and \
-                not (current_state.total_moves - starting_move > MOVES_PER_SIMULATION):
-            board_hash = hash(current_state)
-            if board_hash not in hash_to_legal_moves:
-                hash_to_legal_moves[board_hash] = current_state.generate_legal_moves()
-
-            possible_moves = hash_to_legal_moves[board_hash]
-
-            if len(possible_moves) == 0:
-                # print("*"*20)
-                # print("THIS SHOULD NOT HAPPEN WEE WOO WEE WOO")
-                gen = current_state.generate_legal_moves()
-                possible_moves = gen
-                # print('ACTUAL LEGAL MOVES: ' + str(gen))
-                # print("*" * 20)
-
-            action = self.rollout_policy(current_state, possible_moves)
-            # print('v.to_play=' + str(current_state.to_play))
-            current_state.move(action[0], action[1], action[2], action[3])
-
-        if current_state.is_game_over() == 2:
-            evaluation = count_material_evaluation(current_state.board)
-            if evaluation >= WINNING_POSITION_VALUE:
-                result = 1
-            elif evaluation <= -WINNING_POSITION_VALUE:
-                result = -1
-            else:
-                result = 0
-        else:
-            result = current_state.is_game_over()
-
-        # 1 for white win, -1 for black win, 0 for draw
-        # should probably change what is returned here but leaving it for now
-        return result
-
-    def rollout_policy(self, model, possible_moves):
-
-        # two different rollout policies decided by self.random_rollout
-        if self.random_rollout:
-            return random.choice(possible_moves)
-        else:
-            return get_greedy_move(model, possible_moves)
-
-    def tree_policy(self, c=C_CONSTANT):
-
-        # SELECTION:
-        if len(self.untried_actions) == 0:
-            # if no untried children, calculate best ucb1
-
-            max_of_ucb = float('-inf')
-            best_children = []
-
-            for child in self.children:
-
-                ni = child.num_sims
-                # if ni == 0:
-                #     ni = 0.0001
-                xi = child.num_wins / ni
-
-                global total_arm_pulls
-                # the selection equation
-                ucb = xi + c * math.sqrt(2 * math.log(total_arm_pulls) / ni)
-
-                if ucb > max_of_ucb:
-                    best_children = []
-                    max_of_ucb = ucb
-                    best_children.append(child)
-                elif ucb == max_of_ucb:
-                    best_children.append(child)
+        return rollout(self.model, self.random_rollout, self.evaluator)
 
-            if len(best_children) > 0:
-                current_node = random.choice(best_children)
-            else:
-                # we're at a terminal node
-                return self
+    def tree_policy(self):
+        """ Go down the tree as the selection policy says until it picks a move that hasn't been tried, or the
+        game is over
 
-        else:
-            # we have untried children so greedily choose one
-            move = get_greedy_move(model_copier(self.model), self.untried_actions)
-            self.untried_actions.remove(move)
-            new_model = self.model_copier()
-            new_model.move(move[0], move[1], move[2], move[3])
-            current_node = GameTree(new_model, parent=self, parent_action=move, white=self.white)
-            self.children.append(current_node)
-
-        # EXPANSION OF SELECTED NODE
+        :return: GameTree of the new child, or of the node where the game ended
+        """
+        current_node = self
         while not current_node.is_terminal_node():
-
-            if not current_node.is_fully_expanded():
-                return current_node.expansion()
+            choice = current_node.policy.select(current_node)
+            if isinstance(choice, GameTree):
+                current_node = choice
             else:
-                current_node = current_node.best_child()
-
+                return current_node.expansion(choice)
         return current_node
 
-    def best_action(self, simulation_no):
+    def best_action(self, simulation_no=None, pool=None, batch_size=1, rollouts_per_leaf=1, deadline=None,
+                    rollout_seeds=None):
+        """ Run simulations from this node and return the most visited child.
+
+        The search stops when simulation_no rollouts have run or the deadline has passed, whichever comes first.
+        It also stops early once the most visited child is further ahead of the runner up than the remaining
+        budget could change, so stopping early never changes the move that is returned.
+
+        :param simulation_no: number of rollouts to run, or None for no limit
+        :param pool: multiprocessing pool to run the rollouts in, or None to run them one at a time here
+        :param batch_size: leaves selected before the pool runs their rollouts
+        :param rollouts_per_leaf: rollouts run in the pool from every selected leaf
+        :param deadline: time.time() after which no more rollouts are started, or None for no limit
+        :param rollout_seeds: random.Random that the seeds of the pool's rollouts are drawn from, or None to
+            draw them from the random module
+        :return: GameTree of the most visited child, or this node if the game is over
+        """
+        if simulation_no is None and deadline is None:
+            raise ValueError("MCTS search needs a simulation number or a deadline")
 
-        for i in range(simulation_no):
+        if pool is not None:
+            self.leaf_parallel_search(simulation_no, pool, batch_size, rollouts_per_leaf, deadline,
+                                      random if rollout_seeds is None else rollout_seeds)
+        else:
+            self.serial_search(simulation_no, deadline)
+        return self.most_visited_child()
+
+    def serial_search(self, simulation_no, deadline):
+        """ Run rollouts one at a time in this process until the budget is spent
+
+        :return: (boolean) True if the search stopped early because the result could no longer change
+        """
+        start = time.time()
+        done = 0
+        while not budget_spent(done, simulation_no, deadline):
             # gets the next
             # child which is selection and also expansion
             v = self.tree_policy()
@@ -542,47 +580,141 @@ class GameTree:
 
             # simulate on the child and backpropagate
             reward = v.simulation()
-            v.backpropagate(reward)
+            v.backpropagate([reward])
 
             # reward = v.alpha_simulation()
             # v.alpha_backpropagate(reward)
 
-            global total_arm_pulls
-            total_arm_pulls += 1
+            done += 1
 
-        return self.best_child()
+            if done % EARLY_STOP_INTERVAL == 0 and self.lead_is_decisive(done, simulation_no, start, deadline):
+                return True
+        return False
 
-    def alpha_simulation(self):
-        evaluation = count_material_evaluation(self.model.board)
-        return evaluation
+    def leaf_parallel_search(self, simulation_no, pool, batch_size, rollouts_per_leaf, deadline, rollout_seeds):
+        """ Run rollouts from this node until the budget is spent, batch_size leaves at a time, with the
+        rollouts of each batch running in the pool, each seeded with rollout_seeds.getrandbits(32)
 
-    def alpha_backpropagate(self, result):
-        self.num_sims += 1
+        :return: (boolean) True if the search stopped early because the result could no longer change
+        """
+        start = time.time()
+        done = 0
+        while not budget_spent(done, simulation_no, deadline):
+            leaves = []
+            jobs = []
+            while len(leaves) < batch_size and not budget_spent(done + len(jobs), simulation_no, None):
+                v = self.tree_policy()
+                v.add_virtual_loss()
+                leaves.append(v)
+                for i in range(min(rollouts_per_leaf, remaining_simulations(done + len(jobs), simulation_no))):
+                    jobs.append((v.model, v.random_rollout, v.evaluator, rollout_seeds.getrandbits(32)))
+
+            results = pool.map(leaf_parallel_rollout, jobs)
+
+            # the results come back in the same order as the jobs, rollouts_per_leaf at a time
+            start_index = 0
+            for v in leaves:
+                count = min(rollouts_per_leaf, len(results) - start_index)
+                v.backpropagate(results[start_index:start_index + count], virtual_loss=True)
+                start_index += count
+
+            done += len(jobs)
+
+            if self.lead_is_decisive(done, simulation_no, start, deadline):
+                return True
+        return False
+
+    def lead_is_decisive(self, done, simulation_no, start, deadline):
+        """ Whether the most visited child can no longer be caught by another child in the remaining budget
+
+        :param done: rollouts run so far in this search
+        :param simulation_no: rollout budget of the search, or None
+        :param start: time.time() when the search started
+        :param deadline: time.time() when the search has to stop, or None
+        :return: (boolean)
+        """
+        if len(self.children) == 0:
+            return False
+
+        remaining = remaining_simulations(done, simulation_no)
+        if deadline is not None:
+            # guess how many more rollouts fit before the deadline from the speed so far
+            now = time.time()
+            if now > start:
+                remaining = min(remaining, done / (now - start) * (deadline - now))
+
+        # untried moves count as children with no simulations, which the runner up is never behind
+        first = second = 0
+        for child in self.children:
+            if child.num_sims > first:
+                first, second = child.num_sims, first
+            elif child.num_sims > second:
+                second = child.num_sims
+        return first - second > remaining
+
+    def most_visited_child(self):
+        """ Child with the most simulations, ties broken at random, or this node if it has no children """
+        if len(self.children) == 0:
+            # we're at a terminal node
+            return self
+        most_sims = max(child.num_sims for child in self.children)
+        return random.choice([child for child in self.children if child.num_sims == most_sims])
 
-        if result >= WINNING_POSITION_VALUE and self.white:
-            self.num_wins += 1
-        elif result <= -WINNING_POSITION_VALUE and not self.white:
-            self.num_wins += 1
-        else:
-            self.num_wins += 0.5
+    def alpha_simulation(self):
+        return self.model.material
 
-        if self.parent:
-            self.parent.backpropagate(result)
+    def alpha_backpropagate(self, result):
+        self.backpropagate([evaluation_result(result)])
 
     def model_copier(self):
         return model_copier(self.model)
 
     def update_opponents_turn(self, model):
+        """ Child reached by the move the opponent just played on the model, detached from the rest of the tree
+
+        :param model: ShatarModel after the opponent's move
+        :return: GameTree of the child, or None if that move was never expanded
+        """
+        move = tuple(model.last_moved_from) + tuple(model.last_moved_to)
         for child in self.children:
-            if hash(child.model) == hash(model):
+            if child.parent_action == move and hash(child.model) == hash(model):
+                child.detach()
                 return child
-        return GameTree(model_copier(model), white=self.white)
+        return None
+
+    def detach(self):
+        """ Make this node the root of its own tree and free every other node of the tree it was in """
+        parent = self.parent
+        if parent is None:
+            return
+        self.parent = None
+        parent.children.remove(self)
+
+        # the old root and the rest of its subtrees
+        while parent.parent is not None:
+            parent = parent.parent
+        parent.release()
+
+    def release(self):
+        """ Break the links between this node and everything under it, so that the nodes are freed right away
+        instead of waiting for the cycle collector """
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            stack.extend(node.children)
+            node.children = []
+            node.parent = None
+
+    def count_nodes(self):
+        """ Number of nodes in the tree under this node, including this one """
+        count = 0
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            count += 1
+            stack.extend(node.children)
+        return count
 
 
 def model_copier(model):
-    new_model = ShatarModel(model.get_board(), to_play=model.to_play)
-    new_model.shak_sequence_white = model.shak_sequence_black
-    new_model.shak_sequence_black = model.shak_sequence_black
-    new_model.moves_since_last_capture = model.moves_since_last_capture
-    new_model.total_moves = model.total_moves
-    return new_model
+    return model.copy()
@@ -0,0 +1,180 @@
+try:
+    import numpy as np
+except ImportError:
+    # everything here still works without NumPy, one position at a time
+    np = None
+
+from evaluation import Evaluator, MATERIAL_SCORES, MIDDLEGAME_SCORES, ENDGAME_SCORES, PHASES, MAX_PHASE, \
+    CODE_SYMBOLS, taper
+from pieces import PAWN, TIGER, KING, PIECE_CODES
+from shatar import parse_fen_row
+
+# Scores many positions at once. A position is encoded as 64 small ints, one per square (row * 8 + col):
+# 0 for an empty square and the pieces.PIECE_CODES code for a piece, negative for black. With NumPy a batch
+# of N positions is an (N, 64) int8 array, and its scores are lookups into (13, 64) tables of piece value +
+# square bonus, summed over the squares. Scores are material units from white's point of view and match evaluation.MaterialEvaluator
+# or evaluation.TaperedEvaluator, whose tables these are.
+
+# codes go from -KING to KING, so a code + CODE_OFFSET is a row of a score table
+CODE_OFFSET = KING
+# code of every piece, negative for black
+CODES_BY_PIECE = {piece_type(white): code if white else -code
+                  for piece_type, code in PIECE_CODES.items() for white in (True, False)}
+
+
+def build_score_table(square_scores):
+    """ Score of every code on every square, as a list of 13 rows of 64 scores indexed by code + CODE_OFFSET
+
+    :param square_scores: dict from piece symbol to 64 scores, like evaluation.MIDDLEGAME_SCORES
+    """
+    return [[0] * 64 if code == 0 else square_scores[CODE_SYMBOLS[code]] for code in range(-KING, KING + 1)]
+
+
+MATERIAL_TABLE = build_score_table(MATERIAL_SCORES)
+MIDDLEGAME_TABLE = build_score_table(MIDDLEGAME_SCORES)
+ENDGAME_TABLE = build_score_table(ENDGAME_SCORES)
+# phase weight of each code, indexed like the score tables
+PHASE_TABLE = [0 if code == 0 else PHASES[CODE_SYMBOLS[code]] for code in range(-KING, KING + 1)]
+if np is not None:
+    MATERIAL_TABLE = np.array(MATERIAL_TABLE, dtype=np.float32)
+    MIDDLEGAME_TABLE = np.array(MIDDLEGAME_TABLE, dtype=np.float32)
+    ENDGAME_TABLE = np.array(ENDGAME_TABLE, dtype=np.float32)
+    PHASE_TABLE = np.array(PHASE_TABLE, dtype=np.int32)
+    SQUARES = np.arange(64)
+
+
+def encode(model):
+    """ The model's board as a list of 64 codes """
+    codes = [0] * 64
+    for row in range(8):
+        for col in range(8):
+            piece = model.board[row][col]
+            if piece is not None:
+                codes[row * 8 + col] = CODES_BY_PIECE[piece]
+    return codes
+
+
+def encode_batch(models):
+    """ Boards of many models, as an (N, 64) int8 array (or a list of lists without NumPy) """
+    codes = [encode(model) for model in models]
+    if np is None:
+        return codes
+    return np.array(codes, dtype=np.int8).reshape(len(codes), 64)
+
+
+def encode_fens(fens):
+    """ Boards and sides to play of many FENs (see ShatarModel.to_fen), without building a model for any of them
+
+    :param fens: (list) of FENs
+    :return: (codes, white_to_play) with an (N, 64) int8 array of boards and an (N,) bool array of whether
+        white is to play (or a list of lists and a list without NumPy)
+    """
+    codes = []
+    white_to_play = []
+    for fen in fens:
+        fields = fen.split()
+        fen_rows = fields[0].split('/')
+        if len(fen_rows) != 8:
+            raise ValueError("FEN board doesn't have 8 rows: " + fen)
+        position = []
+        for fen_row in reversed(fen_rows):
+            position.extend(CODES_BY_PIECE.get(piece, 0) for piece in parse_fen_row(fen_row))
+        codes.append(position)
+        white_to_play.append(len(fields) < 2 or fields[1] != '0')
+
+    if np is None:
+        return codes, white_to_play
+    return np.array(codes, dtype=np.int8).reshape(len(codes), 64), np.array(white_to_play, dtype=bool)
+
+
+def encode_children(model, moves):
+    """ Boards after each of the moves is played on the model, without playing any of them
+
+    :param model: ShatarModel
+    :param moves: (list) of legal (from_row, from_col, to_row, to_col) moves
+    :return: (N, 64) int8 array (or a list of lists without NumPy), one row per move
+    """
+    parent = encode(model)
+    if np is None:
+        children = []
+        for from_row, from_col, to_row, to_col in moves:
+            child = list(parent)
+            code = child[from_row * 8 + from_col]
+            child[from_row * 8 + from_col] = 0
+            if abs(code) == PAWN and to_row in (0, 7):
+                code = TIGER if code > 0 else -TIGER
+            child[to_row * 8 + to_col] = code
+            children.append(child)
+        return children
+
+    move_array = np.array(moves, dtype=np.intp).reshape(len(moves), 4)
+    from_squares = move_array[:, 0] * 8 + move_array[:, 1]
+    to_squares = move_array[:, 2] * 8 + move_array[:, 3]
+    rows = np.arange(len(moves))
+
+    children = np.repeat(np.array(parent, dtype=np.int8)[np.newaxis, :], len(moves), axis=0)
+    codes = children[rows, from_squares]
+    # a pawn reaching the last rank becomes a Tiger
+    promoted = (np.abs(codes) == PAWN) & ((move_array[:, 2] == 0) | (move_array[:, 2] == 7))
+    codes = np.where(promoted, np.sign(codes) * TIGER, codes).astype(np.int8)
+    children[rows, from_squares] = 0
+    children[rows, to_squares] = codes
+    return children
+
+
+def evaluate_batch(codes, material_only=False):
+    """ Scores of a batch of encoded positions
+
+    :param codes: (N, 64) array from encode_batch or encode_children
+    :param material_only: True to leave out the piece-square tables, which gives count_material_evaluation
+    :return: (N,) float32 array (or a list without NumPy) of scores from white's point of view
+    """
+    if np is None:
+        scores = []
+        for position in codes:
+            pieces = [(code + CODE_OFFSET, sq) for sq, code in enumerate(position) if code != 0]
+            if material_only:
+                scores.append(sum(MATERIAL_TABLE[row][sq] for row, sq in pieces))
+            else:
+                scores.append(taper(sum(MIDDLEGAME_TABLE[row][sq] for row, sq in pieces),
+                                    sum(ENDGAME_TABLE[row][sq] for row, sq in pieces),
+                                    sum(PHASE_TABLE[row] for row, sq in pieces)))
+        return scores
+
+    if len(codes) == 0:
+        return np.zeros(0, dtype=np.float32)
+    rows = np.asarray(codes, dtype=np.intp) + CODE_OFFSET
+    if material_only:
+        return MATERIAL_TABLE[rows, SQUARES].sum(axis=1)
+    middlegame = MIDDLEGAME_TABLE[rows, SQUARES].sum(axis=1)
+    endgame = ENDGAME_TABLE[rows, SQUARES].sum(axis=1)
+    phase = np.minimum(PHASE_TABLE[rows].sum(axis=1), MAX_PHASE).astype(np.float32)
+    return (middlegame * phase + endgame * (MAX_PHASE - phase)) / MAX_PHASE
+
+
+def evaluate_children(model, moves, material_only=False):
+    """ Score of the position after each move, from white's point of view, in one batch
+
+    :return: (N,) float32 array (or a list without NumPy), one score per move
+    """
+    return evaluate_batch(encode_children(model, moves), material_only=material_only)
+
+
+class BatchEvaluator(Evaluator):
+    """ Evaluator that scores the children of a position all in one batch
+
+    Attributes:
+        material_only (bool): True to score like MaterialEvaluator, False like TaperedEvaluator
+    """
+
+    def __init__(self, material_only=False):
+        self.material_only = material_only
+
+    def evaluate(self, model):
+        return float(evaluate_batch(encode_batch([model]), self.material_only)[0])
+
+    def evaluate_codes(self, codes):
+        return float(evaluate_batch([codes], self.material_only)[0])
+
+    def evaluate_children(self, model, moves):
+        return list(evaluate_children(model, moves, self.material_only))
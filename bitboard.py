@@ -0,0 +1,435 @@
+from pieces import ROOK_DIRECTIONS, BISHOP_DIRECTIONS, KING_TARGETS, KNIGHT_TARGETS, PAWN_CAPTURE_TARGETS, RAYS, \
+    squares_between
+
+# Squares are numbered row * 8 + col, so bit 0 is row 0, col 0 (white's side of the board)
+# and bit 63 is row 7, col 7. A bitboard is a Python int with one bit set per occupied square.
+#
+# Legal moves are generated the way the 2d board does it: the checkers, the pins and the squares the enemy
+# threatens are worked out once per position as masks, and every piece's targets are cut down by them, so no
+# move has to be tried out. Turn it on with ShatarModel(bitboards=True) (or tournament.py --bitboards);
+# perft --bitboards runs the reference positions on it.
+
+PAWN = 0
+KNIGHT = 1
+BISHOP = 2
+ROOK = 3
+TIGER = 4
+KING = 5
+
+# black pieces are stored after the six white ones, so index = type + BLACK_OFFSET for black
+BLACK_OFFSET = 6
+SYMBOLS = 'PNBRQKpnbrqk'
+SYMBOL_TO_INDEX = {symbol: index for index, symbol in enumerate(SYMBOLS)}
+
+
+def square(row, col):
+    """ Get the bit index of the given row and column
+
+    :param row: row
+    :param col: col
+    :return: (int) square index from 0 to 63
+    """
+    return row * 8 + col
+
+
+def targets_to_mask(targets):
+    """ Turn an iterable of (row, col) squares into a bitboard
+
+    :param targets: (row, col) squares, e.g. an entry of one of the target tables in pieces
+    :return: (int) mask with a bit set for every square
+    """
+    mask = 0
+    for row, col in targets:
+        mask |= 1 << square(row, col)
+    return mask
+
+
+def table_to_masks(table):
+    """ Turn an 8x8 target table from pieces into a list of 64 masks indexed by square """
+    return [targets_to_mask(table[row][col]) for row in range(8) for col in range(8)]
+
+
+KING_ATTACKS = table_to_masks(KING_TARGETS)
+KNIGHT_ATTACKS = table_to_masks(KNIGHT_TARGETS)
+# squares a pawn on each square can capture on, for white ([0]) and black ([1])
+PAWN_ATTACKS = (table_to_masks(PAWN_CAPTURE_TARGETS[True]), table_to_masks(PAWN_CAPTURE_TARGETS[False]))
+
+
+def ray_masks(directions):
+    """ For each direction, a (list of 64 ray masks, True if the ray goes towards higher square indices) pair """
+    rays = []
+    for direction in directions:
+        masks = [targets_to_mask(RAYS[row][col][direction]) for row in range(8) for col in range(8)]
+        rays.append((masks, direction[0] * 8 + direction[1] > 0))
+    return rays
+
+
+ROOK_RAYS = ray_masks(ROOK_DIRECTIONS)
+BISHOP_RAYS = ray_masks(BISHOP_DIRECTIONS)
+
+
+def between_mask(from_sq, to_sq):
+    """ Mask of the squares strictly between two squares, 0 if they are the same or not on a line """
+    if from_sq == to_sq:
+        return 0
+    return targets_to_mask(squares_between(from_sq // 8, from_sq % 8, to_sq // 8, to_sq % 8))
+
+
+# squares strictly between two squares, indexed [from][to]
+BETWEEN = [[between_mask(from_sq, to_sq) for to_sq in range(64)] for from_sq in range(64)]
+
+FILE_A = 0x0101010101010101
+FILE_H = FILE_A << 7
+ALL_SQUARES = (1 << 64) - 1
+
+# (from_row, from_col, to_row, to_col) tuple of every move, indexed [from][to], so that generating a move
+# doesn't build a new tuple
+MOVES = [[divmod(from_sq, 8) + divmod(to_sq, 8) for to_sq in range(64)] for from_sq in range(64)]
+
+
+def first_square(mask, positive):
+    """ Square of the first set bit met going along a ray: the lowest one for rays towards higher square
+    indices, the highest one otherwise """
+    if positive:
+        return (mask & -mask).bit_length() - 1
+    return mask.bit_length() - 1
+
+
+def pawn_attacks(pawns, white):
+    """ Every square that the given pawns can capture on, all pawns at once
+
+    :param pawns: mask of pawns of one color
+    :param white: (boolean) color of the pawns
+    :return: (int) mask of attacked squares
+    """
+    if white:
+        return (((pawns & ~FILE_A) << 7) | ((pawns & ~FILE_H) << 9)) & ALL_SQUARES
+    return ((pawns & ~FILE_H) >> 7) | ((pawns & ~FILE_A) >> 9)
+
+
+def sliding_attacks(sq, occupied, rays):
+    """ Squares a slider on sq sees, up to and including the first occupied square in each direction
+
+    :param sq: square of the slider
+    :param occupied: mask of every occupied square
+    :param rays: ROOK_RAYS or BISHOP_RAYS
+    :return: (int) mask of attacked squares
+    """
+    attacks = 0
+    for table, positive in rays:
+        ray = table[sq]
+        blockers = ray & occupied
+        if blockers:
+            if positive:
+                first = (blockers & -blockers).bit_length() - 1
+            else:
+                first = blockers.bit_length() - 1
+            ray ^= table[first]
+        attacks |= ray
+    return attacks
+
+
+class BitBoard(object):
+    """ Shatar board stored as one 64-bit mask per piece type and color.
+
+    Attributes:
+        pieces (list of int): 12 masks indexed like SYMBOLS (white pawn, knight, bishop, rook, tiger, king, then black)
+        white_occupied (int): mask of every square with a white piece
+        black_occupied (int): mask of every square with a black piece
+    """
+
+    def __init__(self, pieces=None):
+        if pieces is None:
+            pieces = [0] * 12
+        self.pieces = pieces
+        self.white_occupied = 0
+        self.black_occupied = 0
+        for index in range(6):
+            self.white_occupied |= pieces[index]
+            self.black_occupied |= pieces[index + BLACK_OFFSET]
+
+    @classmethod
+    def from_board(cls, board):
+        """ Build a BitBoard from a 2d list of pieces
+
+        :param board: (2d array) shatar board
+        :return: BitBoard with the same pieces
+        """
+        pieces = [0] * 12
+        for i in range(8):
+            for j in range(8):
+                piece = board[i][j]
+                if piece is not None:
+                    pieces[SYMBOL_TO_INDEX[piece.symbol]] |= 1 << square(i, j)
+        return cls(pieces)
+
+    def copy(self):
+        """ Independent BitBoard with the same pieces, without going through a 2d board """
+        return BitBoard(list(self.pieces))
+
+    def move_piece(self, symbol, from_sq, to_sq, captured=None, promoted=None):
+        """ Move a piece on the bitboards. Does not check that the move is legal
+
+        :param symbol: (str) symbol of the moving piece
+        :param from_sq: square the piece leaves
+        :param to_sq: square the piece lands on
+        :param captured: (str) symbol of the piece on to_sq or None
+        :param promoted: (str) symbol of the piece the mover turns into (pawn to Tiger) or None
+        """
+        from_bit = 1 << from_sq
+        to_bit = 1 << to_sq
+        index = SYMBOL_TO_INDEX[symbol]
+
+        if captured is not None:
+            self.pieces[SYMBOL_TO_INDEX[captured]] ^= to_bit
+            if index < BLACK_OFFSET:
+                self.black_occupied ^= to_bit
+            else:
+                self.white_occupied ^= to_bit
+
+        self.pieces[index] ^= from_bit
+        if promoted is None:
+            self.pieces[index] |= to_bit
+        else:
+            self.pieces[SYMBOL_TO_INDEX[promoted]] |= to_bit
+
+        if index < BLACK_OFFSET:
+            self.white_occupied ^= from_bit | to_bit
+        else:
+            self.black_occupied ^= from_bit | to_bit
+
+    def unmove_piece(self, symbol, from_sq, to_sq, captured=None, promoted=None):
+        """ Take back a move_piece call made with the same arguments """
+        from_bit = 1 << from_sq
+        to_bit = 1 << to_sq
+        index = SYMBOL_TO_INDEX[symbol]
+
+        if promoted is None:
+            self.pieces[index] ^= to_bit
+        else:
+            self.pieces[SYMBOL_TO_INDEX[promoted]] ^= to_bit
+        self.pieces[index] |= from_bit
+
+        if index < BLACK_OFFSET:
+            self.white_occupied ^= from_bit | to_bit
+        else:
+            self.black_occupied ^= from_bit | to_bit
+
+        if captured is not None:
+            self.pieces[SYMBOL_TO_INDEX[captured]] |= to_bit
+            if index < BLACK_OFFSET:
+                self.black_occupied |= to_bit
+            else:
+                self.white_occupied |= to_bit
+
+    def king_square(self, white):
+        """ Square of the King of the given color, or None if it is not on the board """
+        king = self.pieces[KING if white else KING + BLACK_OFFSET]
+        if king == 0:
+            return None
+        return king.bit_length() - 1
+
+    def attackers_to(self, sq, by_white, occupied=None, removed=0):
+        """ Mask of the pieces of the given color that threaten the given square
+
+        :param sq: square that is attacked
+        :param by_white: (boolean) True to find white attackers
+        :param occupied: mask of occupied squares to use for sliders (defaults to the current board)
+        :param removed: mask of squares whose pieces should be ignored (e.g. a piece that was just captured)
+        :return: (int) mask of attacking pieces
+        """
+        if occupied is None:
+            occupied = self.white_occupied | self.black_occupied
+        base = 0 if by_white else BLACK_OFFSET
+        pieces = self.pieces
+        keep = ~removed
+        tigers = pieces[base + TIGER]
+
+        attackers = KNIGHT_ATTACKS[sq] & pieces[base + KNIGHT]
+        attackers |= KING_ATTACKS[sq] & (pieces[base + KING] | tigers)
+        # a white pawn attacks sq from the squares a black pawn on sq would attack, and vice versa
+        attackers |= PAWN_ATTACKS[1 if by_white else 0][sq] & pieces[base + PAWN]
+        attackers |= sliding_attacks(sq, occupied, ROOK_RAYS) & (pieces[base + ROOK] | tigers)
+        attackers |= sliding_attacks(sq, occupied, BISHOP_RAYS) & pieces[base + BISHOP]
+        return attackers & keep
+
+    def is_attacked(self, sq, by_white, occupied=None, removed=0):
+        return self.attackers_to(sq, by_white, occupied, removed) != 0
+
+    def attacked_squares(self, by_white, occupied):
+        """ Every square that the pieces of the given color threaten
+
+        :param by_white: (boolean) True for the squares white threatens
+        :param occupied: mask of occupied squares to use for sliders
+        :return: (int) mask of threatened squares
+        """
+        base = 0 if by_white else BLACK_OFFSET
+        pieces = self.pieces
+        tigers = pieces[base + TIGER]
+        attacks = pawn_attacks(pieces[base + PAWN], by_white)
+
+        for remaining, table in ((pieces[base + KNIGHT], KNIGHT_ATTACKS), (pieces[base + KING] | tigers, KING_ATTACKS)):
+            while remaining:
+                bit = remaining & -remaining
+                remaining ^= bit
+                attacks |= table[bit.bit_length() - 1]
+
+        for remaining, rays in ((pieces[base + ROOK] | tigers, ROOK_RAYS), (pieces[base + BISHOP], BISHOP_RAYS)):
+            while remaining:
+                bit = remaining & -remaining
+                remaining ^= bit
+                attacks |= sliding_attacks(bit.bit_length() - 1, occupied, rays)
+        return attacks
+
+    def pin_masks(self, king_sq, white, occupied):
+        """ Find the pieces of the given color that are pinned to their King
+
+        :param king_sq: square of the King
+        :param white: (boolean) color of the King and the pinned pieces
+        :param occupied: mask of every occupied square
+        :return: (dict) from the square of each pinned piece to the mask of squares it can move to without
+            leaving the King in check (the line between the King and the pinning piece, including the pinner)
+        """
+        pins = {}
+        own = self.white_occupied if white else self.black_occupied
+        enemy_base = BLACK_OFFSET if white else 0
+        tigers = self.pieces[enemy_base + TIGER]
+
+        for pinners, rays in ((self.pieces[enemy_base + ROOK] | tigers, ROOK_RAYS),
+                              (self.pieces[enemy_base + BISHOP], BISHOP_RAYS)):
+            if not pinners:
+                continue
+            for table, positive in rays:
+                ray = table[king_sq]
+                if not ray & pinners:
+                    continue
+                pinned = first_square(ray & occupied, positive)
+                if not (own >> pinned) & 1:
+                    continue
+                behind = table[pinned] & occupied
+                if behind:
+                    pinner = first_square(behind, positive)
+                    if (pinners >> pinner) & 1:
+                        pins[pinned] = ray ^ table[pinner]
+        return pins
+
+    def targets(self, piece_type, sq, white):
+        """ Pseudo legal target squares for a piece, ignoring whether its own King is left in check
+
+        :param piece_type: PAWN, KNIGHT, BISHOP, ROOK, TIGER or KING
+        :param sq: square of the piece
+        :param white: (boolean) color of the piece
+        :return: (int) mask of target squares
+        """
+        if white:
+            own, enemy = self.white_occupied, self.black_occupied
+        else:
+            own, enemy = self.black_occupied, self.white_occupied
+        occupied = own | enemy
+
+        if piece_type == PAWN:
+            forward = sq + 8 if white else sq - 8
+            mask = PAWN_ATTACKS[0 if white else 1][sq] & enemy
+            if 0 <= forward < 64 and not (occupied >> forward) & 1:
+                mask |= 1 << forward
+            return mask
+        elif piece_type == KNIGHT:
+            mask = KNIGHT_ATTACKS[sq]
+        elif piece_type == KING:
+            mask = KING_ATTACKS[sq]
+        elif piece_type == ROOK:
+            mask = sliding_attacks(sq, occupied, ROOK_RAYS)
+        elif piece_type == BISHOP:
+            mask = sliding_attacks(sq, occupied, BISHOP_RAYS)
+        else:
+            mask = sliding_attacks(sq, occupied, ROOK_RAYS) | KING_ATTACKS[sq]
+        return mask & ~own
+
+    def leaves_king_safe(self, piece_type, from_sq, to_sq, white):
+        """ True if moving the piece from from_sq to to_sq does not leave its own King threatened """
+        king_sq = to_sq if piece_type == KING else self.king_square(white)
+        to_bit = 1 << to_sq
+        occupied = ((self.white_occupied | self.black_occupied) ^ (1 << from_sq)) | to_bit
+        return not self.is_attacked(king_sq, not white, occupied, to_bit)
+
+    def is_legal_move(self, from_sq, to_sq, white):
+        """ True if the piece of the given color on from_sq can legally move to to_sq """
+        base = 0 if white else BLACK_OFFSET
+        from_bit = 1 << from_sq
+        for piece_type in range(6):
+            if self.pieces[base + piece_type] & from_bit:
+                if not (self.targets(piece_type, from_sq, white) >> to_sq) & 1:
+                    return False
+                return self.leaves_king_safe(piece_type, from_sq, to_sq, white)
+        return False
+
+    def legal_moves(self, white):
+        """ Generates all the legal moves for the given color
+
+        :param white: (boolean) True to generate white's moves
+        :return: (list) of moves that are tuples in the format: (from_row, from_col, to_row, to_col)
+        """
+        return list(self.iter_legal_moves(white))
+
+    def iter_legal_moves(self, white):
+        """ Yields the legal moves for the given color one at a time. The bitboards must not be changed until
+            the iteration is finished
+
+        :param white: (boolean) True to generate white's moves
+        :return: generator of moves that are tuples in the format: (from_row, from_col, to_row, to_col)
+        """
+        pieces = self.pieces
+        if white:
+            base, own = 0, self.white_occupied
+        else:
+            base, own = BLACK_OFFSET, self.black_occupied
+        occupied = self.white_occupied | self.black_occupied
+        king = pieces[base + KING]
+        king_sq = king.bit_length() - 1
+
+        # the King can't step onto a threatened square. It is lifted off the board so that sliders checking it
+        # also threaten the squares behind it
+        targets = KING_ATTACKS[king_sq] & ~own & ~self.attacked_squares(not white, occupied ^ king)
+        king_moves = MOVES[king_sq]
+        while targets:
+            to_bit = targets & -targets
+            targets ^= to_bit
+            yield king_moves[to_bit.bit_length() - 1]
+
+        checkers = self.attackers_to(king_sq, not white, occupied)
+        if checkers & (checkers - 1):
+            # in double check only the King can move
+            return
+        # squares a move of another piece has to land on: off its own pieces, and onto the checker or between
+        # it and the King when in check
+        allowed = ~own
+        if checkers:
+            allowed &= checkers | BETWEEN[king_sq][checkers.bit_length() - 1]
+        pins = self.pin_masks(king_sq, white, occupied)
+
+        for piece_type in (PAWN, KNIGHT, BISHOP, ROOK, TIGER):
+            remaining = pieces[base + piece_type]
+            while remaining:
+                from_bit = remaining & -remaining
+                remaining ^= from_bit
+                from_sq = from_bit.bit_length() - 1
+
+                if piece_type == PAWN:
+                    targets = self.targets(PAWN, from_sq, white)
+                elif piece_type == KNIGHT:
+                    targets = KNIGHT_ATTACKS[from_sq]
+                elif piece_type == BISHOP:
+                    targets = sliding_attacks(from_sq, occupied, BISHOP_RAYS)
+                elif piece_type == ROOK:
+                    targets = sliding_attacks(from_sq, occupied, ROOK_RAYS)
+                else:
+                    targets = sliding_attacks(from_sq, occupied, ROOK_RAYS) | KING_ATTACKS[from_sq]
+                targets &= allowed
+                if from_sq in pins:
+                    targets &= pins[from_sq]
+
+                from_moves = MOVES[from_sq]
+                while targets:
+                    to_bit = targets & -targets
+                    targets ^= to_bit
+                    yield from_moves[to_bit.bit_length() - 1]
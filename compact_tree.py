@@ -0,0 +1,280 @@
+import math
+import random
+import time
+from array import array
+
+from basic_ai import MCTSPlayer, EARLY_STOP_INTERVAL, rollout, budget_spent, remaining_simulations, \
+    cached_legal_moves, cached_is_game_over, model_copier
+from selection import C_CONSTANT
+from shatar import pack_move, unpack_move
+from transposition import TranspositionTable
+
+# A GameTree node is a Python object holding a full ShatarModel, a list of children and a list of untried moves,
+# which is a few kilobytes per node. CompactTree keeps its nodes in parallel arrays instead, so a node is one
+# slot in each column (24 bytes in all), and only the root position is stored. The position of any other node
+# is reached by playing the moves on the path from the root on the root's model, and taking them back after.
+
+DEFAULT_CAPACITY = 1 << 16
+
+# marks a node whose children haven't been generated yet
+NOT_EXPANDED = -1
+NO_PARENT = -1
+
+
+class CompactTree(object):
+    """ Monte Carlo search tree stored in preallocated array columns, indexed by node number.
+
+    The children of a node are generated all at once the first time the search reaches it, and take up
+    consecutive slots, so a node only needs the index of its first child and how many it has. Wins are counted
+    for the side that played the move into the node, with the same scoring as GameTree (1 for a win, 0.5 for a
+    draw and -1 for a loss), so the root's children can be compared like GameTree's children. Selection is
+    UCB1 with each node's own visit count as the parent visits.
+
+    Attributes:
+        model (ShatarModel): position at the root, which is moved on during a search and put back afterwards
+        size (int): number of nodes in use
+        capacity (int): number of nodes the columns have room for, doubled whenever they fill up
+        visits (array): number of simulations through each node
+        wins (array): wins of each node for the side that moved into it
+        parents (array): index of each node's parent, NO_PARENT for the root
+        first_child (array): index of each node's first child, NOT_EXPANDED if it has none yet
+        num_children (array): number of children of each node
+        moves (array): packed move that leads to each node from its parent
+    """
+
+    def __init__(self, model, random_rollout=True, table=None, capacity=DEFAULT_CAPACITY, evaluator=None):
+        if capacity < 1:
+            raise ValueError("Compact tree needs room for at least one node")
+        if table is None:
+            table = TranspositionTable()
+        self.model = model
+        self.random_rollout = random_rollout
+        self.evaluator = evaluator
+        self.table = table
+        self.capacity = capacity
+        self.visits = array('i', bytes(4 * capacity))
+        self.wins = array('d', bytes(8 * capacity))
+        self.parents = array('i', [NO_PARENT]) * capacity
+        self.first_child = array('i', [NOT_EXPANDED]) * capacity
+        self.num_children = array('H', bytes(2 * capacity))
+        self.moves = array('H', bytes(2 * capacity))
+        # the root
+        self.size = 1
+
+    def grow(self, needed):
+        """ Double the columns until there is room for the given number of nodes """
+        extra = self.capacity
+        while self.capacity + extra < needed:
+            extra *= 2
+        self.visits.extend(array('i', bytes(4 * extra)))
+        self.wins.extend(array('d', bytes(8 * extra)))
+        self.parents.extend(array('i', [NO_PARENT]) * extra)
+        self.first_child.extend(array('i', [NOT_EXPANDED]) * extra)
+        self.num_children.extend(array('H', bytes(2 * extra)))
+        self.moves.extend(array('H', bytes(2 * extra)))
+        self.capacity += extra
+
+    def expand(self, node):
+        """ Add every legal move of the current position as a child of the node
+
+        :param node: index of the node whose position the model is at
+        """
+        legal_moves = cached_legal_moves(self.model, self.table)
+        first = self.size
+        if first + len(legal_moves) > self.capacity:
+            self.grow(first + len(legal_moves))
+
+        for i, move in enumerate(legal_moves):
+            self.parents[first + i] = node
+            self.moves[first + i] = pack_move(move)
+        self.first_child[node] = first
+        self.num_children[node] = len(legal_moves)
+        self.size += len(legal_moves)
+
+    def select_child(self, node, c=C_CONSTANT):
+        """ Child of an expanded node to search next: an unvisited child if there is one, otherwise the child
+        with the best UCB1 value. Ties are broken at random """
+        first = self.first_child[node]
+        end = first + self.num_children[node]
+        visits = self.visits
+        wins = self.wins
+
+        unvisited = [child for child in range(first, end) if visits[child] == 0]
+        if unvisited:
+            return random.choice(unvisited)
+
+        log_parent_visits = math.log(visits[node])
+        max_of_ucb = float('-inf')
+        best_children = []
+        for child in range(first, end):
+            ni = visits[child]
+            ucb = wins[child] / ni + c * math.sqrt(2 * log_parent_visits / ni)
+            if ucb > max_of_ucb:
+                max_of_ucb = ucb
+                best_children = [child]
+            elif ucb == max_of_ucb:
+                best_children.append(child)
+        return random.choice(best_children)
+
+    def simulate(self):
+        """ Run one selection, expansion, rollout and backup from the root """
+        model = self.model
+        node = 0
+        # (node, whether white played the move into it) for every node below the root on the path
+        path = []
+        undo_stack = []
+
+        while cached_is_game_over(model, self.table) == 2:
+            if self.first_child[node] == NOT_EXPANDED:
+                self.expand(node)
+                if self.num_children[node] == 0:
+                    break
+            node = self.select_child(node)
+            path.append((node, model.to_play))
+            undo_stack.append(model.make_move(unpack_move(self.moves[node])))
+            if self.visits[node] == 0:
+                # a new node, play the rest of the game out from here
+                break
+
+        result = cached_is_game_over(model, self.table)
+        if result == 2:
+            result = rollout(model, self.random_rollout, self.evaluator)
+
+        while undo_stack:
+            model.unmake_move(undo_stack.pop())
+
+        self.visits[0] += 1
+        for node, white in path:
+            self.visits[node] += 1
+            if result == 0:
+                self.wins[node] += 0.5
+            elif (result == 1) == white:
+                self.wins[node] += 1
+            else:
+                self.wins[node] -= 1
+
+    def best_action(self, simulation_no=None, deadline=None):
+        """ Run simulations from the root and return the most visited child, like GameTree.best_action
+
+        :param simulation_no: number of rollouts to run, or None for no limit
+        :param deadline: time.time() after which no more rollouts are started, or None for no limit
+        :return: CompactNode of the most visited child, or of the root if the game is over
+        """
+        if simulation_no is None and deadline is None:
+            raise ValueError("MCTS search needs a simulation number or a deadline")
+
+        start = time.time()
+        done = 0
+        while not budget_spent(done, simulation_no, deadline):
+            self.simulate()
+            done += 1
+            if done % EARLY_STOP_INTERVAL == 0 and self.lead_is_decisive(done, simulation_no, start, deadline):
+                break
+        return self.most_visited_child()
+
+    def root_children(self):
+        first = self.first_child[0]
+        if first == NOT_EXPANDED:
+            return range(0)
+        return range(first, first + self.num_children[0])
+
+    def most_visited_child(self):
+        """ Root child with the most simulations, ties broken at random, or the root if it has no children """
+        children = self.root_children()
+        if len(children) == 0:
+            # we're at a terminal node
+            return CompactNode(self, 0)
+        most_visits = max(self.visits[child] for child in children)
+        return CompactNode(self, random.choice([child for child in children if self.visits[child] == most_visits]))
+
+    def lead_is_decisive(self, done, simulation_no, start, deadline):
+        """ Whether the most visited root child can no longer be caught in the remaining budget, see
+        GameTree.lead_is_decisive """
+        children = self.root_children()
+        if len(children) == 0:
+            return False
+
+        remaining = remaining_simulations(done, simulation_no)
+        if deadline is not None:
+            now = time.time()
+            if now > start:
+                remaining = min(remaining, done / (now - start) * (deadline - now))
+
+        first = second = 0
+        for child in children:
+            if self.visits[child] > first:
+                first, second = self.visits[child], first
+            elif self.visits[child] > second:
+                second = self.visits[child]
+        return first - second > remaining
+
+    def __len__(self):
+        return self.size
+
+
+class CompactNode(object):
+    """ Read only view of one node of a CompactTree, with the attributes that callers use on a GameTree """
+
+    __slots__ = ('tree', 'index')
+
+    def __init__(self, tree, index):
+        self.tree = tree
+        self.index = index
+
+    @property
+    def parent_action(self):
+        if self.index == 0:
+            return None
+        return unpack_move(self.tree.moves[self.index])
+
+    @property
+    def num_sims(self):
+        return self.tree.visits[self.index]
+
+    @property
+    def num_wins(self):
+        return self.tree.wins[self.index]
+
+    @property
+    def parent(self):
+        parent = self.tree.parents[self.index]
+        if parent == NO_PARENT:
+            return None
+        return CompactNode(self.tree, parent)
+
+    @property
+    def children(self):
+        first = self.tree.first_child[self.index]
+        if first == NOT_EXPANDED:
+            return []
+        return [CompactNode(self.tree, child) for child in range(first, first + self.tree.num_children[self.index])]
+
+
+class CompactMCTSPlayer(MCTSPlayer):
+    """
+    MCTSPlayer that searches on a CompactTree, which fits millions of nodes in the memory that a few hundred
+    thousand GameTree nodes need. The tree is built from scratch for every move and searched in this process.
+
+    Attributes:
+        capacity (int): number of nodes a new tree starts with room for
+        tree (CompactTree): tree of the last search
+    """
+
+    def __init__(self, white, random_rollout, table=None, capacity=DEFAULT_CAPACITY, evaluator=None):
+        super().__init__(white, random_rollout, table=table, evaluator=evaluator)
+        self.capacity = capacity
+        self.tree = None
+
+    def get_move(self, model, time_limit=None, node_limit=None):
+        if model.to_play is not self.white:
+            raise ValueError("Trying to play on wrong turn!")
+
+        if time_limit is None:
+            time_limit = self.time_limit
+        if node_limit is None:
+            node_limit = self.simulation_number
+        deadline = None if time_limit is None else time.time() + time_limit
+
+        self.tree = CompactTree(model_copier(model), random_rollout=self.random_rollout, table=self.table,
+                                capacity=self.capacity, evaluator=self.evaluator)
+        return self.tree.best_action(node_limit, deadline=deadline).parent_action
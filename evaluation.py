@@ -0,0 +1,258 @@
+from abc import ABC, abstractmethod
+
+from pieces import MATERIAL_VALUE, PIECE_CODES
+
+# Static evaluation of positions. Scores are in material units from white's point of view, so a Pawn is worth
+# MATERIAL_VALUE['P'] and a positive score means white is ahead.
+#
+# An Evaluator scores ShatarModels, and the flat 64 square boards of Playout and batch_eval (piece codes, see
+# CODE_SYMBOLS). The TaperedEvaluator adds piece-square tables to the material, blended between a middlegame
+# and an endgame table by how much material other than Pawns and Kings is left. Its sums are kept up to date by
+# ShatarModel.make_move the same way as the Zobrist key, so evaluating a model costs the same at any point of a
+# search: the model holds middlegame_score, endgame_score and phase, and the evaluator only blends them.
+
+# Piece-square tables, in material units for a white piece, from row 0 (white's back rank) to row 7.
+# Black pieces use the same tables upside down.
+PAWN_TABLE = [
+    0, 0, 0, 0, 0, 0, 0, 0,
+    0, 0, 0, -0.1, -0.1, 0, 0, 0,
+    0, 0, 0.05, 0.1, 0.1, 0.05, 0, 0,
+    0.05, 0.05, 0.1, 0.2, 0.2, 0.1, 0.05, 0.05,
+    0.1, 0.1, 0.2, 0.3, 0.3, 0.2, 0.1, 0.1,
+    0.3, 0.3, 0.4, 0.5, 0.5, 0.4, 0.3, 0.3,
+    # one step from becoming a Tiger
+    0.8, 0.8, 0.9, 1, 1, 0.9, 0.8, 0.8,
+    0, 0, 0, 0, 0, 0, 0, 0,
+]
+# with few pieces left to stop them, Pawns gain more the closer they get to promotion. This goes by rank only,
+# whether a Pawn is passed isn't checked, and tops out well short of PROMOTION_GAIN
+PAWN_ENDGAME_TABLE = [
+    0, 0, 0, 0, 0, 0, 0, 0,
+    0, 0, 0, 0, 0, 0, 0, 0,
+    0.1, 0.1, 0.1, 0.1, 0.1, 0.1, 0.1, 0.1,
+    0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2,
+    0.4, 0.4, 0.4, 0.4, 0.4, 0.4, 0.4, 0.4,
+    0.8, 0.8, 0.8, 0.8, 0.8, 0.8, 0.8, 0.8,
+    1.6, 1.6, 1.6, 1.6, 1.6, 1.6, 1.6, 1.6,
+    0, 0, 0, 0, 0, 0, 0, 0,
+]
+KNIGHT_TABLE = [
+    -0.5, -0.4, -0.3, -0.3, -0.3, -0.3, -0.4, -0.5,
+    -0.4, -0.2, 0, 0.05, 0.05, 0, -0.2, -0.4,
+    -0.3, 0.05, 0.1, 0.15, 0.15, 0.1, 0.05, -0.3,
+    -0.3, 0, 0.15, 0.2, 0.2, 0.15, 0, -0.3,
+    -0.3, 0.05, 0.15, 0.2, 0.2, 0.15, 0.05, -0.3,
+    -0.3, 0, 0.1, 0.15, 0.15, 0.1, 0, -0.3,
+    -0.4, -0.2, 0, 0, 0, 0, -0.2, -0.4,
+    -0.5, -0.4, -0.3, -0.3, -0.3, -0.3, -0.4, -0.5,
+]
+BISHOP_TABLE = [
+    -0.2, -0.1, -0.1, -0.1, -0.1, -0.1, -0.1, -0.2,
+    -0.1, 0.05, 0, 0, 0, 0, 0.05, -0.1,
+    -0.1, 0.1, 0.1, 0.1, 0.1, 0.1, 0.1, -0.1,
+    -0.1, 0, 0.1, 0.1, 0.1, 0.1, 0, -0.1,
+    -0.1, 0.05, 0.05, 0.1, 0.1, 0.05, 0.05, -0.1,
+    -0.1, 0, 0.05, 0.1, 0.1, 0.05, 0, -0.1,
+    -0.1, 0, 0, 0, 0, 0, 0, -0.1,
+    -0.2, -0.1, -0.1, -0.1, -0.1, -0.1, -0.1, -0.2,
+]
+ROOK_TABLE = [
+    0, 0, 0, 0.05, 0.05, 0, 0, 0,
+    -0.05, 0, 0, 0, 0, 0, 0, -0.05,
+    -0.05, 0, 0, 0, 0, 0, 0, -0.05,
+    -0.05, 0, 0, 0, 0, 0, 0, -0.05,
+    -0.05, 0, 0, 0, 0, 0, 0, -0.05,
+    -0.05, 0, 0, 0, 0, 0, 0, -0.05,
+    # the rank the enemy pawns start on
+    0.05, 0.1, 0.1, 0.1, 0.1, 0.1, 0.1, 0.05,
+    0, 0, 0, 0, 0, 0, 0, 0,
+]
+TIGER_TABLE = [
+    -0.2, -0.1, -0.1, -0.05, -0.05, -0.1, -0.1, -0.2,
+    -0.1, 0, 0.05, 0, 0, 0, 0, -0.1,
+    -0.1, 0.05, 0.05, 0.05, 0.05, 0.05, 0, -0.1,
+    0, 0, 0.05, 0.05, 0.05, 0.05, 0, -0.05,
+    -0.05, 0, 0.05, 0.05, 0.05, 0.05, 0, -0.05,
+    -0.1, 0, 0.05, 0.05, 0.05, 0.05, 0, -0.1,
+    -0.1, 0, 0, 0, 0, 0, 0, -0.1,
+    -0.2, -0.1, -0.1, -0.05, -0.05, -0.1, -0.1, -0.2,
+]
+# the King is safest at home behind its pawns
+KING_TABLE = [
+    0.2, 0.3, 0.1, 0, 0, 0.1, 0.3, 0.2,
+    0.2, 0.2, 0, 0, 0, 0, 0.2, 0.2,
+    -0.1, -0.2, -0.2, -0.2, -0.2, -0.2, -0.2, -0.1,
+    -0.2, -0.3, -0.3, -0.4, -0.4, -0.3, -0.3, -0.2,
+    -0.3, -0.4, -0.4, -0.5, -0.5, -0.4, -0.4, -0.3,
+    -0.3, -0.4, -0.4, -0.5, -0.5, -0.4, -0.4, -0.3,
+    -0.3, -0.4, -0.4, -0.5, -0.5, -0.4, -0.4, -0.3,
+    -0.3, -0.4, -0.4, -0.5, -0.5, -0.4, -0.4, -0.3,
+]
+# once the attackers are gone the King should come to the middle and help
+KING_ENDGAME_TABLE = [
+    -0.5, -0.3, -0.3, -0.3, -0.3, -0.3, -0.3, -0.5,
+    -0.3, -0.3, 0, 0, 0, 0, -0.3, -0.3,
+    -0.3, -0.1, 0.2, 0.3, 0.3, 0.2, -0.1, -0.3,
+    -0.3, -0.1, 0.3, 0.4, 0.4, 0.3, -0.1, -0.3,
+    -0.3, -0.1, 0.3, 0.4, 0.4, 0.3, -0.1, -0.3,
+    -0.3, -0.1, 0.2, 0.3, 0.3, 0.2, -0.1, -0.3,
+    -0.3, -0.2, -0.1, 0, 0, -0.1, -0.2, -0.3,
+    -0.5, -0.4, -0.3, -0.2, -0.2, -0.3, -0.4, -0.5,
+]
+
+# tables keyed by the white piece symbol
+MIDDLEGAME_TABLES = {'P': PAWN_TABLE, 'N': KNIGHT_TABLE, 'B': BISHOP_TABLE, 'R': ROOK_TABLE, 'Q': TIGER_TABLE,
+                     'K': KING_TABLE}
+ENDGAME_TABLES = {'P': PAWN_ENDGAME_TABLE, 'N': KNIGHT_TABLE, 'B': BISHOP_TABLE, 'R': ROOK_TABLE, 'Q': TIGER_TABLE,
+                  'K': KING_ENDGAME_TABLE}
+
+# How far a position is from the endgame: the sum of the phase weights of the pieces on the board, which is
+# MAX_PHASE at the start. Promotions can push it over MAX_PHASE, which counts as MAX_PHASE.
+PHASE_WEIGHTS = {'P': 0, 'N': 1, 'B': 1, 'R': 2, 'Q': 4, 'K': 0}
+MAX_PHASE = 24
+
+# material a side gains when a Pawn becomes a Tiger
+PROMOTION_GAIN = MATERIAL_VALUE['Q'] - MATERIAL_VALUE['P']
+
+# symbols of the pieces.PIECE_CODES codes on flat boards, negative codes are black
+CODE_SYMBOLS = {code: piece_type.SYMBOL for piece_type, code in PIECE_CODES.items()}
+CODE_SYMBOLS.update({-code: symbol.lower() for code, symbol in list(CODE_SYMBOLS.items())})
+
+
+def mirror(sq):
+    """ The same square seen from black's side of the board """
+    return (7 - sq // 8) * 8 + sq % 8
+
+
+def build_square_scores(tables):
+    """ Score of every piece on every square: its material value plus its table bonus, negative for black
+
+    :param tables: dict from white piece symbol to a white table of 64 bonuses, or None for material only
+    :return: dict from piece symbol ('P', 'p', ...) to a list of 64 scores indexed by row * 8 + col
+    """
+    scores = {}
+    for symbol, value in MATERIAL_VALUE.items():
+        if symbol.islower():
+            continue
+        bonuses = [0] * 64 if tables is None else tables[symbol]
+        scores[symbol] = [value + bonuses[sq] for sq in range(64)]
+        scores[symbol.lower()] = [-(value + bonuses[mirror(sq)]) for sq in range(64)]
+    return scores
+
+
+MATERIAL_SCORES = build_square_scores(None)
+MIDDLEGAME_SCORES = build_square_scores(MIDDLEGAME_TABLES)
+ENDGAME_SCORES = build_square_scores(ENDGAME_TABLES)
+PHASES = dict(PHASE_WEIGHTS)
+PHASES.update({symbol.lower(): weight for symbol, weight in PHASE_WEIGHTS.items()})
+
+
+def count_material_evaluation(board):
+    material = 0
+    for i in range(len(board)):
+        for j in range(len(board)):
+            piece = board[i][j]
+            if piece is not None:
+                material += piece.value
+    return material
+
+
+def score_board(board):
+    """ Middlegame and endgame table sums and the phase of a board, from a scan of every square. ShatarModel
+    keeps these up to date as it moves after computing them once
+
+    :return: (middlegame score, endgame score, phase)
+    """
+    middlegame = endgame = phase = 0
+    for row in range(8):
+        for col in range(8):
+            piece = board[row][col]
+            if piece is not None:
+                sq = row * 8 + col
+                middlegame += MIDDLEGAME_SCORES[piece.symbol][sq]
+                endgame += ENDGAME_SCORES[piece.symbol][sq]
+                phase += PHASES[piece.symbol]
+    return middlegame, endgame, phase
+
+
+def taper(middlegame, endgame, phase):
+    """ Blend of the middlegame and the endgame score, all middlegame at MAX_PHASE and all endgame at 0 """
+    phase = min(phase, MAX_PHASE)
+    return (middlegame * phase + endgame * (MAX_PHASE - phase)) / MAX_PHASE
+
+
+class Evaluator(ABC):
+    """ Static evaluation that players can be given to score positions with. Subclasses implement evaluate and
+    evaluate_codes, and can override evaluate_children when they can score many positions faster together """
+
+    @abstractmethod
+    def evaluate(self, model):
+        """ Score of the model's position, from white's point of view """
+
+    @abstractmethod
+    def evaluate_codes(self, codes):
+        """ Score of a flat board of 64 piece codes, like Playout.board, from white's point of view """
+
+    def evaluate_children(self, model, moves):
+        """ Score of the position after each move
+
+        :param model: ShatarModel, which is left as it was
+        :param moves: (list) of legal moves
+        :return: (list) of scores from white's point of view, one per move
+        """
+        scores = []
+        for move in moves:
+            undo = model.make_move(move)
+            scores.append(self.evaluate(model))
+            model.unmake_move(undo)
+        return scores
+
+
+class MaterialEvaluator(Evaluator):
+    """ Sum of the material values of the pieces, which the model keeps up to date """
+
+    def evaluate(self, model):
+        return model.material
+
+    def evaluate_children(self, model, moves):
+        # only a capture or a promotion changes the material, so the moves don't have to be played
+        board = model.board
+        material = model.material
+        scores = []
+        for from_row, from_col, to_row, to_col in moves:
+            score = material
+            captured = board[to_row][to_col]
+            if captured is not None:
+                score -= captured.value
+            piece = board[from_row][from_col]
+            if piece.symbol == 'P' and to_row == 7:
+                score += PROMOTION_GAIN
+            elif piece.symbol == 'p' and to_row == 0:
+                score -= PROMOTION_GAIN
+            scores.append(score)
+        return scores
+
+    def evaluate_codes(self, codes):
+        return sum(MATERIAL_VALUE[CODE_SYMBOLS[code]] for code in codes if code != 0)
+
+
+class TaperedEvaluator(Evaluator):
+    """ Material plus piece-square tables, blended from the middlegame to the endgame tables as the pieces come
+    off. Evaluating a model only blends the sums the model keeps up to date, so it is O(1) """
+
+    def evaluate(self, model):
+        return taper(model.middlegame_score, model.endgame_score, model.phase)
+
+    def evaluate_codes(self, codes):
+        middlegame = endgame = phase = 0
+        for sq, code in enumerate(codes):
+            if code != 0:
+                symbol = CODE_SYMBOLS[code]
+                middlegame += MIDDLEGAME_SCORES[symbol][sq]
+                endgame += ENDGAME_SCORES[symbol][sq]
+                phase += PHASES[symbol]
+        return taper(middlegame, endgame, phase)
+
+
+MATERIAL_EVALUATOR = MaterialEvaluator()
+TAPERED_EVALUATOR = TaperedEvaluator()
@@ -0,0 +1,296 @@
+import os
+import struct
+
+from shatar import ShatarModel, square_name, parse_square, pack_move, unpack_move
+
+# Game records in two forms that hold the same thing: the players, the starting position if it isn't the
+# usual one, the moves and the result.
+#
+# The text form looks like PGN, with squares named by column a-h and row 1-8 (row 1 is white's back rank), and
+# moves written as the from square followed by the to square:
+#
+#     [White "GreedyPlayer"]
+#     [Black "RandomPlayer"]
+#     [Result "1-0"]
+#
+#     1. d1d3 e8d7 2. ...
+#     1-0
+#
+# The binary form is a file header followed by one record per game: a signed result byte, the number of moves,
+# the length of the starting FEN (0 for the usual start), the FEN, the player names and then every move packed
+# into two bytes by shatar.pack_move. Both forms are written one game at a time and read back as a stream,
+# so files don't have to fit in memory.
+
+BINARY_MAGIC = b'SHTR'
+BINARY_VERSION = 2
+FILE_HEADER = struct.Struct('<4sB')
+# result, number of moves, lengths of the starting FEN, the white name and the black name, for each version
+# that can be read. Version 1 only had a byte for each name length
+GAME_HEADERS = {1: struct.Struct('<bHHBB'), 2: struct.Struct('<bHHHH')}
+GAME_HEADER = GAME_HEADERS[BINARY_VERSION]
+# longest FEN or player name, in bytes, that fits in the game header
+MAX_FIELD_LENGTH = 0xFFFF
+MOVE = struct.Struct('<H')
+
+# is_game_over result of a game that was stopped before the end
+UNFINISHED = 2
+RESULT_TOKENS = {1: '1-0', -1: '0-1', 0: '1/2-1/2', UNFINISHED: '*'}
+TOKEN_RESULTS = {token: result for result, token in RESULT_TOKENS.items()}
+
+
+def move_to_text(move):
+    """ (from_row, from_col, to_row, to_col) move as 'd1d3' """
+    return square_name(move[0], move[1]) + square_name(move[2], move[3])
+
+
+def text_to_move(text):
+    """ Inverse of move_to_text """
+    if len(text) != 4:
+        raise ValueError("Not a move: " + text)
+    return parse_square(text[:2]) + parse_square(text[2:])
+
+
+class GameRecord(object):
+    """ Moves and result of one game
+
+    Attributes:
+        white (str): name of the white player
+        black (str): name of the black player
+        start_fen (str): ShatarModel.to_fen of the starting position, or None for the usual start
+        moves (list): (from_row, from_col, to_row, to_col) moves in the order they were played
+        result (int): is_game_over result, 1 if white won, -1 if black won, 0 for a draw, UNFINISHED if the game
+            was stopped before the end
+    """
+
+    def __init__(self, white='?', black='?', start_fen=None, moves=None, result=UNFINISHED):
+        self.white = white
+        self.black = black
+        self.start_fen = start_fen
+        self.moves = [] if moves is None else moves
+        self.result = result
+
+    @classmethod
+    def from_model(cls, model, white='?', black='?'):
+        """ Empty record of a game that starts from the model's position """
+        start_fen = model.to_fen()
+        if start_fen == ShatarModel().to_fen():
+            start_fen = None
+        return cls(white, black, start_fen)
+
+    def record(self, move):
+        self.moves.append(tuple(move))
+
+    def finish(self, result):
+        self.result = result
+
+    def start_model(self):
+        """ New model of the starting position """
+        return ShatarModel() if self.start_fen is None else ShatarModel.from_fen(self.start_fen)
+
+    def replay(self, validate=False):
+        """ Play the game through again
+
+        :param validate: check every move with ShatarModel.move instead of playing it without any checks
+        :return: generator of (model, move, result), where model is the position before the move. The same model
+            is moved on after every step, so copy it to keep a position
+        """
+        model = self.start_model()
+        for move in self.moves:
+            yield model, move, self.result
+            if validate:
+                model.move(*move)
+            else:
+                model.make_move(move)
+
+    def to_text(self):
+        lines = [f'[White "{self.white}"]', f'[Black "{self.black}"]']
+        if self.start_fen is not None:
+            lines.append(f'[Start "{self.start_fen}"]')
+        lines.append(f'[Result "{RESULT_TOKENS[self.result]}"]')
+        lines.append('')
+
+        tokens = []
+        white_to_play = self.start_model().to_play
+        move_number = 1
+        if not white_to_play:
+            tokens.append('1...')
+        for move in self.moves:
+            if white_to_play:
+                tokens.append(f'{move_number}.')
+            else:
+                move_number += 1
+            tokens.append(move_to_text(move))
+            white_to_play = not white_to_play
+        tokens.append(RESULT_TOKENS[self.result])
+
+        # keep lines short like PGN does
+        line = ''
+        for token in tokens:
+            if line and len(line) + 1 + len(token) > 80:
+                lines.append(line)
+                line = token
+            else:
+                line = token if not line else line + ' ' + token
+        lines.append(line)
+        return '\n'.join(lines) + '\n'
+
+    def to_bytes(self):
+        start_fen = b'' if self.start_fen is None else self.start_fen.encode()
+        white = self.white.encode()
+        black = self.black.encode()
+        if max(len(start_fen), len(white), len(black)) > MAX_FIELD_LENGTH:
+            raise ValueError("Starting FEN or player name is too long for a binary game record")
+        header = GAME_HEADER.pack(self.result, len(self.moves), len(start_fen), len(white), len(black))
+        moves = b''.join(MOVE.pack(pack_move(move)) for move in self.moves)
+        return header + start_fen + white + black + moves
+
+
+def parse_tag(line):
+    """ (name, value) of a '[Name "value"]' line """
+    name, _, value = line.strip()[1:-1].partition(' ')
+    return name, value.strip().strip('"')
+
+
+def read_text_games(file):
+    """ Games of a text file, one at a time
+
+    :param file: file opened for reading text
+    :return: generator of GameRecord
+    """
+    record = None
+    for line in file:
+        line = line.strip()
+        if not line:
+            continue
+        if record is None:
+            record = GameRecord()
+        if line.startswith('['):
+            name, value = parse_tag(line)
+            if name == 'White':
+                record.white = value
+            elif name == 'Black':
+                record.black = value
+            elif name == 'Start':
+                record.start_fen = value
+            continue
+
+        for token in line.split():
+            if token in TOKEN_RESULTS:
+                # the result token ends the game
+                record.result = TOKEN_RESULTS[token]
+                yield record
+                record = None
+                break
+            if not token.endswith('.'):
+                record.record(text_to_move(token))
+
+    if record is not None:
+        raise ValueError("Game record ends without a result")
+
+
+def read_exactly(file, size):
+    data = file.read(size)
+    if len(data) != size:
+        raise ValueError("Game record file is cut off")
+    return data
+
+
+def read_binary_games(file):
+    """ Games of a binary file, one at a time
+
+    :param file: file opened for reading bytes
+    :return: generator of GameRecord
+    """
+    magic, version = FILE_HEADER.unpack(read_exactly(file, FILE_HEADER.size))
+    if magic != BINARY_MAGIC:
+        raise ValueError("Not a binary game record file")
+    if version not in GAME_HEADERS:
+        raise ValueError("Unknown binary game record version " + str(version))
+    game_header = GAME_HEADERS[version]
+
+    while True:
+        header = file.read(game_header.size)
+        if not header:
+            return
+        if len(header) != game_header.size:
+            raise ValueError("Game record file is cut off")
+        result, num_moves, fen_length, white_length, black_length = game_header.unpack(header)
+        start_fen = read_exactly(file, fen_length).decode() if fen_length else None
+        white = read_exactly(file, white_length).decode()
+        black = read_exactly(file, black_length).decode()
+        packed_moves = read_exactly(file, num_moves * MOVE.size)
+        moves = [unpack_move(packed) for (packed,) in MOVE.iter_unpack(packed_moves)]
+        yield GameRecord(white, black, start_fen, moves, result)
+
+
+class GameWriter(object):
+    """ Writes games to a file as they finish, in the text or the binary form
+
+    Attributes:
+        file: file the games go to, opened by the writer
+        binary (bool): True for the binary form, False for text
+    """
+
+    def __init__(self, path, binary=False, append=False):
+        self.binary = binary
+        if binary and append and os.path.exists(path) and os.path.getsize(path) > 0:
+            # records of another version can't be mixed into the file
+            with open(path, 'rb') as file:
+                magic, version = FILE_HEADER.unpack(read_exactly(file, FILE_HEADER.size))
+            if magic != BINARY_MAGIC or version != BINARY_VERSION:
+                raise ValueError("Can only append to a binary game record file of version " + str(BINARY_VERSION))
+        mode = ('a' if append else 'w') + ('b' if binary else '')
+        self.file = open(path, mode)
+        if binary and self.file.tell() == 0:
+            self.file.write(FILE_HEADER.pack(BINARY_MAGIC, BINARY_VERSION))
+
+    def write(self, record):
+        if self.binary:
+            self.file.write(record.to_bytes())
+        else:
+            self.file.write(record.to_text() + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def export_games(records, path, binary=False):
+    """ Write many games to a new file
+
+    :param records: iterable of GameRecord, which can be a generator
+    :return: (int) number of games written
+    """
+    count = 0
+    with GameWriter(path, binary=binary) as writer:
+        for record in records:
+            writer.write(record)
+            count += 1
+    return count
+
+
+def read_games(path):
+    """ Games of a file in either form, one at a time. The form is told apart by the binary file header """
+    with open(path, 'rb') as file:
+        binary = file.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+    if binary:
+        with open(path, 'rb') as file:
+            yield from read_binary_games(file)
+    else:
+        with open(path) as file:
+            yield from read_text_games(file)
+
+
+def replay_games(path, validate=False):
+    """ Every position of every game of a file, without loading more than one game at a time
+
+    :return: generator of (model, move, result), see GameRecord.replay
+    """
+    for record in read_games(path):
+        yield from record.replay(validate)
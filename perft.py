@@ -0,0 +1,140 @@
+import argparse
+import time
+
+from shatar import ShatarModel
+
+# Perft counts the leaf nodes of the legal move tree to a fixed depth. Like chess perft it only exercises
+# move generation: every legal move is played, and the game is not stopped early by the draw rules in
+# is_game_over (only having a King, the capture clock) or by mate, which just leaves a position with no moves.
+
+# name: (FEN in the ShatarModel.get_fen format, which from_fen reads, [node count at depth 1, depth 2, ...])
+# 'default' and 'tough' are DEFAULT_BOARD and TOUGH_BOARD with white to play
+REFERENCE_POSITIONS = {
+    'default': ('rnbqkbnr/ppp1pppp/8/3p4/3P4/8/PPP1PPPP/RNBQKBNR 1', [20, 400, 8426, 177344]),
+    'tough': ('k7/p7/1P6/8/6p1/8/Q7/K7 1', [18, 71, 1335, 6927, 135375]),
+    'promotion': ('4k3/1P6/8/8/8/8/6p1/4K3 1', [5, 27, 233, 1769, 18088]),
+    'promotion_capture': ('r1n1k3/1P6/8/8/8/8/6p1/4KB1R 0', [20, 348, 6320, 125942]),
+    'check_block': ('r7/3k4/8/1q6/8/4r3/2R5/4K1QR 1', [5, 257, 7374]),
+    'pin': ('4k3/8/8/8/1b6/8/3B4/R3K3 1', [16, 184, 3584, 43136]),
+    'double_check': ('4k3/8/8/8/8/5n2/8/r3K2R 1', [2, 54, 819, 18458]),
+}
+
+
+def perft(model, depth):
+    """ Count the positions reached by playing every legal move sequence of the given length
+
+    :param model: ShatarModel, which is left exactly as it was
+    :param depth: number of moves to play
+    :return: (int) number of leaf positions
+    """
+    if depth == 0:
+        return 1
+    moves = model.generate_legal_moves()
+    if depth == 1:
+        return len(moves)
+
+    nodes = 0
+    for move in moves:
+        undo = model.make_move(move)
+        nodes += perft(model, depth - 1)
+        model.unmake_move(undo)
+    return nodes
+
+
+def divide(model, depth):
+    """ Perft split up by the first move, which narrows down where two move generators disagree
+
+    :param model: ShatarModel, which is left exactly as it was
+    :param depth: number of moves to play, including the first one
+    :return: (dict) from each legal move to the number of leaf positions under it
+    """
+    counts = {}
+    for move in model.generate_legal_moves():
+        undo = model.make_move(move)
+        counts[move] = perft(model, depth - 1)
+        model.unmake_move(undo)
+    return counts
+
+
+def run_perft(model, max_depth, show_divide=False):
+    """ Print node counts and speed for every depth up to max_depth
+
+    :return: (list) of node counts, one per depth
+    """
+    if max_depth < 1:
+        raise ValueError("Perft needs a depth of at least 1")
+    counts = []
+    for depth in range(1, max_depth + 1):
+        start = time.perf_counter()
+        if show_divide and depth == max_depth:
+            breakdown = divide(model, depth)
+            nodes = sum(breakdown.values())
+        else:
+            nodes = perft(model, depth)
+        elapsed = time.perf_counter() - start
+        counts.append(nodes)
+        nodes_per_second = nodes / elapsed if elapsed > 0 else float('inf')
+        print(f'depth {depth}: {nodes} nodes in {elapsed:.3f} seconds ({nodes_per_second:.0f} nodes/s)')
+
+    if show_divide:
+        for move, nodes in sorted(breakdown.items()):
+            print(f'{move}: {nodes}')
+    return counts
+
+
+def check_reference_positions(max_depth=None, bitboards=False):
+    """ Run perft on every reference position and compare with the stored counts
+
+    :param max_depth: stop each position at this depth, or None to run every stored depth
+    :param bitboards: True to run the models on bitboards
+    :return: (boolean) True if every count matched
+    """
+    all_match = True
+    total_nodes = 0
+    start = time.perf_counter()
+
+    for name, (fen, expected_counts) in REFERENCE_POSITIONS.items():
+        model = ShatarModel.from_fen(fen, bitboards=bitboards)
+        for depth, expected in enumerate(expected_counts, start=1):
+            if max_depth is not None and depth > max_depth:
+                break
+            nodes = perft(model, depth)
+            total_nodes += nodes
+            if nodes != expected:
+                all_match = False
+                print(f'{name} depth {depth}: got {nodes} nodes, expected {expected}')
+
+    elapsed = time.perf_counter() - start
+    print(f'{"all counts match" if all_match else "MISMATCH"}: {total_nodes} nodes in {elapsed:.3f} seconds '
+          f'({total_nodes / elapsed:.0f} nodes/s)')
+    return all_match
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Count legal move tree leaves to benchmark and verify move generation')
+    parser.add_argument('position', nargs='?', default='default',
+                        help='name of a reference position (' + ', '.join(REFERENCE_POSITIONS) + ') or a FEN')
+    parser.add_argument('depth', nargs='?', type=int, default=3)
+    parser.add_argument('--divide', action='store_true', help='break the deepest count down by first move')
+    parser.add_argument('--bitboards', action='store_true', help='run the model on bitboards')
+    parser.add_argument('--check', nargs='?', type=int, const=0, metavar='MAX_DEPTH',
+                        help='verify every reference position instead, up to MAX_DEPTH or every stored depth')
+    args = parser.parse_args()
+    if args.depth < 1:
+        parser.error('depth must be at least 1')
+
+    if args.check is not None:
+        if not check_reference_positions(args.check or None, bitboards=args.bitboards):
+            raise SystemExit(1)
+        return
+
+    fen = args.position
+    if fen in REFERENCE_POSITIONS:
+        fen = REFERENCE_POSITIONS[fen][0]
+    model = ShatarModel.from_fen(fen, bitboards=args.bitboards)
+    print(model)
+    run_perft(model, args.depth, show_divide=args.divide)
+
+
+if __name__ == '__main__':
+    main()
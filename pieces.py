@@ -3,6 +3,11 @@ ROOK_DIRECTIONS = [(1, 0), (-1, 0), (0, 1), (0, -1)]
 KNIGHT_DIRECTIONS = [(2, 1), (2, -1), (1, 2), (1, -2), (-2, 1), (-2, -1), (-1, 2), (-1, -2)]
 BISHOP_DIRECTIONS = [(1, 1), (1, -1), (-1, 1), (-1, -1)]
 
+MATERIAL_VALUE = {'k': 0, 'K': 0, 'p': -1, 'P': 1, 'q': -7, 'Q': 7, 'r': -5, 'R': 5, 'b': -3, 'B': 3, 'n': -3, 'N': 3}
+
+# the shared piece objects, keyed by (piece class, white)
+FLYWEIGHTS = {}
+
 
 def puts_self_in_check(board, from_row, from_col, to_row, to_col, white):
     """ Determines if the given move puts the given color in check
@@ -110,15 +115,64 @@ def get_piece_delta(row_diff, col_diff):
     return row, col
 
 
+def build_step_targets(directions):
+    """ Build a table of the squares a piece can reach in one step in each of the given directions
+
+    :param directions: list of (row, col) deltas
+    :return: 8x8 list of frozensets of (row, col) squares, indexed by the square the piece is on
+    """
+    table = []
+    for row in range(8):
+        table_row = []
+        for col in range(8):
+            table_row.append(frozenset((row + d_row, col + d_col) for d_row, d_col in directions
+                                       if not is_invalid_indices(row + d_row, col + d_col)))
+        table.append(table_row)
+    return table
+
+
+def build_rays():
+    """ Build a table of the squares a sliding piece passes over in each direction on an empty board
+
+    :return: 8x8 list of dicts from direction (row, col) to a tuple of (row, col) squares, nearest first
+    """
+    table = []
+    for row in range(8):
+        table_row = []
+        for col in range(8):
+            rays = {}
+            for d_row, d_col in KING_DIRECTIONS:
+                ray = []
+                to_row, to_col = row + d_row, col + d_col
+                while not is_invalid_indices(to_row, to_col):
+                    ray.append((to_row, to_col))
+                    to_row += d_row
+                    to_col += d_col
+                rays[(d_row, d_col)] = tuple(ray)
+            table_row.append(rays)
+        table.append(table_row)
+    return table
+
+
+KING_TARGETS = build_step_targets(KING_DIRECTIONS)
+KNIGHT_TARGETS = build_step_targets(KNIGHT_DIRECTIONS)
+# the Tiger's king steps that are not already the first square of one of its rook rays
+TIGER_STEP_TARGETS = build_step_targets(BISHOP_DIRECTIONS)
+# squares a pawn captures on, indexed by [white][row][col]
+PAWN_CAPTURE_TARGETS = [build_step_targets([(-1, -1), (-1, 1)]), build_step_targets([(1, -1), (1, 1)])]
+RAYS = build_rays()
+
+
 def rook_bishop_move_helper(board, from_row, from_col, to_row, to_col, row_diff, col_diff, white):
     if is_invalid_indices(from_row, from_col) or is_invalid_indices(to_row, to_col):
         return False
 
-    delta = get_piece_delta(row_diff, col_diff)
+    ray = RAYS[from_row][from_col][get_piece_delta(row_diff, col_diff)]
+    distance = max(abs(row_diff), abs(col_diff))
 
-    for i in range(1, max(abs(row_diff), abs(col_diff))):
-        square = board[from_row + delta[0] * i][from_col + delta[1] * i]
-        if square is not None:
+    for i in range(distance - 1):
+        row, col = ray[i]
+        if board[row][col] is not None:
             return False
 
     square = board[to_row][to_col]
@@ -129,14 +183,11 @@ def rook_bishop_move_helper(board, from_row, from_col, to_row, to_col, row_diff,
     return white is not square.white
 
 
-def king_knight_move_helper(board, directions, from_row, from_col, to_row, to_col, white):
+def king_knight_move_helper(board, targets, from_row, from_col, to_row, to_col, white):
     if is_invalid_indices(from_row, from_col) or is_invalid_indices(to_row, to_col):
         return False
 
-    row_diff = to_row - from_row
-    col_diff = to_col - from_col
-
-    if (row_diff, col_diff) not in directions:
+    if (to_row, to_col) not in targets[from_row][from_col]:
         return False
 
     piece = board[to_row][to_col]
@@ -146,32 +197,221 @@ def king_knight_move_helper(board, directions, from_row, from_col, to_row, to_co
         return True
 
 
+def step_moves(board, targets, from_row, from_col, white):
+    """ Pseudo legal moves for a piece that steps to the squares in the given target table
+
+    :param board:
+    :param targets: KING_TARGETS, KNIGHT_TARGETS or TIGER_STEP_TARGETS
+    :param from_row:
+    :param from_col:
+    :param white: color of the moving piece
+    :return: returns a list of moves in format [(from_row, from_col, to_row, to_col), ...]
+    """
+    moves = []
+
+    for to_row, to_col in targets[from_row][from_col]:
+        piece = board[to_row][to_col]
+        if piece is None or piece.white != white:
+            moves.append((from_row, from_col, to_row, to_col))
+
+    return moves
+
+
+def slider_moves(board, directions, from_row, from_col, white):
+    """ Pseudo legal moves for a piece that slides along RAYS in the given directions
+
+    :param board:
+    :param directions: ROOK_DIRECTIONS or BISHOP_DIRECTIONS
+    :param from_row:
+    :param from_col:
+    :param white: color of the moving piece
+    :return: returns a list of moves in format [(from_row, from_col, to_row, to_col), ...]
+    """
+    moves = []
+    rays = RAYS[from_row][from_col]
+
+    for direction in directions:
+        for to_row, to_col in rays[direction]:
+            piece = board[to_row][to_col]
+            if piece is None:
+                moves.append((from_row, from_col, to_row, to_col))
+            else:
+                if piece.white != white:
+                    moves.append((from_row, from_col, to_row, to_col))
+                break
+
+    return moves
+
+
+def attackers_of(board, row, col, white):
+    """ Find every piece of the given color that could capture a piece on the given square
+
+    :param board:
+    :param row:
+    :param col:
+    :param white: the color of the attackers (True to find white pieces)
+    :return: (list) of (row, col) squares of the attacking pieces
+    """
+    attackers = []
+
+    for i, j in KNIGHT_TARGETS[row][col]:
+        piece = board[i][j]
+        if piece is not None and piece.white == white and isinstance(piece, Knight):
+            attackers.append((i, j))
+
+    for i, j in KING_TARGETS[row][col]:
+        piece = board[i][j]
+        if piece is not None and piece.white == white and \
+                (isinstance(piece, King) or (isinstance(piece, Tiger) and i != row and j != col)):
+            attackers.append((i, j))
+
+    # a white pawn captures on this square from where a black pawn here would capture, and vice versa
+    for i, j in PAWN_CAPTURE_TARGETS[not white][row][col]:
+        piece = board[i][j]
+        if piece is not None and piece.white == white and isinstance(piece, Pawn):
+            attackers.append((i, j))
+
+    rays = RAYS[row][col]
+    for direction in KING_DIRECTIONS:
+        diagonal = direction[0] != 0 and direction[1] != 0
+        for i, j in rays[direction]:
+            piece = board[i][j]
+            if piece is None:
+                continue
+            if piece.white == white:
+                if diagonal and isinstance(piece, Bishop):
+                    attackers.append((i, j))
+                # an adjacent Tiger was already found as a king step
+                elif not diagonal and (isinstance(piece, Rook) or isinstance(piece, Tiger)):
+                    attackers.append((i, j))
+            break
+
+    return attackers
+
+
+def pinned_pieces(board, king_row, king_col, white):
+    """ Find the pieces of the given color that are pinned to their King
+
+    :param board:
+    :param king_row:
+    :param king_col:
+    :param white: the color of the King and the pinned pieces
+    :return: (dict) from the (row, col) of each pinned piece to the set of squares it can move to without
+        leaving the King in check (the line between the King and the pinning piece, including the pinner)
+    """
+    pins = {}
+    rays = RAYS[king_row][king_col]
+
+    for direction in KING_DIRECTIONS:
+        diagonal = direction[0] != 0 and direction[1] != 0
+        pinned = None
+        for i, j in rays[direction]:
+            piece = board[i][j]
+            if piece is None:
+                continue
+            if pinned is None:
+                if piece.white != white:
+                    break
+                pinned = (i, j)
+            else:
+                if piece.white != white and \
+                        (isinstance(piece, Bishop) if diagonal else isinstance(piece, (Rook, Tiger))):
+                    pins[pinned] = frozenset(squares_between(king_row, king_col, i, j) + [(i, j)])
+                break
+
+    return pins
+
+
+def squares_between(from_row, from_col, to_row, to_col):
+    """ The squares strictly between two squares on the same row, column or diagonal
+
+    :return: (list) of (row, col) squares, empty if the squares are adjacent or not on a line
+    """
+    row_diff = to_row - from_row
+    col_diff = to_col - from_col
+    if not (row_diff == 0 or col_diff == 0 or abs(row_diff) == abs(col_diff)):
+        return []
+
+    ray = RAYS[from_row][from_col][get_piece_delta(row_diff, col_diff)]
+    return list(ray[:max(abs(row_diff), abs(col_diff)) - 1])
+
+
 class Piece(object):
-    """ Superclass for all Pieces in Shatar
+    """ Superclass for all Pieces in Shatar.
+
+    Pieces are immutable flyweights: there is exactly one object for each color of each piece type, and
+    calling a piece class (e.g. Pawn(white=False)) returns that shared object. Boards can share pieces freely,
+    and copying a board or a piece allocates no new pieces.
 
     Attributes:
         white (boolean): whether or not this is a white piece
+        symbol (str): FEN letter of the piece, upper case for white ('P', 'k', ...)
+        value (int): material value of the piece, positive for white and negative for black
     """
 
+    __slots__ = ('white', 'symbol', 'value')
+    # white FEN letter of the piece type, set by each subclass
+    SYMBOL = None
+
+    def __new__(cls, white=True):
+        white = bool(white)
+        piece = FLYWEIGHTS.get((cls, white))
+        if piece is None:
+            piece = super().__new__(cls)
+            symbol = cls.SYMBOL if white else cls.SYMBOL.lower()
+            object.__setattr__(piece, 'white', white)
+            object.__setattr__(piece, 'symbol', symbol)
+            object.__setattr__(piece, 'value', MATERIAL_VALUE[symbol])
+            FLYWEIGHTS[(cls, white)] = piece
+        return piece
+
     def __init__(self, white=True):
-        self.white = white
+        # everything is set up once in __new__
+        pass
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Pieces are immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("Pieces are immutable")
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        # unpickle to the shared piece of this process instead of a new object
+        return type(self), (self.white,)
+
+    def __str__(self):
+        return self.symbol
+
+    def __repr__(self):
+        return self.symbol
 
     def is_legal_move(self, board, from_row, from_col, to_row, to_col):
         return self.is_threatening(board, from_row, from_col, to_row, to_col) and \
                not puts_self_in_check(board, from_row, from_col, to_row, to_col, self.white)
 
+    def generate_legal_moves(self, board, from_row, from_col):
+        """ Return a list of legal moves to make
+
+        :param board:
+        :param from_row:
+        :param from_col:
+        :return: returns a list of legal moves in format [(from_row, from_col, to_row, to_col), ...]
+        """
+        return [move for move in self.generate_pseudo_legal_moves(board, from_row, from_col)
+                if not puts_self_in_check(board, from_row, from_col, move[2], move[3], self.white)]
+
 
 class Pawn(Piece):
     """ Represents a pawn in a game of Shatar. """
 
-    def __init__(self, white=True):
-        super().__init__(white=white)
-
-    def __str__(self):
-        if self.white:
-            return 'P'
-        else:
-            return 'p'
+    __slots__ = ()
+    SYMBOL = 'P'
 
     def is_threatening(self, board, from_row, from_col, to_row, to_col):
         if is_invalid_indices(to_row, to_col) or is_invalid_indices(from_row, from_col):
@@ -200,31 +440,27 @@ class Pawn(Piece):
         else:
             return False
 
-    def generate_legal_moves(self, board, from_row, from_col):
-        """ Return a list of legal moves to make
+    def generate_pseudo_legal_moves(self, board, from_row, from_col):
+        """ Return a list of moves to make, without checking if they leave the King in check
 
         :param board:
         :param from_row:
         :param from_col:
-        :return: returns a list of legal moves in format [(from_row, from_col, to_row, to_col), ...]
+        :return: returns a list of moves in format [(from_row, from_col, to_row, to_col), ...]
         """
-        # if is_invalid_indices(from_row, from_col):
-        #     return []
-
         moves = []
 
         row_delta = 1
         if not self.white:
             row_delta = -1
 
-        if self.is_legal_move(board, from_row, from_col, from_row + row_delta, from_col):
+        if not is_invalid_indices(from_row + row_delta, from_col) and board[from_row + row_delta][from_col] is None:
             moves.append((from_row, from_col, from_row + row_delta, from_col))
 
-        if self.is_legal_move(board, from_row, from_col, from_row + row_delta, from_col + 1):
-            moves.append((from_row, from_col, from_row + row_delta, from_col + 1))
-
-        if self.is_legal_move(board, from_row, from_col, from_row + row_delta, from_col - 1):
-            moves.append((from_row, from_col, from_row + row_delta, from_col - 1))
+        for to_row, to_col in PAWN_CAPTURE_TARGETS[self.white][from_row][from_col]:
+            piece = board[to_row][to_col]
+            if piece is not None and piece.white != self.white:
+                moves.append((from_row, from_col, to_row, to_col))
 
         return moves
 
@@ -232,49 +468,31 @@ class Pawn(Piece):
 class King(Piece):
     """ Represents a King in a game of Shatar. """
 
-    def __init__(self, white=True):
-        super().__init__(white)
-
-    def __str__(self):
-        if self.white:
-            return 'K'
-        else:
-            return 'k'
+    __slots__ = ()
+    SYMBOL = 'K'
 
     def is_threatening(self, board, from_row, from_col, to_row, to_col):
         # if is_invalid_indices(to_row, to_col) or is_invalid_indices(from_row, from_col):
         #     return False
 
-        return king_knight_move_helper(board, KING_DIRECTIONS, from_row, from_col, to_row, to_col, self.white)
+        return king_knight_move_helper(board, KING_TARGETS, from_row, from_col, to_row, to_col, self.white)
 
-    def generate_legal_moves(self, board, from_row, from_col):
-        """ Return a list of legal moves to make
+    def generate_pseudo_legal_moves(self, board, from_row, from_col):
+        """ Return a list of moves to make, without checking if they leave the King in check
 
-        :return: returns a list of legal moves in format [(from_row, from_col, to_row, to_col), ...]
+        :return: returns a list of moves in format [(from_row, from_col, to_row, to_col), ...]
         """
         # if is_invalid_indices(from_row, from_col):
         #     return []
 
-        moves = []
-
-        for direction in KING_DIRECTIONS:
-            if self.is_legal_move(board, from_row, from_col, from_row + direction[0], from_col + direction[1]):
-                moves.append((from_row, from_col, from_row + direction[0], from_col + direction[1]))
-
-        return moves
+        return step_moves(board, KING_TARGETS, from_row, from_col, self.white)
 
 
 class Rook(Piece):
     """ Represents a Rook in a game of Shatar."""
 
-    def __init__(self, white=True):
-        super().__init__(white)
-
-    def __str__(self):
-        if self.white:
-            return 'R'
-        else:
-            return 'r'
+    __slots__ = ()
+    SYMBOL = 'R'
 
     def is_threatening(self, board, from_row, from_col, to_row, to_col):
         # if is_invalid_indices(to_row, to_col) or is_invalid_indices(from_row, from_col):
@@ -288,42 +506,22 @@ class Rook(Piece):
 
         return rook_bishop_move_helper(board, from_row, from_col, to_row, to_col, row_diff, col_diff, self.white)
 
-    def generate_legal_moves(self, board, from_row, from_col):
-        """ Return a list of legal moves to make
+    def generate_pseudo_legal_moves(self, board, from_row, from_col):
+        """ Return a list of moves to make, without checking if they leave the King in check
 
-        :return: returns a list of legal moves in format [(from_row, from_col, to_row, to_col), ...]
+        :return: returns a list of moves in format [(from_row, from_col, to_row, to_col), ...]
         """
         # if is_invalid_indices(from_row, from_col):
         #     return []
 
-        moves = []
-
-        for direction in ROOK_DIRECTIONS:
-            count = 1
-            blocked = False
-            while not blocked:
-                to_row = from_row + direction[0] * count
-                to_col = from_col + direction[1] * count
-                if self.is_legal_move(board, from_row, from_col, to_row, to_col):
-                    moves.append((from_row, from_col, to_row, to_col))
-                else:
-                    blocked = True
-                count += 1
-
-        return moves
+        return slider_moves(board, ROOK_DIRECTIONS, from_row, from_col, self.white)
 
 
 class Bishop(Piece):
     """ Represents a Bishop in a game of Shatar."""
 
-    def __init__(self, white=True):
-        super().__init__(white=white)
-
-    def __str__(self):
-        if self.white:
-            return 'B'
-        else:
-            return 'b'
+    __slots__ = ()
+    SYMBOL = 'B'
 
     def is_threatening(self, board, from_row, from_col, to_row, to_col):
         # if is_invalid_indices(to_row, to_col) or is_invalid_indices(from_row, from_col):
@@ -340,92 +538,80 @@ class Bishop(Piece):
 
         return rook_bishop_move_helper(board, from_row, from_col, to_row, to_col, row_diff, col_diff, self.white)
 
-    def generate_legal_moves(self, board, from_row, from_col):
-        """ Return a list of legal moves to make
+    def generate_pseudo_legal_moves(self, board, from_row, from_col):
+        """ Return a list of moves to make, without checking if they leave the King in check
 
-        :return: returns a list of legal moves in format [(from_row, from_col, to_row, to_col), ...]
+        :return: returns a list of moves in format [(from_row, from_col, to_row, to_col), ...]
         """
         # if is_invalid_indices(from_row, from_col):
         #     return []
 
-        moves = []
-
-        for direction in BISHOP_DIRECTIONS:
-            count = 1
-            blocked = False
-            while not blocked:
-                to_row = from_row + direction[0] * count
-                to_col = from_col + direction[1] * count
-                if self.is_legal_move(board, from_row, from_col, to_row, to_col):
-                    moves.append((from_row, from_col, to_row, to_col))
-                else:
-                    blocked = True
-                count += 1
-
-        return moves
+        return slider_moves(board, BISHOP_DIRECTIONS, from_row, from_col, self.white)
 
 
 class Tiger(Piece):
     """ Represents a Tiger in a game of Shatar."""
 
-    def __init__(self, white=True):
-        super().__init__(white)
-
-    def __str__(self):
-        if self.white:
-            return 'Q'
-        else:
-            return 'q'
+    __slots__ = ()
+    SYMBOL = 'Q'
 
     def is_threatening(self, board, from_row, from_col, to_row, to_col):
-        if Rook(white=self.white).is_threatening(board, from_row, from_col, to_row, to_col) or \
-                king_knight_move_helper(board, KING_DIRECTIONS, from_row, from_col, to_row, to_col, self.white):
+        row_diff = to_row - from_row
+        col_diff = to_col - from_col
+
+        if (row_diff == 0) != (col_diff == 0) and \
+                rook_bishop_move_helper(board, from_row, from_col, to_row, to_col, row_diff, col_diff, self.white):
             return True
 
-    def generate_legal_moves(self, board, from_row, from_col):
-        """ Return a list of legal moves to make
+        return king_knight_move_helper(board, KING_TARGETS, from_row, from_col, to_row, to_col, self.white)
 
-        :return: returns a list of legal moves in format [(from_row, from_col, to_row, to_col), ...]
+    def generate_pseudo_legal_moves(self, board, from_row, from_col):
+        """ Return a list of moves to make, without checking if they leave the King in check
+
+        :return: returns a list of moves in format [(from_row, from_col, to_row, to_col), ...]
         """
         # if is_invalid_indices(from_row, from_col):
         #     return []
 
-        king_moves = King(white=self.white).generate_legal_moves(board, from_row, from_col)
-        rook_moves = Rook(white=self.white).generate_legal_moves(board, from_row, from_col)
-
-        return list(set().union(king_moves, rook_moves))
+        return slider_moves(board, ROOK_DIRECTIONS, from_row, from_col, self.white) + \
+            step_moves(board, TIGER_STEP_TARGETS, from_row, from_col, self.white)
 
 
 class Knight(Piece):
     """ Represents a Knight in a game of Shatar."""
 
-    def __init__(self, white=True):
-        super().__init__(white=white)
-
-    def __str__(self):
-        if self.white:
-            return 'N'
-        else:
-            return 'n'
+    __slots__ = ()
+    SYMBOL = 'N'
 
     def is_threatening(self, board, from_row, from_col, to_row, to_col):
         # if is_invalid_indices(to_row, to_col) or is_invalid_indices(from_row, from_col):
         #     return False
 
-        return king_knight_move_helper(board, KNIGHT_DIRECTIONS, from_row, from_col, to_row, to_col, self.white)
+        return king_knight_move_helper(board, KNIGHT_TARGETS, from_row, from_col, to_row, to_col, self.white)
 
-    def generate_legal_moves(self, board, from_row, from_col):
-        """ Return a list of legal moves to make
+    def generate_pseudo_legal_moves(self, board, from_row, from_col):
+        """ Return a list of moves to make, without checking if they leave the King in check
 
-        :return: returns a list of legal moves in format [(from_row, from_col, to_row, to_col), ...]
+        :return: returns a list of moves in format [(from_row, from_col, to_row, to_col), ...]
         """
         # if is_invalid_indices(from_row, from_col):
         #     return []
 
-        moves = []
+        return step_moves(board, KNIGHT_TARGETS, from_row, from_col, self.white)
 
-        for direction in KNIGHT_DIRECTIONS:
-            if self.is_legal_move(board, from_row, from_col, from_row + direction[0], from_col + direction[1]):
-                moves.append((from_row, from_col, from_row + direction[0], from_col + direction[1]))
 
-        return moves
+# every piece, keyed by its FEN letter
+PIECE_BY_SYMBOL = {piece.symbol: piece for piece in
+                   [piece_type(white) for piece_type in (Pawn, King, Rook, Bishop, Tiger, Knight)
+                    for white in (True, False)]}
+
+# piece codes on the flat 64 square boards of playout and batch_eval, negative for black and 0 for an empty
+# square
+PAWN = 1
+KNIGHT = 2
+BISHOP = 3
+ROOK = 4
+TIGER = 5
+KING = 6
+
+PIECE_CODES = {Pawn: PAWN, Knight: KNIGHT, Bishop: BISHOP, Rook: ROOK, Tiger: TIGER, King: KING}
@@ -0,0 +1,387 @@
+import argparse
+import random
+import time
+
+from pieces import KING_TARGETS, KNIGHT_TARGETS, PAWN_CAPTURE_TARGETS, RAYS, ROOK_DIRECTIONS, BISHOP_DIRECTIONS, \
+    MATERIAL_VALUE, PAWN, KNIGHT, BISHOP, ROOK, TIGER, KING, PIECE_CODES
+from shatar import ShatarModel, NO_CAPTURE_DRAW_LIMIT
+
+# Rollouts on a ShatarModel pay for its bookkeeping on every ply: the Zobrist key, piece counts, the game over
+# cache and full legal move lists. A Playout copies the position into a flat list of 64 small ints and plays
+# the game out on that instead. It only generates pseudo-legal moves, and only checks the move it's about to
+# play for leaving its own King in check, by making it, looking for attacks on the King and unmaking it.
+
+# the flat board holds the pieces.PIECE_CODES codes
+# material value of each code, indexed by the absolute code
+CODE_VALUES = [0, MATERIAL_VALUE['P'], MATERIAL_VALUE['N'], MATERIAL_VALUE['B'], MATERIAL_VALUE['R'],
+               MATERIAL_VALUE['Q'], MATERIAL_VALUE['K']]
+
+# random playouts pick uniformly among the legal moves, capture playouts take the most valuable capture there
+# is, then a promotion, then a random move
+RANDOM_POLICY = 'random'
+CAPTURE_POLICY = 'capture'
+
+
+def flatten(table):
+    """ Turn an 8x8 table of (row, col) squares into a list of 64 tuples of square indices """
+    return [tuple(sorted(row * 8 + col for row, col in table[sq // 8][sq % 8])) for sq in range(64)]
+
+
+def flatten_rays(directions):
+    """ List of 64 tuples of rays (tuples of square indices, nearest first) in the given directions """
+    return [tuple(tuple(row * 8 + col for row, col in RAYS[sq // 8][sq % 8][direction])
+                  for direction in directions if len(RAYS[sq // 8][sq % 8][direction]) > 0)
+            for sq in range(64)]
+
+
+KING_STEPS = flatten(KING_TARGETS)
+KNIGHT_STEPS = flatten(KNIGHT_TARGETS)
+# PAWN_STEPS[white][sq]
+PAWN_STEPS = [flatten(PAWN_CAPTURE_TARGETS[False]), flatten(PAWN_CAPTURE_TARGETS[True])]
+ROOK_RAYS = flatten_rays(ROOK_DIRECTIONS)
+BISHOP_RAYS = flatten_rays(BISHOP_DIRECTIONS)
+
+
+class Playout(object):
+    """ A position copied from a ShatarModel onto a flat board, to play fast games out on.
+
+    The game ends by the same rules as ShatarModel.is_game_over: a side with only its King left draws, a side
+    with no legal moves is mated if the other side is in a shak sequence and the check isn't from a Knight
+    (otherwise it's a draw), and NO_CAPTURE_DRAW_LIMIT moves without a capture draw.
+
+    Attributes:
+        board (list): 64 piece codes, indexed by row * 8 + col
+        to_play (boolean): True if white is to play
+        king_squares (list): square of the black King at [0] and of the white King at [1]
+        num_pieces (list): number of black pieces at [0] and of white pieces at [1]
+        material (int): material balance, positive if white is ahead
+        shak_sequence_white (boolean): whether white is in a shak sequence
+        shak_sequence_black (boolean): whether black is in a shak sequence
+        moves_since_last_capture (int): the capture clock
+    """
+
+    def __init__(self, model):
+        self.board = [0] * 64
+        self.king_squares = [0, 0]
+        self.num_pieces = [0, 0]
+        self.material = model.material
+        for row in range(8):
+            for col in range(8):
+                piece = model.board[row][col]
+                if piece is None:
+                    continue
+                code = PIECE_CODES[type(piece)]
+                if code == KING:
+                    self.king_squares[piece.white] = row * 8 + col
+                self.board[row * 8 + col] = code if piece.white else -code
+                self.num_pieces[piece.white] += 1
+        self.to_play = model.to_play
+        self.shak_sequence_white = model.shak_sequence_white
+        self.shak_sequence_black = model.shak_sequence_black
+        self.moves_since_last_capture = model.moves_since_last_capture
+
+    def pseudo_legal_moves(self):
+        """ Moves of the side to play, without checking whether they leave its King in check
+
+        :return: (list) of (from_sq, to_sq) moves
+        """
+        board = self.board
+        white = self.to_play
+        moves = []
+        for sq in range(64):
+            code = board[sq]
+            if code == 0 or (code > 0) != white:
+                continue
+            kind = code if white else -code
+
+            if kind == PAWN:
+                forward = sq + 8 if white else sq - 8
+                if 0 <= forward < 64 and board[forward] == 0:
+                    moves.append((sq, forward))
+                for target in PAWN_STEPS[white][sq]:
+                    if board[target] != 0 and (board[target] > 0) != white:
+                        moves.append((sq, target))
+                continue
+
+            if kind == KNIGHT:
+                steps = KNIGHT_STEPS[sq]
+            elif kind == KING or kind == TIGER:
+                steps = KING_STEPS[sq]
+            else:
+                steps = ()
+            for target in steps:
+                if board[target] == 0 or (board[target] > 0) != white:
+                    moves.append((sq, target))
+
+            if kind == ROOK or kind == TIGER:
+                rays = ROOK_RAYS[sq]
+            elif kind == BISHOP:
+                rays = BISHOP_RAYS[sq]
+            else:
+                continue
+            # a Tiger's first step along a ray is already one of its king steps
+            skip = -1
+            for ray in rays:
+                if kind == TIGER:
+                    skip = ray[0]
+                for target in ray:
+                    if board[target] == 0:
+                        if target != skip:
+                            moves.append((sq, target))
+                    else:
+                        if (board[target] > 0) != white and target != skip:
+                            moves.append((sq, target))
+                        break
+        return moves
+
+    def attackers(self, sq, by_white):
+        """ Squares of the pieces of the given color that attack the square
+
+        :return: (list) of square indices
+        """
+        board = self.board
+        sign = 1 if by_white else -1
+        found = []
+
+        for target in KNIGHT_STEPS[sq]:
+            if board[target] == sign * KNIGHT:
+                found.append(target)
+        for target in KING_STEPS[sq]:
+            code = board[target] * sign
+            if code == KING or code == TIGER:
+                found.append(target)
+        # a pawn attacks sq from the squares a pawn of the other color would capture on
+        for target in PAWN_STEPS[not by_white][sq]:
+            if board[target] == sign * PAWN:
+                found.append(target)
+
+        for ray in ROOK_RAYS[sq]:
+            for target in ray:
+                code = board[target]
+                if code != 0:
+                    code *= sign
+                    # an adjacent Tiger was already found by its king step
+                    if code == ROOK or (code == TIGER and target != ray[0]):
+                        found.append(target)
+                    break
+        for ray in BISHOP_RAYS[sq]:
+            for target in ray:
+                code = board[target]
+                if code != 0:
+                    if code == sign * BISHOP:
+                        found.append(target)
+                    break
+        return found
+
+    def is_attacked(self, sq, by_white):
+        """ Whether any piece of the given color attacks the square """
+        return len(self.attackers(sq, by_white)) > 0
+
+    def make_move(self, from_sq, to_sq):
+        """ Play a move and return what unmake_move needs to take it back """
+        board = self.board
+        code = board[from_sq]
+        captured = board[to_sq]
+        white = code > 0
+        undo = (from_sq, to_sq, code, captured, self.material, self.shak_sequence_white, self.shak_sequence_black,
+                self.moves_since_last_capture)
+
+        if captured != 0:
+            self.material -= CODE_VALUES[captured] if captured > 0 else -CODE_VALUES[-captured]
+            self.num_pieces[captured > 0] -= 1
+            self.moves_since_last_capture = 0
+        else:
+            self.moves_since_last_capture += 1
+
+        board[from_sq] = 0
+        if (code == PAWN and to_sq >= 56) or (code == -PAWN and to_sq < 8):
+            board[to_sq] = TIGER if white else -TIGER
+            promotion = CODE_VALUES[TIGER] - CODE_VALUES[PAWN]
+            self.material += promotion if white else -promotion
+        else:
+            board[to_sq] = code
+            if code == KING or code == -KING:
+                self.king_squares[white] = to_sq
+        self.to_play = not white
+        return undo
+
+    def unmake_move(self, undo):
+        from_sq, to_sq, code, captured, self.material, self.shak_sequence_white, self.shak_sequence_black, \
+            self.moves_since_last_capture = undo
+        white = code > 0
+        self.board[from_sq] = code
+        self.board[to_sq] = captured
+        if captured != 0:
+            self.num_pieces[captured > 0] += 1
+        if code == KING or code == -KING:
+            self.king_squares[white] = from_sq
+        self.to_play = white
+
+    def leaves_king_safe(self, move, white):
+        """ Make the move, check that it doesn't leave the mover's King attacked and take it back if it does
+
+        :return: the undo record if the move was kept, None if it was taken back
+        """
+        undo = self.make_move(move[0], move[1])
+        if self.is_attacked(self.king_squares[white], not white):
+            self.unmake_move(undo)
+            return None
+        return undo
+
+    def update_checking_sequence(self, white):
+        """ Update the mover's shak sequence after a move, like ShatarModel.update_checking_sequence
+
+        :param white: (boolean) color of the side that just moved
+        """
+        attackers = self.attackers(self.king_squares[not white], white)
+        if len(attackers) > 0:
+            # the first piece a row by row scan of the board would find
+            kind = abs(self.board[min(attackers)])
+            shak = kind == ROOK or kind == TIGER or kind == KNIGHT
+            if white:
+                self.shak_sequence_white = self.shak_sequence_white or shak
+            else:
+                self.shak_sequence_black = self.shak_sequence_black or shak
+        elif white:
+            self.shak_sequence_white = False
+        else:
+            self.shak_sequence_black = False
+
+    def ordered_candidates(self, moves):
+        """ Pseudo-legal moves, most valuable capture or promotion first and the rest in random order """
+        board = self.board
+        scored = []
+        for move in moves:
+            captured = board[move[1]]
+            score = CODE_VALUES[abs(captured)] if captured != 0 else 0
+            code = board[move[0]]
+            if (code == PAWN and move[1] >= 56) or (code == -PAWN and move[1] < 8):
+                score += CODE_VALUES[TIGER] - CODE_VALUES[PAWN]
+            # random tie break between moves with the same score
+            scored.append((score, random.random(), move))
+        scored.sort(reverse=True)
+        return [move for score, tie_break, move in scored]
+
+    def play_move(self, policy):
+        """ Play a legal move for the side to play, chosen by the policy
+
+        :return: (boolean) False if the side to play had no legal move
+        """
+        white = self.to_play
+        moves = self.pseudo_legal_moves()
+
+        if policy == RANDOM_POLICY:
+            # draw moves at random until one is legal, which is a uniform choice among the legal moves without
+            # having to check all of them
+            while moves:
+                i = random.randrange(len(moves))
+                move = moves[i]
+                moves[i] = moves[-1]
+                moves.pop()
+                if self.leaves_king_safe(move, white) is not None:
+                    self.update_checking_sequence(white)
+                    return True
+            return False
+
+        for move in self.ordered_candidates(moves):
+            if self.leaves_king_safe(move, white) is not None:
+                self.update_checking_sequence(white)
+                return True
+        return False
+
+    def no_move_result(self):
+        """ Result when the side to play has no legal moves, like ShatarModel.compute_game_over """
+        white = self.to_play
+        shak = self.shak_sequence_black if white else self.shak_sequence_white
+        attackers = self.attackers(self.king_squares[white], not white)
+        if len(attackers) == 0 or abs(self.board[min(attackers)]) == KNIGHT or not shak:
+            return 0
+        return -1 if white else 1
+
+    def play(self, max_moves, policy=RANDOM_POLICY, winning_value=None, evaluator=None):
+        """ Play the game out
+
+        :param max_moves: number of moves to play before stopping the game
+        :param policy: RANDOM_POLICY or CAPTURE_POLICY
+        :param winning_value: material lead that counts as a win for a stopped game, or None to call it a draw
+        :param evaluator: evaluation.Evaluator that scores a stopped game, or None for the material balance
+        :return: 1 for white win, -1 for black win, 0 for draw
+        """
+        num_moves = 0
+        while True:
+            if self.num_pieces[self.to_play] == 1:
+                # only the King is left
+                return 0
+            if self.moves_since_last_capture >= NO_CAPTURE_DRAW_LIMIT:
+                # a side with no legal moves is still mated (or stalemated) rather than drawn by the clock
+                if not self.has_legal_move():
+                    return self.no_move_result()
+                return 0
+            if num_moves > max_moves:
+                if not self.has_legal_move():
+                    return self.no_move_result()
+                break
+            if not self.play_move(policy):
+                return self.no_move_result()
+            num_moves += 1
+
+        if winning_value is not None:
+            score = self.material if evaluator is None else evaluator.evaluate_codes(self.board)
+            if score >= winning_value:
+                return 1
+            elif score <= -winning_value:
+                return -1
+        return 0
+
+    def has_legal_move(self):
+        white = self.to_play
+        for move in self.pseudo_legal_moves():
+            undo = self.leaves_king_safe(move, white)
+            if undo is not None:
+                self.unmake_move(undo)
+                return True
+        return False
+
+    def legal_moves(self):
+        """ Every legal move of the side to play, as (from_row, from_col, to_row, to_col) tuples """
+        white = self.to_play
+        moves = []
+        for move in self.pseudo_legal_moves():
+            undo = self.leaves_king_safe(move, white)
+            if undo is not None:
+                self.unmake_move(undo)
+                moves.append((move[0] // 8, move[0] % 8, move[1] // 8, move[1] % 8))
+        return moves
+
+
+def benchmark(model, num_playouts, max_moves, policy):
+    """ Play playouts from the model and report how many were played per second
+
+    :return: (float) playouts per second
+    """
+    start = time.perf_counter()
+    results = {1: 0, 0: 0, -1: 0}
+    for i in range(num_playouts):
+        results[Playout(model).play(max_moves, policy)] += 1
+    elapsed = time.perf_counter() - start
+    playouts_per_second = num_playouts / elapsed
+    print(f'{num_playouts} {policy} playouts in {elapsed:.3f} seconds ({playouts_per_second:.0f} playouts/s), '
+          f'white won {results[1]}, black won {results[-1]}, {results[0]} draws')
+    return playouts_per_second
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure playout speed from the starting position')
+    parser.add_argument('playouts', nargs='?', type=int, default=1000)
+    parser.add_argument('--max-moves', type=int, default=NO_CAPTURE_DRAW_LIMIT * 10)
+    parser.add_argument('--policy', choices=[RANDOM_POLICY, CAPTURE_POLICY], default=RANDOM_POLICY)
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    benchmark(ShatarModel(), args.playouts, args.max_moves, args.policy)
+
+
+if __name__ == '__main__':
+    main()
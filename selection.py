@@ -0,0 +1,154 @@
+import math
+import random
+
+from batch_eval import evaluate_children
+from pieces import Pawn
+
+# Selection policies decide which way a GameTree search goes down the tree. A policy's select(node) is called on
+# every node that the search passes that isn't over, and returns either one of node.children to go down into, or
+# one of node.untried_actions to add as a new child. That new child is where the rollout starts.
+#
+# Wins are scored 1 for a win, 0.5 for a draw and -1 for a loss, so child values are between -1 and 1.
+
+C_CONSTANT = 1.414
+PUCT_CONSTANT = 1.5
+
+# prior weight of a move that captures nothing, captures add the captured piece's material value on top of it
+QUIET_MOVE_WEIGHT = 1
+# extra prior weight of a pawn move that promotes to a Tiger
+PROMOTION_WEIGHT = 6
+# material units that make one move e (2.718...) times as likely as another in evaluation_prior
+PRIOR_TEMPERATURE = 1
+
+
+def pick_best(items, score):
+    """ Item with the highest score, ties broken at random """
+    best_score = float('-inf')
+    best_items = []
+    for item in items:
+        item_score = score(item)
+        if item_score > best_score:
+            best_score = item_score
+            best_items = [item]
+        elif item_score == best_score:
+            best_items.append(item)
+    return random.choice(best_items)
+
+
+class UCB1(object):
+    """ Tries every move once, in random order, and then picks the child with the best upper confidence bound,
+    using the node's own number of simulations as the parent visits
+
+    Attributes:
+        c (float): exploration constant
+    """
+
+    def __init__(self, c=C_CONSTANT):
+        self.c = c
+
+    def select(self, node):
+        if len(node.untried_actions) > 0:
+            return random.choice(node.untried_actions)
+
+        log_parent_visits = math.log(node.num_sims)
+        return pick_best(node.children, lambda child: self.upper_bound(child, log_parent_visits))
+
+    def upper_bound(self, child, log_parent_visits):
+        ni = child.num_sims
+        return child.num_wins / ni + self.c * math.sqrt(2 * log_parent_visits / ni)
+
+
+class UCB1Tuned(UCB1):
+    """ UCB1 that scales each child's exploration term by an upper bound on the variance of its results, so
+    children whose rollouts keep ending the same way are explored less """
+
+    # largest variance of a result between -1 and 1
+    MAX_VARIANCE = 1
+
+    def upper_bound(self, child, log_parent_visits):
+        ni = child.num_sims
+        mean = child.num_wins / ni
+        variance = child.sum_squares / ni - mean * mean + math.sqrt(2 * log_parent_visits / ni)
+        return mean + self.c * math.sqrt(log_parent_visits / ni * min(self.MAX_VARIANCE, variance))
+
+
+class PUCT(object):
+    """ Predictor + UCT selection as in AlphaZero: every move has a prior probability, and the search picks the
+    move with the best value + c * prior * sqrt(parent visits) / (1 + child visits). Untried moves count as
+    unvisited children with a value of 0, so moves with a high prior get tried first and moves with a low prior
+    may never be expanded at all.
+
+    Attributes:
+        c (float): exploration constant
+        prior (callable): function of (model, moves) returning a weight for every move, which are normalized
+            into probabilities. The priors of a node are computed once and kept on the node.
+    """
+
+    def __init__(self, c=PUCT_CONSTANT, prior=None):
+        if prior is None:
+            prior = material_capture_prior
+        self.c = c
+        self.prior = prior
+
+    def select(self, node):
+        priors = node.priors
+        if priors is None:
+            moves = node.untried_actions + [child.parent_action for child in node.children]
+            weights = self.prior(node.model, moves)
+            total = sum(weights)
+            priors = {move: weight / total for move, weight in zip(moves, weights)}
+            node.priors = priors
+
+        exploration = self.c * math.sqrt(node.num_sims)
+        choices = node.untried_actions + node.children
+
+        def score(choice):
+            if isinstance(choice, tuple):
+                return exploration * priors[choice]
+            return choice.num_wins / choice.num_sims + \
+                exploration * priors[choice.parent_action] / (1 + choice.num_sims)
+
+        if len(node.children) == 0:
+            # nothing has been visited, so the prior is all there is to go on
+            return pick_best(node.untried_actions, priors.get)
+        return pick_best(choices, score)
+
+
+def uniform_prior(model, moves):
+    """ Every move is equally likely """
+    return [1] * len(moves)
+
+
+def material_capture_prior(model, moves):
+    """ Captures are weighted by the material they win and promotions by the Tiger they make
+
+    :param model: ShatarModel the moves are played on
+    :param moves: (list) of legal moves
+    :return: (list) of positive weights, one per move
+    """
+    board = model.board
+    weights = []
+    for from_row, from_col, to_row, to_col in moves:
+        weight = QUIET_MOVE_WEIGHT
+        captured = board[to_row][to_col]
+        if captured is not None:
+            weight += abs(captured.value)
+        if isinstance(board[from_row][from_col], Pawn) and to_row in (0, 7):
+            weight += PROMOTION_WEIGHT
+        weights.append(weight)
+    return weights
+
+
+def evaluation_prior(model, moves):
+    """ Softmax of the evaluation after each move, for the side making it. The positions after all of the moves
+    are scored in one batch_eval call
+
+    :param model: ShatarModel the moves are played on
+    :param moves: (list) of legal moves
+    :return: (list) of positive weights, one per move
+    """
+    scores = evaluate_children(model, moves)
+    if not model.to_play:
+        scores = [-score for score in scores]
+    best_score = max(scores)
+    return [math.exp((score - best_score) / PRIOR_TEMPERATURE) for score in scores]
@@ -1,6 +1,11 @@
-from pieces import Pawn, King, Rook, Bishop, Tiger, Knight, square_is_threatened, find_king, piece_threatens_square, \
-    is_invalid_indices
-from copy import deepcopy, copy
+from functools import lru_cache
+
+from pieces import Pawn, King, Rook, Bishop, Tiger, Knight, is_invalid_indices, attackers_of, pinned_pieces, \
+    squares_between, KING_TARGETS, PIECE_BY_SYMBOL
+from bitboard import BitBoard, square
+from evaluation import MIDDLEGAME_SCORES, ENDGAME_SCORES, PHASES, score_board, count_material_evaluation
+from zobrist import PIECE_KEYS, BLACK_TO_PLAY_KEY, SHAK_SEQUENCE_WHITE_KEY, SHAK_SEQUENCE_BLACK_KEY, CAPTURE_CLOCK_KEY, \
+    capture_clock_bucket, board_key
 
 NUM_COLS = 8
 # With these constant values for players, flipping ownership is just a sign change
@@ -11,9 +16,15 @@ BLACK = -1
 TIE = 2  # NOT the value of a tie, which is 0 - just an arbitrary enum for end-of-game
 
 WIN_VAL = 100
+# number of moves (by either player) without a capture after which the game is a draw
+NO_CAPTURE_DRAW_LIMIT = 100
 WHITE_TO_PLAY = True
 DEMO_SEARCH_DEPTH = 5
 
+# FEN digit: run of empty squares, and back
+EMPTY_RUNS = {str(length): (None,) * length for length in range(1, NUM_COLS + 1)}
+EMPTY_RUN_NAMES = {length: str(length) for length in range(1, NUM_COLS + 1)}
+
 DIRECTIONS = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
 
 DEFAULT_BOARD = [[Rook(), Knight(), Bishop(), Tiger(), King(), Bishop(), Knight(), Rook()],
@@ -28,51 +39,99 @@ DEFAULT_BOARD = [[Rook(), Knight(), Bishop(), Tiger(), King(), Bishop(), Knight(
                   Bishop(white=False), Knight(white=False), Rook(white=False)]]
 
 
+# Full FEN of a position: the board from row 7 down to row 0, then the side to play ('1' for white, '0' for
+# black), the shak sequences under way ('W', 'B', 'WB' or '-'), the moves since the last capture, the total
+# moves and the last move ('d7d5', or '-'). Only the board is needed, the other fields default to the start of
+# a game, so the shorter FENs of get_fen can be read too.
+FEN_FIELDS = 6
+NO_FEN_VALUE = '-'
+COLUMN_NAMES = 'abcdefgh'
+# parsed rows and built rows are kept for reuse, since most positions of a suite share most of their rows
+FEN_ROW_CACHE_SIZE = 1 << 12
+
+
+def square_name(row, col):
+    """ Name of a square, by column a-h and row 1-8 (row 1 is white's back rank) """
+    return COLUMN_NAMES[col] + str(row + 1)
+
+
+def parse_square(name):
+    """ Inverse of square_name
+
+    :return: (row, col)
+    """
+    if len(name) != 2 or name[0] not in COLUMN_NAMES or name[1] not in '12345678':
+        raise ValueError("Not a square: " + name)
+    return int(name[1]) - 1, COLUMN_NAMES.index(name[0])
+
+
+def pack_move(move):
+    """ Pack a (from_row, from_col, to_row, to_col) move into one int below 4096 """
+    return square(move[0], move[1]) * 64 + square(move[2], move[3])
+
+
+def unpack_move(packed):
+    """ Inverse of pack_move """
+    from_sq, to_sq = divmod(packed, 64)
+    return from_sq // 8, from_sq % 8, to_sq // 8, to_sq % 8
+
+
+@lru_cache(maxsize=FEN_ROW_CACHE_SIZE)
+def parse_fen_row(fen_row):
+    """ Pieces of one FEN row, from column 0 to 7
+
+    :return: (tuple) of 8 pieces or None
+    """
+    row = []
+    for char in fen_row:
+        if char in EMPTY_RUNS:
+            row.extend(EMPTY_RUNS[char])
+        else:
+            row.append(str_to_piece(char))
+    if len(row) != NUM_COLS:
+        raise ValueError("FEN row doesn't have 8 squares: " + fen_row)
+    return tuple(row)
+
+
+@lru_cache(maxsize=FEN_ROW_CACHE_SIZE)
+def build_fen_row(row):
+    """ Inverse of parse_fen_row """
+    parts = []
+    empty_spaces = 0
+    for piece in row:
+        if piece is None:
+            empty_spaces += 1
+            continue
+        if empty_spaces > 0:
+            parts.append(EMPTY_RUN_NAMES[empty_spaces])
+            empty_spaces = 0
+        parts.append(piece.symbol)
+    if empty_spaces > 0:
+        parts.append(EMPTY_RUN_NAMES[empty_spaces])
+    return ''.join(parts)
+
+
 def fen_to_board(fen):
-    board = []
+    """ Board of the board field of a FEN
 
+    :return: (2d list) with row 0 (white's back rank) first
+    """
     fen_rows = fen.split('/')
-    fen_rows.reverse()
-
-    for fen_row in fen_rows:
-        row = []
-        for i in range(len(fen_row)):
-            curr = fen_row[i]
-            if curr.isnumeric():
-                for j in range(int(curr)):
-                    row.append(None)
-            else:
-                row.append(str_to_piece(curr))
-        board.append(row)
+    if len(fen_rows) != NUM_COLS:
+        raise ValueError("FEN board doesn't have 8 rows: " + fen)
+    return [list(parse_fen_row(fen_row)) for fen_row in reversed(fen_rows)]
+
 
-    return board
+def board_to_fen(board):
+    """ Inverse of fen_to_board """
+    return '/'.join(build_fen_row(tuple(row)) for row in reversed(board))
 
 
 def str_to_piece(piece):
-    if piece == 'n':
-        return Knight(white=False)
-    elif piece == 'N':
-        return Knight()
-    elif piece == 'q':
-        return Tiger(white=False)
-    elif piece == 'Q':
-        return Tiger()
-    elif piece == 'k':
-        return King(white=False)
-    elif piece == 'K':
-        return King()
-    elif piece == 'b':
-        return Bishop(white=False)
-    elif piece == 'B':
-        return Bishop()
-    elif piece == 'p':
-        return Pawn(white=False)
-    elif piece == 'P':
-        return Pawn()
-    elif piece == 'r':
-        return Rook(white=False)
-    elif piece == 'R':
-        return Rook()
+    try:
+        return PIECE_BY_SYMBOL[piece]
+    except KeyError:
+        raise ValueError("Unknown piece in FEN: " + piece) from None
 
 
 class ShatarModel(object):
@@ -82,10 +141,27 @@ class ShatarModel(object):
         board (2d array): represents the board of pieces. None if no piece on a square
         to_play (boolean): True if white_to_play, False otherwise
         shak_sequence_white (boolean): True if there is currently a check sequence for white that contains a check by a Rook, Knight, or Tiger (Queen)
+        bitboards (BitBoard): bitboard copy of the board used for move generation and attacks, or None to use
+            the pieces on the 2d board. Generating moves on bitboards is faster, see bitboard.py
+        zobrist_key (int): 64-bit Zobrist key of the position, side to play, shak sequences and capture clock
+            bucket. Kept up to date by make_move; call compute_zobrist_key after changing any of those directly
+        king_squares (dict): (row, col) of the King of each color, keyed by True for white and False for black
+        piece_counts (dict): number of pieces on the board for each piece symbol ('P', 'k', ...)
+        num_pieces (dict): number of pieces on the board for each color, keyed like king_squares
+        middlegame_score (float): material plus middlegame piece-square bonuses, positive if white is ahead.
+            Kept up to date by make_move like the Zobrist key, see evaluation.TaperedEvaluator
+        endgame_score (float): the same with the endgame tables
+        phase (int): sum of the evaluation.PHASE_WEIGHTS of the pieces on the board
+        material (int): material balance, positive if white is ahead (read only, kept up to date by make_move)
     """
 
-    def __init__(self, board=DEFAULT_BOARD, last_moved_from=(6, 3), last_moved_to=(4, 3), to_play=WHITE_TO_PLAY):
+    def __init__(self, board=None, last_moved_from=(6, 3), last_moved_to=(4, 3), to_play=WHITE_TO_PLAY,
+                 bitboards=False):
+        # copy the starting position so that moving on this model doesn't change DEFAULT_BOARD for later games
+        if board is None:
+            board = [list(row) for row in DEFAULT_BOARD]
         self.board = board
+        self.bitboards = BitBoard.from_board(board) if bitboards else None
         self.to_play = to_play
         self.last_moved_from = last_moved_from
         self.last_moved_to = last_moved_to
@@ -93,6 +169,62 @@ class ShatarModel(object):
         self.shak_sequence_black = False
         self.moves_since_last_capture = 0
         self.total_moves = 0
+        self.zobrist_key = self.compute_zobrist_key()
+        self.count_pieces()
+        self.middlegame_score, self.endgame_score, self.phase = score_board(board)
+        self._material = count_material_evaluation(board)
+        # (zobrist_key, is_game_over result) of the last position is_game_over was worked out for
+        self.game_over_cache = None
+
+    @property
+    def material(self):
+        return self._material
+
+    def count_pieces(self):
+        """ Fill in king_squares, piece_counts and num_pieces from a scan of the board.
+            make_move and unmake_move keep them up to date after this
+        """
+        self.king_squares = {True: None, False: None}
+        self.piece_counts = {symbol: 0 for symbol in 'PNBRQKpnbrqk'}
+        self.num_pieces = {True: 0, False: 0}
+        for i in range(len(self.board)):
+            for j in range(len(self.board[0])):
+                piece = self.board[i][j]
+                if piece is None:
+                    continue
+                if isinstance(piece, King):
+                    self.king_squares[piece.white] = (i, j)
+                self.piece_counts[piece.symbol] += 1
+                self.num_pieces[piece.white] += 1
+
+    def compute_zobrist_key(self):
+        """ Compute the Zobrist key of the current state from scratch
+
+        :return: (int) 64-bit key
+        """
+        key = board_key(self.board)
+        if not self.to_play:
+            key ^= BLACK_TO_PLAY_KEY
+        if self.shak_sequence_white:
+            key ^= SHAK_SEQUENCE_WHITE_KEY
+        if self.shak_sequence_black:
+            key ^= SHAK_SEQUENCE_BLACK_KEY
+        if capture_clock_bucket(self.moves_since_last_capture, NO_CAPTURE_DRAW_LIMIT):
+            key ^= CAPTURE_CLOCK_KEY
+        return key
+
+    def copy(self):
+        """ Return an independent model with the same board and game state """
+        new_model = ShatarModel(self.get_board(), last_moved_from=self.last_moved_from,
+                                last_moved_to=self.last_moved_to, to_play=self.to_play)
+        if self.bitboards is not None:
+            new_model.bitboards = self.bitboards.copy()
+        new_model.shak_sequence_white = self.shak_sequence_white
+        new_model.shak_sequence_black = self.shak_sequence_black
+        new_model.moves_since_last_capture = self.moves_since_last_capture
+        new_model.total_moves = self.total_moves
+        new_model.zobrist_key = self.zobrist_key
+        return new_model
 
     def move(self, from_row, from_col, to_row, to_col):
         """ Move on the board from the given square to the other given square.
@@ -115,23 +247,82 @@ class ShatarModel(object):
         if not (piece.white == self.to_play):
             raise ValueError("This piece is the wrong color to move! Piece.white =" + str(piece.white))
 
-        if not piece.is_legal_move(self.board, from_row, from_col, to_row, to_col):
+        if not self.is_legal_move(piece, from_row, from_col, to_row, to_col):
             raise ValueError(
-                "Piece: " + str(piece) + " cannot make this move! " + f'{from_row}, {from_col}, {to_row}, {to_col}')
+                "Piece: " + piece.symbol + " cannot make this move! " + f'{from_row}, {from_col}, {to_row}, {to_col}')
 
         if from_row == to_row and from_col == to_col:
             raise ValueError("Can't move to the same square")
 
-        if self.board[to_row][to_col] is not None:
+        self.make_move((from_row, from_col, to_row, to_col))
+
+    def make_move(self, move):
+        """ Play the given move without checking that it is legal, and return what is needed to take it back.
+            Only use this with moves from generate_legal_moves
+
+        :param move: tuple in the format (from_row, from_col, to_row, to_col)
+        :return: (tuple) undo record to pass to unmake_move
+        """
+        from_row, from_col, to_row, to_col = move
+        piece = self.board[from_row][from_col]
+        captured = self.board[to_row][to_col]
+
+        shak_white = self.shak_sequence_white
+        shak_black = self.shak_sequence_black
+        moves_since_last_capture = self.moves_since_last_capture
+        key = self.zobrist_key
+
+        middlegame = self.middlegame_score
+        endgame = self.endgame_score
+
+        undo = (move, piece, captured, shak_white, shak_black, moves_since_last_capture,
+                self.last_moved_from, self.last_moved_to, key, middlegame, endgame, self.phase, self._material)
+
+        from_sq = square(from_row, from_col)
+        to_sq = square(to_row, to_col)
+        key ^= PIECE_KEYS[piece.symbol][from_sq]
+        middlegame -= MIDDLEGAME_SCORES[piece.symbol][from_sq]
+        endgame -= ENDGAME_SCORES[piece.symbol][from_sq]
+
+        if captured is not None:
             self.moves_since_last_capture = 0
+            key ^= PIECE_KEYS[captured.symbol][to_sq]
+            middlegame -= MIDDLEGAME_SCORES[captured.symbol][to_sq]
+            endgame -= ENDGAME_SCORES[captured.symbol][to_sq]
+            self.phase -= PHASES[captured.symbol]
+            self._material -= captured.value
+            self.piece_counts[captured.symbol] -= 1
+            self.num_pieces[captured.white] -= 1
         else:
             self.moves_since_last_capture += 1
 
-        self.board[to_row][to_col] = self.board[from_row][from_col]
+        self.board[to_row][to_col] = piece
         self.board[from_row][from_col] = None
 
-        if (str(piece) == 'P' and to_row == 7) or (str(piece) == 'p' and to_row == 0):
-            self.board[to_row][to_col] = Tiger(white=piece.white)
+        promoted = None
+        if isinstance(piece, Pawn) and to_row == (7 if piece.white else 0):
+            promoted = Tiger(white=piece.white)
+            self.board[to_row][to_col] = promoted
+            key ^= PIECE_KEYS[promoted.symbol][to_sq]
+            middlegame += MIDDLEGAME_SCORES[promoted.symbol][to_sq]
+            endgame += ENDGAME_SCORES[promoted.symbol][to_sq]
+            self.phase += PHASES[promoted.symbol] - PHASES[piece.symbol]
+            self._material += promoted.value - piece.value
+            self.piece_counts[piece.symbol] -= 1
+            self.piece_counts[promoted.symbol] += 1
+        else:
+            key ^= PIECE_KEYS[piece.symbol][to_sq]
+            middlegame += MIDDLEGAME_SCORES[piece.symbol][to_sq]
+            endgame += ENDGAME_SCORES[piece.symbol][to_sq]
+            if isinstance(piece, King):
+                self.king_squares[piece.white] = (to_row, to_col)
+        self.middlegame_score = middlegame
+        self.endgame_score = endgame
+
+        if self.bitboards is not None:
+            self.bitboards.move_piece(piece.symbol, from_sq, to_sq,
+                                      None if captured is None else captured.symbol,
+                                      None if promoted is None else promoted.symbol)
 
         self.update_checking_sequence()
         self.total_moves += 1
@@ -139,6 +330,77 @@ class ShatarModel(object):
         self.last_moved_to = to_row, to_col
         self.to_play = not self.to_play
 
+        key ^= BLACK_TO_PLAY_KEY
+        if self.shak_sequence_white != shak_white:
+            key ^= SHAK_SEQUENCE_WHITE_KEY
+        if self.shak_sequence_black != shak_black:
+            key ^= SHAK_SEQUENCE_BLACK_KEY
+        if capture_clock_bucket(self.moves_since_last_capture, NO_CAPTURE_DRAW_LIMIT) != \
+                capture_clock_bucket(moves_since_last_capture, NO_CAPTURE_DRAW_LIMIT):
+            key ^= CAPTURE_CLOCK_KEY
+        self.zobrist_key = key
+
+        return undo
+
+    def unmake_move(self, undo):
+        """ Take back the last move made with make_move, restoring the board and all game state exactly
+
+        :param undo: the undo record returned by make_move
+        """
+        move, piece, captured, shak_white, shak_black, moves_since_last_capture, last_from, last_to, key, \
+            middlegame, endgame, phase, material = undo
+        from_row, from_col, to_row, to_col = move
+        promoted = self.board[to_row][to_col]
+
+        if self.bitboards is not None:
+            self.bitboards.unmove_piece(piece.symbol, square(from_row, from_col), square(to_row, to_col),
+                                        None if captured is None else captured.symbol,
+                                        None if promoted is piece else promoted.symbol)
+
+        if promoted is not piece:
+            self.piece_counts[promoted.symbol] -= 1
+            self.piece_counts[piece.symbol] += 1
+        elif isinstance(piece, King):
+            self.king_squares[piece.white] = (from_row, from_col)
+        if captured is not None:
+            self.piece_counts[captured.symbol] += 1
+            self.num_pieces[captured.white] += 1
+
+        self.board[from_row][from_col] = piece
+        self.board[to_row][to_col] = captured
+
+        self.to_play = not self.to_play
+        self.total_moves -= 1
+        self.shak_sequence_white = shak_white
+        self.shak_sequence_black = shak_black
+        self.moves_since_last_capture = moves_since_last_capture
+        self.last_moved_from = last_from
+        self.last_moved_to = last_to
+        self.zobrist_key = key
+        self.middlegame_score = middlegame
+        self.endgame_score = endgame
+        self.phase = phase
+        self._material = material
+
+    def is_legal_move(self, piece, from_row, from_col, to_row, to_col):
+        """ Returns true if the given piece can legally move from the first square to the second """
+        if self.bitboards is not None:
+            return self.bitboards.is_legal_move(square(from_row, from_col), square(to_row, to_col), piece.white)
+        if not piece.is_threatening(self.board, from_row, from_col, to_row, to_col):
+            return False
+
+        # try the move and see if the King (which starts from a known square) is attacked afterwards
+        king_row, king_col = self.king_squares[piece.white]
+        if isinstance(piece, King):
+            king_row, king_col = to_row, to_col
+        captured = self.board[to_row][to_col]
+        self.board[to_row][to_col] = piece
+        self.board[from_row][from_col] = None
+        in_check = len(attackers_of(self.board, king_row, king_col, not piece.white)) > 0
+        self.board[from_row][from_col] = piece
+        self.board[to_row][to_col] = captured
+        return not in_check
+
     def update_checking_sequence(self):
         # if the opposite color of what just played is now in check:
         checking_piece = self.get_piece_causing_check(not self.to_play)
@@ -181,10 +443,23 @@ class ShatarModel(object):
         :param white: (boolean) True if checking if white is in check, false if black
         :return: A piece or None
         """
-
-        king_row, king_col = find_king(self.board, white)
-
-        return piece_threatens_square(self.board, king_row, king_col, not white)
+        if self.bitboards is not None:
+            king_sq = self.bitboards.king_square(white)
+            attackers = self.bitboards.attackers_to(king_sq, not white)
+            if attackers == 0:
+                return None
+            # the lowest square, which is the first piece a row by row scan of the board would find
+            row, col = divmod((attackers & -attackers).bit_length() - 1, 8)
+            return self.board[row][col]
+
+        king_row, king_col = self.king_squares[white]
+
+        attackers = attackers_of(self.board, king_row, king_col, not white)
+        if len(attackers) == 0:
+            return None
+        # the first piece a row by row scan of the board would find
+        row, col = min(attackers)
+        return self.board[row][col]
 
     def __str__(self):
         b = ''
@@ -208,10 +483,8 @@ class ShatarModel(object):
             row = []
             for j in range(len(self.board[0])):
                 piece = self.board[i][j]
-                if piece is None:
-                    row.append(None)
-                else:
-                    row.append(copy(piece))
+                # pieces are immutable and shared, so they don't need copying
+                row.append(piece)
             new_board.append(row)
 
         return new_board
@@ -219,6 +492,19 @@ class ShatarModel(object):
     def is_game_over(self):
         """ Determines if the game is over
 
+        :return: 1 if white wins, 0 if draw, -1 if black wins, 2 if game is not over
+        """
+        # the result only depends on what the Zobrist key covers, so it can be reused until the key changes
+        if self.game_over_cache is not None and self.game_over_cache[0] == self.zobrist_key:
+            return self.game_over_cache[1]
+
+        result = self.compute_game_over()
+        self.game_over_cache = (self.zobrist_key, result)
+        return result
+
+    def compute_game_over(self):
+        """ Work out is_game_over without using the cached result
+
         :return: 1 if white wins, 0 if draw, -1 if black wins, 2 if game is not over
         """
         # if a player only has a king, it's a DRAW
@@ -226,7 +512,7 @@ class ShatarModel(object):
             return 0
 
         # if to_play has no legal moves
-        if len(self.generate_legal_moves()) == 0:
+        if not self.has_any_legal_move():
             # get the shak for the opposite player
             shak = self.shak_sequence_black
             if not self.to_play:
@@ -246,7 +532,7 @@ class ShatarModel(object):
                     return 1
 
         # if no captures in 50 moves: draw
-        if self.moves_since_last_capture >= 100:
+        if self.moves_since_last_capture >= NO_CAPTURE_DRAW_LIMIT:
             return 0
 
         # there actually are legal moves and it's not a draw so the game is not over
@@ -257,60 +543,142 @@ class ShatarModel(object):
 
         :return: (list) of moves that are tuples in the format: (from_row, from_col, to_row, to_col)
         """
+        if self.bitboards is not None:
+            return self.bitboards.legal_moves(self.to_play)
+        return list(self.iter_legal_moves())
+
+    def has_any_legal_move(self):
+        """ True if the to_play player has at least one legal move. Stops at the first one it finds """
+        if self.bitboards is not None:
+            return next(self.bitboards.iter_legal_moves(self.to_play), None) is not None
+        return next(self.iter_legal_moves(), None) is not None
+
+    def iter_legal_moves(self):
+        """ Yields the legal moves for the to_play player one at a time on the 2d board.
+            The model must not be changed until the iteration is finished
+
+        :return: generator of moves that are tuples in the format: (from_row, from_col, to_row, to_col)
+        """
+        board = self.board
+        white = self.to_play
+        king_row, king_col = self.king_squares[white]
+
+        # work out the checks and pins once, then keep only the pseudo legal moves that respect them
+        checkers = attackers_of(board, king_row, king_col, not white)
+        pins = pinned_pieces(board, king_row, king_col, white)
+
+        # squares a non-King move has to land on to get out of check, or None if not in check
+        evasions = None
+        if len(checkers) == 1:
+            checker_row, checker_col = checkers[0]
+            evasions = set(squares_between(king_row, king_col, checker_row, checker_col))
+            evasions.add((checker_row, checker_col))
+
+        for i in range(len(board)):
+            for j in range(len(board[0])):
+                piece = board[i][j]
+                if piece is None or piece.white != white:
+                    continue
+
+                if i == king_row and j == king_col:
+                    yield from self.generate_king_moves(king_row, king_col, white)
+                    continue
+
+                # in double check only the King can move
+                if len(checkers) > 1:
+                    continue
+
+                pin = pins.get((i, j))
+                for move in piece.generate_pseudo_legal_moves(board, i, j):
+                    target = (move[2], move[3])
+                    if (evasions is None or target in evasions) and (pin is None or target in pin):
+                        yield move
+
+    def generate_king_moves(self, king_row, king_col, white):
+        """ Legal moves for the King of the given color, which can't step onto a threatened square
+
+        :return: (list) of moves that are tuples in the format: (from_row, from_col, to_row, to_col)
+        """
+        board = self.board
+        king = board[king_row][king_col]
         moves = []
-        for i in range(len(self.board)):
-            for j in range(len(self.board[0])):
-                piece = self.board[i][j]
-                if piece is not None and piece.white == self.to_play:
-                    piece_moves = piece.generate_legal_moves(self.board, i, j)
-                    for move in piece_moves:
-                        moves.append(move)
+
+        # lift the King off the board so that sliders checking it also see the squares behind it
+        board[king_row][king_col] = None
+        for to_row, to_col in KING_TARGETS[king_row][king_col]:
+            piece = board[to_row][to_col]
+            if (piece is None or piece.white != white) and \
+                    len(attackers_of(board, to_row, to_col, not white)) == 0:
+                moves.append((king_row, king_col, to_row, to_col))
+        board[king_row][king_col] = king
+
         return moves
 
     def only_has_king(self, white):
         """ Return True if the given color only has a King left on the board. """
-        count = 0
-        for i in range(len(self.board)):
-            for j in range(len(self.board[0])):
-                piece = self.board[i][j]
-                if piece is None:
-                    continue
-                if piece.white == white and not isinstance(piece, King):
-                    return False
-                elif piece.white == white:
-                    count += 1
-        return count == 1
+        return self.num_pieces[white] == 1 and self.king_squares[white] is not None
 
     def get_fen(self):
-        h = ''
-        empty_spaces = 0
-
-        for i in range(len(self.board)):
-            for j in range(len(self.board[0])):
-                piece = self.board[7 - i][j]
-                if piece is None:
-                    empty_spaces += 1
-                else:
-                    if empty_spaces > 0:
-                        h += str(empty_spaces)
-                        empty_spaces = 0
-                    h += str(piece)
-                    empty_spaces = 0
-            if empty_spaces > 0:
-                h += str(empty_spaces)
-                empty_spaces = 0
-
-            if i < len(self.board) - 1:
-                h += '/'
-
-        if self.to_play:
-            h += ' 1'
+        """ Short FEN of the board and the side to play, see to_fen for the whole state """
+        return board_to_fen(self.board) + (' 1' if self.to_play else ' 0')
+
+    def to_fen(self):
+        """ FEN of the whole game state, which from_fen turns back into an equal model """
+        shak_sequences = ('W' if self.shak_sequence_white else '') + ('B' if self.shak_sequence_black else '')
+        if self.last_moved_from is None or self.last_moved_to is None:
+            last_move = NO_FEN_VALUE
         else:
-            h += ' 0'
-        return h
+            last_move = square_name(*self.last_moved_from) + square_name(*self.last_moved_to)
+        return ' '.join([board_to_fen(self.board), '1' if self.to_play else '0', shak_sequences or NO_FEN_VALUE,
+                         str(self.moves_since_last_capture), str(self.total_moves), last_move])
+
+    @classmethod
+    def from_fen(cls, fen, bitboards=False):
+        """ Model of a position given by to_fen or get_fen
+
+        :param fen: FEN, any fields after the board can be left out
+        :param bitboards: True to run the model on bitboards
+        :return: ShatarModel
+        """
+        fields = fen.split()
+        if not 1 <= len(fields) <= FEN_FIELDS:
+            raise ValueError("FEN needs between 1 and 6 fields: " + fen)
+        fields += [None] * (FEN_FIELDS - len(fields))
+        board, to_play, shak_sequences, moves_since_last_capture, total_moves, last_move = fields
+
+        if to_play not in (None, '0', '1'):
+            raise ValueError("FEN side to play must be 1 or 0: " + fen)
+        model = cls(board=fen_to_board(board), to_play=to_play != '0', bitboards=bitboards)
+        if shak_sequences is not None and shak_sequences != NO_FEN_VALUE:
+            if not set(shak_sequences) <= {'W', 'B'}:
+                raise ValueError("FEN shak sequences must be W, B, WB or -: " + fen)
+            model.shak_sequence_white = 'W' in shak_sequences
+            model.shak_sequence_black = 'B' in shak_sequences
+        try:
+            if moves_since_last_capture is not None:
+                model.moves_since_last_capture = int(moves_since_last_capture)
+            if total_moves is not None:
+                model.total_moves = int(total_moves)
+        except ValueError:
+            raise ValueError("FEN move counts must be numbers: " + fen) from None
+        if last_move == NO_FEN_VALUE:
+            model.last_moved_from = model.last_moved_to = None
+        elif last_move is not None:
+            if len(last_move) != 4:
+                raise ValueError("FEN last move must be like d7d5: " + fen)
+            model.last_moved_from = parse_square(last_move[:2])
+            model.last_moved_to = parse_square(last_move[2:])
+
+        model.zobrist_key = model.compute_zobrist_key()
+        return model
+
+    @classmethod
+    def from_fens(cls, fens, bitboards=False):
+        """ Models of many FENs, see from_fen. batch_eval.encode_fens turns FENs into packed arrays instead """
+        return [cls.from_fen(fen, bitboards=bitboards) for fen in fens]
 
     def __hash__(self):
-        return hash(self.get_fen())
+        return self.zobrist_key
 
 
 TOUGH_BOARD = [[King(), None, None, None, None, None, None, None],
@@ -1,7 +1,8 @@
 import pygame
 from shatarview import ShatarView, get_square_under_mouse, draw_drag
 from shatar import ShatarModel, fen_to_board
-from basic_ai import MCTSPlayer, GreedyPlayer, PacifistPlayer, RandomPlayer, count_material_evaluation
+from basic_ai import MCTSPlayer, GreedyPlayer, PacifistPlayer, RandomPlayer
+from gamerecord import GameRecord
 from time import sleep
 from shatarview import TILESIZE
 
@@ -18,6 +19,13 @@ def win_statement(num):
         print('White wins!')
 
 
+def retained_statement(player):
+    # players that reuse their search tree between moves say how much of it they kept
+    retained_nodes = getattr(player, 'retained_nodes', None)
+    if retained_nodes is not None:
+        print('reused ' + str(retained_nodes) + ' nodes of the previous search tree')
+
+
 def score_statement(score):
     # print the score / who is winning
     # negative score means black is winning
@@ -34,6 +42,8 @@ class ShatarController(object):
 
     def __init__(self, model):
         self.model = model
+        # GameRecord of the last simulated game
+        self.record = None
 
     def play_game(self, white_player, black_player):
         white_playable = white_player is None
@@ -61,7 +71,8 @@ class ShatarController(object):
                 self.model.move(move[0], move[1], move[2], move[3])
                 board = self.model.get_board()
                 print('white move took ' + str(clock.get_rawtime() / 1000) + ' seconds')
-                score = count_material_evaluation(self.model.get_board())
+                retained_statement(white_player)
+                score = self.model.material
                 score_statement(score)
             elif not self.model.to_play and not black_playable:
                 clock.tick()
@@ -71,7 +82,8 @@ class ShatarController(object):
                 self.model.move(move[0], move[1], move[2], move[3])
                 board = self.model.get_board()
                 print('black move took ' + str(clock.get_rawtime() / 1000) + ' seconds')
-                score = count_material_evaluation(self.model.get_board())
+                retained_statement(black_player)
+                score = self.model.material
                 score_statement(score)
 
             piece, x, y = get_square_under_mouse(self.model.get_board())
@@ -122,8 +134,15 @@ class ShatarController(object):
             pygame.display.flip()
             clock.tick(10)
 
-    def simulate_game(self, white_player, black_player):
+    def simulate_game(self, white_player, black_player, writer=None):
+        """ Play a game between two AIs from the controller's position without the view
+
+        :param writer: GameWriter that the finished game is written to, or None. The record of the game is kept
+            in self.record either way
+        :return: is_game_over result of the game
+        """
         sim_model = ShatarModel(board=self.model.get_board(), to_play=self.model.to_play)
+        self.record = GameRecord.from_model(sim_model, type(white_player).__name__, type(black_player).__name__)
         prev_score = 0
 
         while sim_model.is_game_over() == 2:
@@ -137,7 +156,8 @@ class ShatarController(object):
                 continue
 
             sim_model.move(move[0], move[1], move[2], move[3])
-            score = count_material_evaluation(sim_model.get_board())
+            self.record.record(move)
+            score = sim_model.material
 
             # only print when the score changes
             if score != prev_score:
@@ -148,10 +168,13 @@ class ShatarController(object):
 
         win_statement(sim_model.is_game_over())
 
+        self.record.finish(sim_model.is_game_over())
+        if writer is not None:
+            writer.write(self.record)
         return sim_model.is_game_over()
 
 
-def simulate_n_games(white_player, black_player, n):
+def simulate_n_games(white_player, black_player, n, writer=None):
     white_win = 0
     black_win = 0
     draw = 0
@@ -159,7 +182,7 @@ def simulate_n_games(white_player, black_player, n):
     for i in range(n):
         model = ShatarModel()
         controller = ShatarController(model)
-        w = controller.simulate_game(white_player, black_player)
+        w = controller.simulate_game(white_player, black_player, writer)
         if w == 1:
             white_win += 1
         elif w == 0:
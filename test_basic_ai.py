@@ -0,0 +1,35 @@
+import random
+import unittest
+
+from basic_ai import MCTSPlayer
+from shatar import ShatarModel
+
+
+class MCTSPlayerTreeReuseTest(unittest.TestCase):
+
+    def test_old_tree_is_released_when_opponents_move_was_not_expanded(self):
+        random.seed(0)
+        model = ShatarModel()
+        player = MCTSPlayer(white=True, random_rollout=True)
+        player.set_simulation_number(200)
+        model.move(*player.get_move(model))
+
+        old_root = player.root
+        old_children = list(old_root.children)
+        self.assertGreater(len(old_children), 0)
+        expanded = {child.parent_action for child in old_children}
+        reply = next(move for move in model.generate_legal_moves() if move not in expanded)
+        model.move(*reply)
+
+        player.get_move(model)
+
+        self.assertIsNot(player.root, old_root)
+        self.assertEqual(player.retained_nodes, 0)
+        self.assertEqual(old_root.children, [])
+        for child in old_children:
+            self.assertIsNone(child.parent)
+            self.assertEqual(child.children, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
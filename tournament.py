@@ -0,0 +1,335 @@
+import argparse
+import json
+import math
+import multiprocessing
+import random
+import time
+
+from alphabeta import AlphaBetaPlayer
+from basic_ai import MCTSPlayer, GreedyPlayer, PacifistPlayer, RandomPlayer
+from evaluation import TAPERED_EVALUATOR
+from shatar import ShatarModel
+
+# Plays matches between two engines without the pygame view, spread over a process pool. Every game gets
+# freshly made players, so no search tree or cache is carried from one game to the next, and its own seed, so
+# any game can be replayed on its own. Games come in pairs that start from the same opening with the engines
+# swapping colors.
+#
+# Results are from the point of view of the first engine (A): 1 for a win, 0.5 for a draw and 0 for a loss.
+
+# sequential probability ratio test defaults: is A at least SPRT_ELO1 stronger (H1) or no stronger (H0)?
+SPRT_ELO0 = 0
+SPRT_ELO1 = 10
+SPRT_ALPHA = 0.05
+SPRT_BETA = 0.05
+
+# z score of a two sided 95% confidence interval
+CONFIDENCE_Z = 1.96
+# smallest per game score variance the test uses, so a match where every game so far ended the same way can
+# still be decided
+MIN_SCORE_VARIANCE = 0.01
+
+# what the sequential probability ratio test has decided so far
+H0_ACCEPTED = 'H0'
+H1_ACCEPTED = 'H1'
+UNDECIDED = None
+
+
+class Engine(object):
+    """ A named way of making players, which is sent to the pool workers and called once per game and color
+
+    Attributes:
+        name (str): name used in the results
+        factory (callable): called as factory(white=..., **kwargs) to make a ShatarAI. It has to be a class or a
+            function at module level, so that it can be pickled for the workers
+        kwargs (dict): extra arguments for the factory
+    """
+
+    def __init__(self, name, factory, **kwargs):
+        self.name = name
+        self.factory = factory
+        self.kwargs = kwargs
+
+    def create(self, white):
+        return self.factory(white=white, **self.kwargs)
+
+
+def mcts_player(white, simulations=100, time_limit=None, random_rollout=False, **kwargs):
+    """ MCTSPlayer with its search budget set. Players are made inside pool workers, which can't start a pool
+    of their own, so workers has to stay at 1 """
+    player = MCTSPlayer(white, random_rollout, **kwargs)
+    player.set_simulation_number(simulations)
+    player.set_time_limit(time_limit)
+    return player
+
+
+ENGINES = {
+    'random': Engine('random', RandomPlayer),
+    'pacifist': Engine('pacifist', PacifistPlayer),
+    'greedy': Engine('greedy', GreedyPlayer),
+    'mcts': Engine('mcts', mcts_player),
+    'alphabeta': Engine('alphabeta', AlphaBetaPlayer, max_depth=3),
+    # the same engines with the tapered piece-square evaluation
+    'greedy-pst': Engine('greedy-pst', GreedyPlayer, evaluator=TAPERED_EVALUATOR),
+    'mcts-pst': Engine('mcts-pst', mcts_player, evaluator=TAPERED_EVALUATOR),
+    'alphabeta-pst': Engine('alphabeta-pst', AlphaBetaPlayer, max_depth=3, evaluator=TAPERED_EVALUATOR),
+}
+
+
+def random_openings(count, plies, seed=None):
+    """ Openings of random legal moves from the starting position
+
+    :param count: number of openings
+    :param plies: moves in each opening
+    :param seed: seed of the random moves, or None for a different set every time
+    :return: (list) of openings, each a list of (from_row, from_col, to_row, to_col) moves, none of which end
+        the game
+    """
+    rng = random.Random(seed)
+    openings = []
+    while len(openings) < count:
+        model = ShatarModel()
+        opening = []
+        while len(opening) < plies and model.is_game_over() == 2:
+            move = rng.choice(model.generate_legal_moves())
+            model.move(*move)
+            opening.append(move)
+        if model.is_game_over() == 2:
+            openings.append(opening)
+    return openings
+
+
+def play_game(white_player, black_player, opening=(), bitboards=False):
+    """ Play one game between two players from the opening
+
+    :param opening: moves played from the starting position before the players take over
+    :param bitboards: True to play the game on a model that generates its moves on bitboards
+    :return: (result, moves) with the is_game_over result (1 white won, -1 black won, 0 draw) and every move
+        of the game, the opening included
+    """
+    model = ShatarModel(bitboards=bitboards)
+    moves = []
+    for move in opening:
+        model.move(*move)
+        moves.append(tuple(move))
+
+    while model.is_game_over() == 2:
+        player = white_player if model.to_play else black_player
+        move = player.get_move(model)
+        if move is None:
+            raise ValueError("Player returned no move in a game that isn't over")
+        model.move(*move)
+        moves.append(move)
+    return model.is_game_over(), moves
+
+
+def play_tournament_game(job):
+    """ Play one game of a match in a pool worker
+
+    :param job: (game number, engine A, engine B, whether A is white, opening number, opening, seed, bitboards)
+    :return: dict with the game's record, which is one line of the results file
+    """
+    game, engine_a, engine_b, a_is_white, opening_number, opening, seed, bitboards = job
+    random.seed(seed)
+    white_engine, black_engine = (engine_a, engine_b) if a_is_white else (engine_b, engine_a)
+    white_player = white_engine.create(True)
+    black_player = black_engine.create(False)
+
+    start = time.time()
+    try:
+        result, moves = play_game(white_player, black_player, opening, bitboards)
+    finally:
+        for player in (white_player, black_player):
+            close = getattr(player, 'close', None)
+            if close is not None:
+                close()
+
+    if result == 0:
+        score = 0.5
+    else:
+        score = 1 if (result == 1) == a_is_white else 0
+    return {'game': game, 'white': white_engine.name, 'black': black_engine.name, 'opening': opening_number,
+            'seed': seed, 'result': result, 'score': score, 'plies': len(moves),
+            'moves': [list(move) for move in moves], 'seconds': round(time.time() - start, 3)}
+
+
+def elo_difference(score):
+    """ Elo difference that gives the expected score, infinite at a score of 0 or 1 """
+    if score <= 0:
+        return float('-inf')
+    if score >= 1:
+        return float('inf')
+    return -400 * math.log10(1 / score - 1)
+
+
+def expected_score(elo):
+    """ Inverse of elo_difference """
+    return 1 / (1 + 10 ** (-elo / 400))
+
+
+class MatchScore(object):
+    """ Wins, draws and losses of engine A so far, with the statistics that are reported about them """
+
+    def __init__(self):
+        self.wins = 0
+        self.draws = 0
+        self.losses = 0
+
+    def add(self, score):
+        if score == 1:
+            self.wins += 1
+        elif score == 0:
+            self.losses += 1
+        else:
+            self.draws += 1
+
+    @property
+    def games(self):
+        return self.wins + self.draws + self.losses
+
+    def score(self):
+        """ Mean score per game """
+        return (self.wins + 0.5 * self.draws) / self.games
+
+    def variance(self):
+        """ Variance of the score of one game """
+        mean = self.score()
+        return (self.wins * (1 - mean) ** 2 + self.draws * (0.5 - mean) ** 2 + self.losses * mean ** 2) / self.games
+
+    def elo(self):
+        """ Elo difference of A over B, with the half width of its 95% confidence interval. The margin is the
+        score's error scaled by the slope of elo_difference at the mean score (the delta method), so it stays
+        finite for lopsided but not perfect scores, where the score interval reaches past 0 or 1
+
+        :return: (elo, margin)
+        """
+        mean = self.score()
+        if mean <= 0 or mean >= 1:
+            return elo_difference(mean), float('inf')
+        error = CONFIDENCE_Z * math.sqrt(self.variance() / self.games)
+        slope = 400 / (math.log(10) * mean * (1 - mean))
+        return elo_difference(mean), slope * error
+
+    def llr(self, elo0=SPRT_ELO0, elo1=SPRT_ELO1):
+        """ Log likelihood ratio of A being elo1 over B against being elo0 over B, with a normal approximation
+        of the game scores """
+        if self.games == 0:
+            return 0
+        variance = max(self.variance(), MIN_SCORE_VARIANCE)
+        s0 = expected_score(elo0)
+        s1 = expected_score(elo1)
+        total = self.wins + 0.5 * self.draws
+        return (s1 - s0) * (2 * total - self.games * (s0 + s1)) / (2 * variance)
+
+    def sprt(self, elo0=SPRT_ELO0, elo1=SPRT_ELO1, alpha=SPRT_ALPHA, beta=SPRT_BETA):
+        """ Decision of the sequential probability ratio test
+
+        :return: H1_ACCEPTED, H0_ACCEPTED or UNDECIDED
+        """
+        llr = self.llr(elo0, elo1)
+        if llr >= math.log((1 - beta) / alpha):
+            return H1_ACCEPTED
+        if llr <= math.log(beta / (1 - alpha)):
+            return H0_ACCEPTED
+        return UNDECIDED
+
+    def __str__(self):
+        if self.games == 0:
+            return 'no games played'
+        elo, margin = self.elo()
+        return f'{self.games} games: +{self.wins} ={self.draws} -{self.losses}, ' \
+               f'score {self.score():.3f}, Elo {elo:+.1f} +/- {margin:.1f}'
+
+
+def tournament_jobs(engine_a, engine_b, games, openings=None, seed=0, bitboards=False):
+    """ Jobs for play_tournament_game. Game 2k and 2k + 1 share an opening, A is white in the first of them """
+    for game in range(games):
+        if openings:
+            opening_number = (game // 2) % len(openings)
+            opening = openings[opening_number]
+        else:
+            opening_number = None
+            opening = []
+        yield game, engine_a, engine_b, game % 2 == 0, opening_number, opening, seed + game, bitboards
+
+
+def run_tournament(engine_a, engine_b, games, workers=1, openings=None, seed=0, output=None, sprt=None,
+                   verbose=True, bitboards=False):
+    """ Play a match between two engines
+
+    :param engine_a: Engine whose results are reported
+    :param engine_b: Engine it plays against
+    :param games: most games to play
+    :param workers: processes to play games in, 1 plays them in this process
+    :param openings: (list) of openings, each a list of moves, or None to start every game from the start
+    :param seed: seed of the first game, game n gets seed + n
+    :param output: path of a JSONL file that gets one line per finished game, or None
+    :param sprt: None, or a dict of sprt arguments (elo0, elo1, alpha, beta) to stop the match once the test
+        decides
+    :param verbose: print the standings after every game
+    :param bitboards: True to play the games on models that generate their moves on bitboards
+    :return: MatchScore of engine A
+    """
+    if games < 1:
+        raise ValueError("A tournament needs at least one game")
+    if workers < 1:
+        raise ValueError("A tournament needs at least one worker")
+
+    match_score = MatchScore()
+    jobs = tournament_jobs(engine_a, engine_b, games, openings, seed, bitboards)
+    results_file = None if output is None else open(output, 'w')
+    pool = None if workers == 1 else multiprocessing.Pool(workers)
+    try:
+        records = map(play_tournament_game, jobs) if pool is None else \
+            pool.imap_unordered(play_tournament_game, jobs)
+        for record in records:
+            match_score.add(record['score'])
+            if results_file is not None:
+                results_file.write(json.dumps(record) + '\n')
+                results_file.flush()
+            if verbose:
+                print(f'game {record["game"]} {record["white"]} - {record["black"]}: {record["result"]}, '
+                      f'{match_score}')
+
+            if sprt is not None:
+                decision = match_score.sprt(**sprt)
+                if decision is not UNDECIDED:
+                    if verbose:
+                        print(f'SPRT accepted {decision} after {match_score.games} games '
+                              f'(LLR {match_score.llr(sprt.get("elo0", SPRT_ELO0), sprt.get("elo1", SPRT_ELO1)):.2f})')
+                    break
+    finally:
+        if pool is not None:
+            # stops the games still being played after an early stop
+            pool.terminate()
+            pool.join()
+        if results_file is not None:
+            results_file.close()
+    return match_score
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Play a match between two engines')
+    parser.add_argument('engine_a', choices=sorted(ENGINES))
+    parser.add_argument('engine_b', choices=sorted(ENGINES))
+    parser.add_argument('--games', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--openings', type=int, default=0, help='number of random openings, 0 for none')
+    parser.add_argument('--opening-plies', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='JSONL file for the game records')
+    parser.add_argument('--sprt', action='store_true', help='stop once the SPRT decides')
+    parser.add_argument('--elo0', type=float, default=SPRT_ELO0)
+    parser.add_argument('--elo1', type=float, default=SPRT_ELO1)
+    parser.add_argument('--bitboards', action='store_true', help='generate moves on bitboards, which is faster')
+    args = parser.parse_args()
+
+    openings = random_openings(args.openings, args.opening_plies, args.seed) if args.openings else None
+    sprt = {'elo0': args.elo0, 'elo1': args.elo1} if args.sprt else None
+    match_score = run_tournament(ENGINES[args.engine_a], ENGINES[args.engine_b], args.games, args.workers,
+                                 openings, args.seed, args.output, sprt, bitboards=args.bitboards)
+    print(f'{args.engine_a} vs {args.engine_b}: {match_score}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+from collections import OrderedDict
+
+# what can be stored for a position, used as indices into an entry
+LEGAL_MOVES = 0
+GAME_OVER = 1
+EVALUATION = 2
+DEPTH = 3
+GENERATION = 4
+
+# replacement policies
+LRU = 'lru'
+DEPTH_PREFERRED = 'depth'
+
+# rough size in bytes of one entry, which is mostly a list of ~30 legal move tuples (measured at 2.2 KB over
+# random games). Used to turn a byte budget into a number of entries
+ENTRY_SIZE_ESTIMATE = 2048
+# memory a table may use when no size is given, 16384 entries. That is more positions than a search of a few
+# thousand rollouts or a depth 3 alpha-beta search touches, so the default only bounds memory
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+
+
+class TranspositionTable(object):
+    """ Fixed capacity cache of things computed for a position, keyed by the position's Zobrist key.
+
+    Each entry can hold the legal moves, the is_game_over result and the alpha-beta search result of one
+    position. Once the table is full, storing a new position evicts an old one:
+        LRU: the least recently used position is evicted
+        DEPTH_PREFERRED: positions hash to a fixed slot, and a new position only replaces the one in its
+            slot if it was stored with at least the same depth (so results from deeper searches survive) or
+            was last stored before the latest new_search call (so old deep results don't fill the table for
+            the rest of the game)
+
+    Attributes:
+        capacity (int): maximum number of positions kept, max_bytes // ENTRY_SIZE_ESTIMATE if only a byte budget
+            is given and DEFAULT_MAX_BYTES worth if neither is
+        policy (str): LRU or DEPTH_PREFERRED
+        hits (int): number of get calls that found a value
+        misses (int): number of get calls that found nothing
+        evictions (int): number of positions thrown out to make room for another one
+        generation (int): number of new_search calls so far, stored with every entry
+    """
+
+    def __init__(self, capacity=None, max_bytes=None, policy=LRU):
+        if policy not in (LRU, DEPTH_PREFERRED):
+            raise ValueError("Unknown replacement policy: " + str(policy))
+        if capacity is None:
+            capacity = (DEFAULT_MAX_BYTES if max_bytes is None else max_bytes) // ENTRY_SIZE_ESTIMATE
+        if capacity < 1:
+            raise ValueError("Transposition table needs room for at least one entry")
+
+        self.capacity = capacity
+        self.policy = policy
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.generation = 0
+
+        if policy == LRU:
+            self.entries = OrderedDict()
+        else:
+            # each slot is None or a (key, entry) pair
+            self.slots = [None] * capacity
+            self.size = 0
+
+    def find_entry(self, key):
+        """ Entry stored for the given key, or None """
+        if self.policy == LRU:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+        slot = self.slots[key % self.capacity]
+        if slot is not None and slot[0] == key:
+            return slot[1]
+        return None
+
+    def get(self, key, field):
+        """ Get a stored value for a position
+
+        :param key: hash of the position
+        :param field: LEGAL_MOVES, GAME_OVER or EVALUATION
+        :return: the stored value or None
+        """
+        entry = self.find_entry(key)
+        if entry is None or entry[field] is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[field]
+
+    def put(self, key, field, value, depth=0):
+        """ Store a value for a position, evicting another position if the table is full
+
+        :param key: hash of the position
+        :param field: LEGAL_MOVES, GAME_OVER or EVALUATION
+        :param value: value to store
+        :param depth: how much search went into the value, only used by DEPTH_PREFERRED
+        """
+        entry = self.find_entry(key)
+        if entry is not None:
+            entry[field] = value
+            entry[DEPTH] = max(entry[DEPTH], depth)
+            entry[GENERATION] = self.generation
+            return
+
+        entry = [None, None, None, depth, self.generation]
+        entry[field] = value
+
+        if self.policy == LRU:
+            if len(self.entries) >= self.capacity:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+            self.entries[key] = entry
+            return
+
+        index = key % self.capacity
+        slot = self.slots[index]
+        if slot is None:
+            self.size += 1
+        elif depth >= slot[1][DEPTH] or slot[1][GENERATION] != self.generation:
+            self.evictions += 1
+        else:
+            # keep the deeper entry of this search that is already there
+            return
+        self.slots[index] = (key, entry)
+
+    def new_search(self):
+        """ Start a new search, after which DEPTH_PREFERRED replaces the entries of earlier searches whatever
+        their depth. Their values can still be read until they are replaced """
+        self.generation += 1
+
+    def clear(self):
+        """ Remove every entry and reset the counters """
+        if self.policy == LRU:
+            self.entries.clear()
+        else:
+            self.slots = [None] * self.capacity
+            self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        if self.policy == LRU:
+            return len(self.entries)
+        return self.size
+
+    def stats(self):
+        """ Counters describing how well the table is working
+
+        :return: (dict) with entries, capacity, hits, misses, evictions and hit_rate
+        """
+        lookups = self.hits + self.misses
+        return {'entries': len(self), 'capacity': self.capacity, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'hit_rate': self.hits / lookups if lookups > 0 else 0}
@@ -0,0 +1,50 @@
+import random
+
+### ZOBRIST HASHING:
+# https://en.wikipedia.org/wiki/Zobrist_hashing
+# https://levelup.gitconnected.com/zobrist-hashing-305c6c3c54d0
+
+# A position's key is the XOR of one random 64-bit number per (piece, square) on the board plus one number
+# for each extra bit of game state that is set. ShatarModel keeps its key up to date by XORing the numbers
+# for whatever changed on every move, so hashing a model never has to look at the whole board.
+
+# fixed seed so that every process (e.g. pool workers or a later run) builds the same keys
+_rng = random.Random(0x5AA7A2)
+
+SYMBOLS = 'PNBRQKpnbrqk'
+
+# PIECE_KEYS[symbol][row * 8 + col]
+PIECE_KEYS = {symbol: [_rng.getrandbits(64) for _ in range(64)] for symbol in SYMBOLS}
+
+BLACK_TO_PLAY_KEY = _rng.getrandbits(64)
+SHAK_SEQUENCE_WHITE_KEY = _rng.getrandbits(64)
+SHAK_SEQUENCE_BLACK_KEY = _rng.getrandbits(64)
+
+# the capture clock only changes the result of is_game_over once it reaches the draw limit, so the clock is
+# hashed as one of two buckets (under the limit or not) instead of its exact value
+CAPTURE_CLOCK_KEY = _rng.getrandbits(64)
+
+
+def capture_clock_bucket(moves_since_last_capture, limit):
+    """ Bucket of the capture clock that goes into the key
+
+    :param moves_since_last_capture: the model's capture clock
+    :param limit: number of moves without a capture that draws the game
+    :return: (boolean) True if the clock is at or past the limit
+    """
+    return moves_since_last_capture >= limit
+
+
+def board_key(board):
+    """ Key of the pieces on a 2d board, without any of the other game state
+
+    :param board: (2d array) shatar board
+    :return: (int) 64-bit key
+    """
+    key = 0
+    for i in range(8):
+        for j in range(8):
+            piece = board[i][j]
+            if piece is not None:
+                key ^= PIECE_KEYS[piece.symbol][i * 8 + j]
+    return key